@@ -0,0 +1,414 @@
+import re
+import csv
+from collections import OrderedDict
+
+from django import forms
+from django.db import transaction
+from django.db.models import Case, When, Value
+from django.utils import timezone
+from django.core.exceptions import ValidationError
+
+from .models import Sample, SampleTag, Project, Term, Tag, ObjectPermissionError, record_tombstones
+from .utils.geometry import validate_wkt, wkt_bounds
+from .widgets.data_widget import filter_queryset_for_user
+
+_RE_SLUG_SUFFIX = re.compile(r'^(.*)__([0-9]+)$')
+
+
+class ImportValidationError(ValidationError):
+
+    def __init__(self, errors, new_terms=()):
+        self.import_errors = errors
+        # columns that don't match an existing term (these are created when the file is imported)
+        self.new_terms = list(new_terms)
+        super().__init__(['Line %s, column "%s": %s' % (line, column, ' '.join(messages))
+                          for line, column, messages in errors])
+
+
+class SlugAllocator:
+    """
+    Allocates unique slugs for many new objects at once, following the same rules as
+    BaseObjectModel.calculate_slug(): the slug base truncated to 55 characters, or, if that is
+    taken, the slug base truncated to fit a '__N' suffix where N is one more than the largest
+    suffix in use. Slugs allocated by this object are remembered, so that one allocator can
+    be used for several batches that are written one after the other.
+    """
+
+    def __init__(self, queryset, max_length=55):
+        self.queryset = queryset
+        self.max_length = max_length
+        self.used = set()
+        self.next_suffix = {}
+
+    def _suffixed(self, slug_base, suffix_index):
+        suffix = '__%d' % suffix_index
+        return slug_base[:(self.max_length - len(suffix))] + suffix
+
+    def _max_suffix(self, slug_base):
+        # long slug bases are truncated further for longer suffixes
+        stem = slug_base[:(self.max_length - 10)]
+        max_suffix = 0
+        for slug in self.queryset.filter(slug__startswith=stem).values_list('slug', flat=True).iterator():
+            match = _RE_SLUG_SUFFIX.match(slug)
+            if match and slug == self._suffixed(slug_base, int(match.group(2))):
+                max_suffix = max(max_suffix, int(match.group(2)))
+        return max_suffix
+
+    def matches(self, slug, slug_base):
+        """Checks if slug could have been allocated for slug_base (with or without a suffix)"""
+        if slug == slug_base[:self.max_length]:
+            return True
+        match = _RE_SLUG_SUFFIX.match(slug)
+        return bool(match) and slug == self._suffixed(slug_base, int(match.group(2)))
+
+    def allocate(self, slug_bases):
+        """Returns a list of unique slugs, one for each item in slug_bases"""
+        candidates = [slug_base[:self.max_length] for slug_base in slug_bases]
+
+        # one query to find which unsuffixed slugs are taken
+        new_candidates = set(candidates).difference(self.used)
+        taken = set(self.queryset.filter(slug__in=new_candidates).values_list('slug', flat=True))
+        self.used.update(taken)
+
+        slugs = []
+        for slug_base, candidate in zip(slug_bases, candidates):
+            if candidate not in self.used:
+                slug = candidate
+            else:
+                # one query per distinct colliding slug base, then suffixes are counted in memory
+                if slug_base not in self.next_suffix:
+                    self.next_suffix[slug_base] = self._max_suffix(slug_base) + 1
+                slug = self._suffixed(slug_base, self.next_suffix[slug_base])
+                while slug in self.used:
+                    self.next_suffix[slug_base] += 1
+                    slug = self._suffixed(slug_base, self.next_suffix[slug_base])
+                self.next_suffix[slug_base] += 1
+
+            self.used.add(slug)
+            slugs.append(slug)
+
+        return slugs
+
+
+class SampleImporter:
+    """
+    Imports samples from a CSV or TSV file with one sample per row. The columns 'name',
+    'description', 'collected', 'geometry', and 'parent' (the slug of an existing sample) set
+    sample fields; all other columns are tags, with the column header as the term name or slug.
+    Rows are read as a stream and written in batches, each batch using bulk_create() inside its
+    own transaction.
+    """
+    sample_fields = ('name', 'description', 'collected', 'geometry', 'parent')
+    taxonomy = 'Sample'
+
+    def __init__(self, project, user, status='draft', batch_size=1000, delimiter=None, max_errors=100):
+        self.project = project
+        self.user = user
+        self.status = status
+        self.batch_size = batch_size
+        self.delimiter = delimiter
+        self.max_errors = max_errors
+
+        self.terms = OrderedDict()
+        self.new_terms = []
+        self.slug_allocator = SlugAllocator(Sample.objects.all())
+        self.collected_field = forms.DateTimeField(required=False)
+        self.name_field = Sample._meta.get_field('name')
+
+    @staticmethod
+    def guess_delimiter(filename):
+        return '\t' if re.search(r'\.(tsv|tab|txt)$', filename or '', re.IGNORECASE) else ','
+
+    def reader(self, f):
+        return csv.DictReader(f, delimiter=self.delimiter or self.guess_delimiter(getattr(f, 'name', '')))
+
+    def resolve_terms(self, fieldnames, create=True):
+        """
+        Resolves (or creates) the term for each tag column once, before any rows are read. If create
+        is False, columns without a term are listed in new_terms (and their values aren't validated,
+        since a new term has no validators).
+        """
+        self.terms = OrderedDict()
+        self.new_terms = []
+        errors = []
+        for column in fieldnames:
+            if column in self.sample_fields or not column or not column.strip():
+                continue
+            term = Term.get_term(column, self.project, taxonomy=self.taxonomy, create=create)
+            if term is None:
+                self.new_terms.append(column)
+                continue
+            if term.project is not None and term.project != self.project:
+                errors.append((1, column, ['Object project must match term project, '
+                                           'or the term project must be None']))
+            self.terms[column] = term
+        return errors
+
+    def batches(self, reader):
+        batch = []
+        # line 1 is the header
+        for line, row in enumerate(reader, start=2):
+            batch.append((line, row))
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def clean_batch(self, batch):
+        """
+        Validates a batch of rows, returning unsaved samples, a list of (term, value) pairs for each
+        sample, and a list of (line, column, messages) errors.
+        """
+        errors = []
+
+        # one query for all the parents in this batch
+        parent_slugs = set(row.get('parent') or '' for line, row in batch)
+        parent_slugs.discard('')
+        parents = {
+            parent.slug: parent for parent in
+            Sample.objects.filter(project=self.project, slug__in=parent_slugs)
+        } if parent_slugs else {}
+
+        samples = []
+        tags = []
+        now = timezone.now()
+        for line, row in batch:
+            sample = Sample(
+                project=self.project,
+                user=self.user,
+                status=self.status,
+                name=(row.get('name') or '').strip() or 'sample',
+                description=row.get('description') or '',
+                geometry=(row.get('geometry') or '').strip()
+            )
+
+            try:
+                self.name_field.run_validators(sample.name)
+            except ValidationError as e:
+                errors.append((line, 'name', e.messages))
+
+            try:
+                sample.collected = self.collected_field.clean(row.get('collected') or '') or now
+            except ValidationError as e:
+                errors.append((line, 'collected', e.messages))
+
+            try:
+                validate_wkt(sample.geometry)
+            except ValidationError as e:
+                errors.append((line, 'geometry', e.messages))
+
+            parent_slug = row.get('parent') or ''
+            if parent_slug:
+                if parent_slug in parents:
+                    sample.parent = parents[parent_slug]
+                    sample.recursive_depth = sample.parent.recursive_depth + 1
+                else:
+                    errors.append((line, 'parent', ['No sample with ID "%s" in this project' % parent_slug]))
+
+            sample_tags = []
+            for column, term in self.terms.items():
+                value = row.get(column)
+                if value:
+                    sample_tags.append((term, value))
+
+            samples.append(sample)
+            tags.append(sample_tags)
+
+        # tag values are validated one column at a time
+        for column, term in self.terms.items():
+            column_errors = term.validate_values([row.get(column) or '' for line, row in batch])
+            for i, messages in column_errors.items():
+                errors.append((batch[i][0], column, messages))
+
+        # errors are reported in line order
+        errors.sort(key=lambda error: error[0])
+        return samples, tags, errors
+
+    def write_batch(self, samples, tags):
+        for sample, slug in zip(samples, self.slug_allocator.allocate([s.slug_base() for s in samples])):
+            sample.slug = slug
+            bounds = wkt_bounds(sample.geometry)
+            sample.geo_xmin = bounds['xmin']
+            sample.geo_xmax = bounds['xmax']
+            sample.geo_ymin = bounds['ymin']
+            sample.geo_ymax = bounds['ymax']
+
+        with transaction.atomic():
+            Sample.objects.bulk_create(samples)
+
+            # not all database backends set the pk from bulk_create(), but slugs are unique
+            pks = dict(Sample.objects.filter(slug__in=[s.slug for s in samples]).values_list('slug', 'pk'))
+
+            sample_tags = []
+            for sample, sample_tag_values in zip(samples, tags):
+                for term, value in sample_tag_values:
+                    sample_tags.append(SampleTag(
+                        object_id=pks[sample.slug],
+                        key=term,
+                        value=value,
+                        user=self.user,
+                        **Tag.calculate_typed_values(value)
+                    ))
+            SampleTag.objects.bulk_create(sample_tags)
+
+        return len(samples), len(sample_tags)
+
+    def validate(self, f):
+        """
+        Validates every row of f without writing anything (not even new terms), returning a list of
+        errors. Columns that would become new terms are listed in new_terms.
+        """
+        reader = self.reader(f)
+        errors = self.resolve_terms(reader.fieldnames or [], create=False)
+        for batch in self.batches(reader):
+            errors.extend(self.clean_batch(batch)[2])
+            if len(errors) >= self.max_errors:
+                break
+        return errors[:self.max_errors]
+
+    def import_file(self, f):
+        """
+        Imports every row of f, returning the number of samples and tags that were created. A
+        ValidationError is raised for the first batch that contains errors; batches before it
+        have already been written, so use validate() first to avoid partial imports.
+        """
+        reader = self.reader(f)
+        errors = self.resolve_terms(reader.fieldnames or [])
+        if errors:
+            raise ImportValidationError(errors)
+
+        n_samples = n_tags = 0
+        for batch in self.batches(reader):
+            samples, tags, errors = self.clean_batch(batch)
+            if errors:
+                raise ImportValidationError(errors[:self.max_errors])
+            batch_samples, batch_tags = self.write_batch(samples, tags)
+            n_samples += batch_samples
+            n_tags += batch_tags
+
+        Project.objects.filter(pk=self.project.pk).update(modified=timezone.now())
+        return n_samples, n_tags
+
+
+def import_samples(f, project, user, validate=True, **kwargs):
+    """
+    Imports samples from the CSV or TSV file f (opened in text mode), validating the whole file
+    before writing anything if validate is True (which requires that f is seekable).
+    """
+    importer = SampleImporter(project, user, **kwargs)
+    if validate:
+        errors = importer.validate(f)
+        if errors:
+            raise ImportValidationError(errors, new_terms=importer.new_terms)
+        f.seek(0)
+
+    return importer.import_file(f)
+
+
+def check_queryset_permission(queryset, user, permission):
+    """
+    Checks that user has permission for every object in queryset using a single query,
+    raising an ObjectPermissionError for the first object that the user can't access.
+    """
+    if user.is_staff:
+        return
+    allowed = filter_queryset_for_user(queryset.model.objects.all(), user, permission)
+    forbidden = queryset.exclude(pk__in=allowed.values('pk')).first()
+    if forbidden is not None:
+        raise ObjectPermissionError(forbidden)
+
+
+def bulk_delete(queryset):
+    """
+    Deletes the objects in queryset and their tags using a number of queries that doesn't depend on
+    the number of rows (up to Django's delete batch size): one DELETE per many-to-many through table
+    (so that related attachments are unlinked rather than deleted, as in Sample.delete()), then
+    queryset deletes of tags and objects. No delete signals are connected to these models, so tags
+    that nothing refers to are deleted without loading them, and the others are collected by Django
+    in batches rather than one row at a time. A ProtectedError is raised if any of the objects are
+    protected (e.g., samples with children). The tombstones of the deleted objects and tags are
+    written using bulk_create() (see record_tombstones()). Returns the number of objects that were
+    deleted.
+    """
+    model = queryset.model
+    pks = queryset.order_by().values('pk')
+
+    with transaction.atomic():
+        for rel in model._meta.related_objects:
+            if rel.many_to_many:
+                rel.through.objects.filter(**{rel.field.m2m_reverse_field_name() + '__in': pks}).delete()
+
+        if getattr(model, 'tags', None) is not None:
+            bulk_delete(model.tags.rel.related_model.objects.filter(object__in=pks))
+
+        record_tombstones(model.objects.filter(pk__in=pks), tags=False)
+        n_deleted, n_deleted_by_model = model.objects.filter(pk__in=pks).delete()
+
+    return n_deleted_by_model.get(model._meta.label, 0)
+
+
+def finalize_slugs(queryset):
+    """
+    Makes sure the slugs of the samples in queryset match their current slug base before
+    they are published (drafts are re-slugged every time they are saved, but published
+    samples keep their slug). Slugs that already match are kept; the others are allocated
+    together and written with a single UPDATE.
+    """
+    allocator = SlugAllocator(Sample.objects.all())
+    stale = [
+        sample for sample in queryset.select_related('user')
+        if not allocator.matches(sample.slug, sample.slug_base())
+    ]
+    if not stale:
+        return 0
+
+    new_slugs = allocator.allocate([sample.slug_base() for sample in stale])
+    return Sample.objects.filter(pk__in=[sample.pk for sample in stale]).update(
+        slug=Case(*[When(pk=sample.pk, then=Value(slug)) for sample, slug in zip(stale, new_slugs)])
+    )
+
+
+def bulk_set_status(queryset, status, revision=None, batch_size=1000):
+    """
+    Sets the status of the samples in queryset using one UPDATE per batch instead of saving
+    each sample. Draft samples that are published have their slugs finalized first. If a
+    BulkRevision is passed, the changed samples are recorded in it. Returns the number of
+    samples whose status was set.
+    """
+    pks = list(queryset.order_by('pk').values_list('pk', flat=True))
+    now = timezone.now()
+    n_updated = 0
+
+    with transaction.atomic():
+        for start in range(0, len(pks), batch_size):
+            batch = Sample.objects.filter(pk__in=pks[start:(start + batch_size)])
+            if status == 'published':
+                finalize_slugs(batch.exclude(status='published'))
+            n_updated += batch.update(status=status, modified=now)
+            if revision is not None:
+                revision.add_queryset(batch)
+
+        projects = Project.objects.filter(pk__in=Sample.objects.filter(pk__in=pks).values('project'))
+        projects.update(modified=now)
+        if revision is not None:
+            revision.add_queryset(projects)
+
+    return n_updated
+
+
+def iter_pk_chunks(queryset, chunk_size=1000):
+    """
+    Yields the primary keys of the objects in queryset in lists of at most chunk_size, using
+    one query per chunk (keyed on the last primary key, so objects may be changed or deleted
+    between chunks).
+    """
+    queryset = queryset.order_by('pk')
+    last_pk = None
+    while True:
+        chunk = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        pks = list(chunk.values_list('pk', flat=True)[:chunk_size])
+        if not pks:
+            break
+        yield pks
+        last_pk = pks[-1]
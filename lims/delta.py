@@ -0,0 +1,159 @@
+import datetime
+from collections import namedtuple
+
+from django.db.models import Q, F
+from django.utils import timezone
+
+from .models import Project, Tombstone, ProjectPermission, LimsModelField
+from .widgets.data_widget import filter_queryset_for_user
+
+DELTA_EXPORT_LIMIT = 1000
+DELTA_EXPORT_MAX_LIMIT = 10000
+# modified (and deleted) are set when a row is saved, not when its transaction commits, so a row can
+# become visible after rows with later times have been exported. Rows modified in the last
+# DELTA_EXPORT_LAG are left for a later call to give transactions this long to commit. This must be
+# longer than the longest transaction that saves objects, tags, or tombstones: rows saved by a
+# transaction that commits more than DELTA_EXPORT_LAG after they were saved can be missed.
+DELTA_EXPORT_LAG = datetime.timedelta(seconds=60)
+DELTA_EXPORT_MODELS = {
+    'project': 'Project',
+    'sample': 'Sample',
+    'attachment': 'Attachment',
+    'term': 'Term'
+}
+DELTA_STREAMS = ('objects', 'tags', 'deleted')
+
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+class DeltaError(Exception):
+    pass
+
+
+DeltaCursor = namedtuple('DeltaCursor', ['modified', 'id'])
+DeltaCursor.__doc__ = 'A position in a (modified, id) ordered stream of changes'
+DELTA_START = DeltaCursor(None, 0)
+
+
+def format_delta_cursor(cursors):
+    """
+    Encodes the cursor of each stream (see DELTA_STREAMS) as <microseconds since 1970>.<id>,
+    separated by underscores
+    """
+    parts = []
+    for stream in DELTA_STREAMS:
+        cursor = cursors.get(stream, DELTA_START)
+        microseconds = 0
+        if cursor.modified is not None:
+            microseconds = (cursor.modified - _EPOCH) // datetime.timedelta(microseconds=1)
+        parts.append('%d.%d' % (microseconds, cursor.id))
+    return '_'.join(parts)
+
+
+def parse_delta_cursor(value):
+    """Decodes a cursor from format_delta_cursor(). An empty value starts from the beginning."""
+    if not value:
+        return {stream: DELTA_START for stream in DELTA_STREAMS}
+
+    parts = value.split('_')
+    if len(parts) != len(DELTA_STREAMS):
+        raise DeltaError('Invalid cursor: "%s"' % value)
+
+    cursors = {}
+    for stream, part in zip(DELTA_STREAMS, parts):
+        try:
+            microseconds, object_id = (int(item) for item in part.split('.'))
+        except ValueError:
+            raise DeltaError('Invalid cursor: "%s"' % value)
+        modified = None if microseconds == 0 else _EPOCH + datetime.timedelta(microseconds=microseconds)
+        cursors[stream] = DeltaCursor(modified, object_id)
+    return cursors
+
+
+def changed_after(queryset, cursor, field='modified', limit=DELTA_EXPORT_LIMIT):
+    """The first limit rows of queryset after cursor in (field, id) order, using the (field, id) indexes"""
+    if cursor.modified is not None:
+        queryset = queryset.filter(
+            Q(**{field + '__gt': cursor.modified}) | Q(**{field: cursor.modified, 'id__gt': cursor.id})
+        )
+    return queryset.order_by(field, 'id')[:limit]
+
+
+def _advance(cursor, rows, field='modified'):
+    return DeltaCursor(rows[-1][field], rows[-1]['id']) if rows else cursor
+
+
+def delta_export(model, cursor=None, project=None, user=None, limit=DELTA_EXPORT_LIMIT, lag=None):
+    """
+    Returns the objects of model and the tags that changed after cursor (a value from
+    format_delta_cursor(), or None to start from the beginning), and the objects and tags deleted
+    after cursor (from their tombstones), along with the cursor for the next call. Each of these
+    has at most limit rows; 'complete' is False if there are more changes to fetch.
+
+    Objects and tags are limited to those in project and those that user can view, if given.
+    Tombstones of tags whose object was also deleted are only included for staff users with no
+    project, because the tombstone of the object implies them.
+
+    Changes from the last lag (by default, DELTA_EXPORT_LAG) are not included yet. A lag shorter than
+    DELTA_EXPORT_LAG raises a DeltaError, because changes from transactions that were still open
+    could be missed.
+    """
+    lag = DELTA_EXPORT_LAG if lag is None else lag
+    if lag < DELTA_EXPORT_LAG:
+        raise DeltaError('The lag must be at least %s seconds' % DELTA_EXPORT_LAG.total_seconds())
+
+    cursors = cursor if isinstance(cursor, dict) else parse_delta_cursor(cursor)
+    until = timezone.now() - lag
+    tag_model = model._meta.get_field('tags').related_model
+
+    objects = model.objects.all()
+    tags = tag_model.objects.all()
+    if project is not None:
+        objects = objects.filter(pk=project.pk) if model is Project else objects.filter(project=project)
+        tags = tags.filter(object__in=objects.values('pk'))
+    if user is not None:
+        objects = filter_queryset_for_user(objects, user, 'view')
+        tags = filter_queryset_for_user(tags, user, 'view')
+
+    object_fields = [field.attname for field in model._meta.concrete_fields]
+    tag_fields = [field.attname for field in tag_model._meta.concrete_fields]
+
+    deleted = Tombstone.objects.filter(model__in=(model.__name__, tag_model.__name__))
+    if project is not None or (user is not None and not user.is_staff):
+        object_tombstones = Q(model=model.__name__)
+        if project is not None:
+            object_tombstones &= Q(project_id=project.pk)
+        if user is not None and not user.is_staff:
+            object_tombstones &= Q(project_id__in=ProjectPermission.objects.filter(
+                user=user, permission='view', model=model.__name__
+            ).values('project_id'))
+        tag_tombstones = Q(model=tag_model.__name__, parent_id__in=objects.values('pk'))
+        deleted = deleted.filter(object_tombstones | tag_tombstones)
+
+    rows = {
+        'objects': list(changed_after(objects.filter(modified__lte=until), cursors['objects'], limit=limit)
+                        .values(*object_fields)),
+        'tags': list(changed_after(tags.filter(modified__lte=until), cursors['tags'], limit=limit)
+                     .values(*tag_fields, term=F('key__slug'))),
+        'deleted': list(changed_after(deleted.filter(deleted__lte=until), cursors['deleted'], 'deleted', limit)
+                        .values('id', 'model', 'object_id', 'parent_id', 'project_id', 'deleted')),
+    }
+
+    next_cursors = {
+        'objects': _advance(cursors['objects'], rows['objects']),
+        'tags': _advance(cursors['tags'], rows['tags']),
+        'deleted': _advance(cursors['deleted'], rows['deleted'], 'deleted')
+    }
+    return dict(
+        rows,
+        model=model.__name__,
+        cursor=format_delta_cursor(next_cursors),
+        complete=all(len(items) < limit for items in rows.values())
+    )
+
+
+def resolve_delta_model(name):
+    """The model for a delta export URL (e.g., 'sample')"""
+    if name not in DELTA_EXPORT_MODELS:
+        raise DeltaError('Delta exports are not available for "%s"' % name)
+    return LimsModelField.get_model(DELTA_EXPORT_MODELS[name])
@@ -0,0 +1,611 @@
+import io
+import os
+import csv
+import json
+import struct
+import sqlite3
+import tempfile
+from collections import deque
+from itertools import islice, groupby
+from operator import itemgetter
+from multiprocessing import get_context
+from concurrent.futures import ProcessPoolExecutor
+
+from django.apps import apps
+from django.core.files import File
+from django.db import connections
+from django.db.models import ForeignKey
+from django.utils import timezone
+
+from .models import Term, TermValidator, SelectionSet
+from .bulk import iter_pk_chunks
+from .jobs import register_job
+from .utils.tag_values import has_tags
+from .utils.geometry import WKTError, parse_wkt, geometry_wkb, geometry_bounds
+from .workers import setup_worker, in_worker
+
+SAMPLE_EXPORT_FIELDS = ('id', 'slug', 'user', 'name', 'description', 'collected')
+# terms with these validators are exported as numbers by typed exports
+NUMERIC_TERM_VALIDATORS = ('Float', 'Integer')
+EXPORT_CHUNK_SIZE = 5000
+
+
+class ExportError(Exception):
+    pass
+
+
+def format_export_value(item, target_tz=None):
+    if hasattr(item, 'strftime'):
+        target_tz = target_tz if target_tz is not None else timezone.get_default_timezone()
+        return item.astimezone(target_tz).strftime('%Y-%m-%dT%H:%M%z')
+    else:
+        return str(item)
+
+
+def export_header(fields, terms):
+    return list(fields) + [term.slug for term in terms]
+
+
+def unique_export_header(fields, terms, reserved=()):
+    """
+    export_header() for formats whose column names must be unique regardless of case (GeoPackage
+    columns and GeoJSON properties): term columns that would repeat a field, a name in reserved, or
+    an earlier term column are prefixed with tag_ (and numbered if that is also taken)
+    """
+    header = list(fields)
+    taken = {name.lower() for name in list(reserved) + header}
+    for term in terms:
+        name = term.slug
+        number = 1
+        while name.lower() in taken:
+            name = 'tag_' + term.slug if number == 1 else 'tag_%s_%d' % (term.slug, number)
+            number += 1
+        taken.add(name.lower())
+        header.append(name)
+    return header
+
+
+def typed_export_value(item, target_tz=None):
+    """Values for formats with typed cells: numbers as numbers, and date/times as naive local date/times"""
+    if item is None or isinstance(item, (bool, int, float)):
+        return item
+    elif hasattr(item, 'strftime'):
+        target_tz = target_tz if target_tz is not None else timezone.get_default_timezone()
+        return timezone.make_naive(item, target_tz) if timezone.is_aware(item) else item
+    else:
+        return str(item)
+
+
+def _is_number_text(value, numeric_value):
+    """True if value is written the way numeric_value would be (i.e., exporting it as a number doesn't change it)"""
+    if numeric_value.is_integer():
+        return value == str(int(numeric_value))
+    return value == repr(numeric_value)
+
+
+def numeric_export_terms(queryset, terms):
+    """
+    The pks of the terms whose columns are exported as numbers by typed exports of queryset: terms
+    with a numeric validator (see NUMERIC_TERM_VALIDATORS), and terms whose values are all numbers
+    that are unchanged when written as numbers (e.g., not "00123" or "true")
+    """
+    term_ids = {term.pk for term in terms}
+    numeric = set(
+        TermValidator.objects.filter(term_id__in=term_ids, validator_class__in=NUMERIC_TERM_VALIDATORS)
+        .values_list('term_id', flat=True)
+    )
+
+    tag_model = queryset.model._meta.get_field('tags').related_model
+    tags = tag_model.objects.filter(object__in=queryset.order_by(), key_id__in=term_ids - numeric) \
+        .values_list('key_id', 'value', 'numeric_value')
+    not_numeric = set()
+    for key_id, value, numeric_value in tags.iterator():
+        if key_id not in not_numeric and (numeric_value is None or not _is_number_text(value, numeric_value)):
+            not_numeric.add(key_id)
+    return term_ids - not_numeric
+
+
+def export_tag_values(model, pks, terms, numeric=()):
+    """
+    {(object pk, term pk): value} for the tags of the objects in pks (the last value if there are
+    several). Values of the terms whose pks are in numeric are numbers where the tag has a numeric value.
+    """
+    tag_model = model._meta.get_field('tags').related_model
+    tags = tag_model.objects.filter(object_id__in=pks, key_id__in=[term.pk for term in terms]).order_by('pk')
+    if numeric:
+        return {
+            (object_id, key_id): value if numeric_value is None or key_id not in numeric else numeric_value
+            for object_id, key_id, value, numeric_value
+            in tags.values_list('object_id', 'key_id', 'value', 'numeric_value')
+        }
+    return {(object_id, key_id): value for object_id, key_id, value in tags.values_list('object_id', 'key_id', 'value')}
+
+
+def iter_export_rows(queryset, fields, terms, chunk_size=EXPORT_CHUNK_SIZE, typed=False, format_value=None):
+    """
+    Yields the export rows (fields, then one column per term) of the objects in queryset, in the
+    order of queryset. Tag values are pivoted using one query for each chunk of objects. If typed,
+    values are left as numbers and date/times (see typed_export_value()), tag values are numbers
+    for the terms from numeric_export_terms(), and missing values are None.
+    format_value(value, target_tz) overrides how field values are formatted.
+    """
+    target_tz = timezone.get_default_timezone()
+    model = queryset.model
+    related = []
+    for field in fields:
+        try:
+            if isinstance(model._meta.get_field(field), ForeignKey):
+                related.append(field)
+        except Exception:
+            pass
+
+    numeric = numeric_export_terms(queryset, terms) if typed and terms else ()
+    objects = queryset.select_related(*related).iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(islice(objects, chunk_size))
+        if not chunk:
+            break
+
+        values = export_tag_values(model, [obj.pk for obj in chunk], terms, numeric=numeric) if terms else {}
+        format_value = format_value or (typed_export_value if typed else format_export_value)
+        missing = None if typed else 'NA'
+        for obj in chunk:
+            row = [format_value(getattr(obj, field), target_tz) for field in fields]
+            row.extend(values.get((obj.pk, term.pk), missing) for term in terms)
+            yield row
+
+
+def render_export_chunk(model_name, pks, fields, term_ids):
+    """Renders the export rows of the objects in pks (ordered by pk) as CSV. Runs in worker processes."""
+    model = apps.get_model('lims', model_name)
+    terms_by_id = Term.objects.in_bulk(term_ids)
+    terms = [terms_by_id[term_id] for term_id in term_ids if term_id in terms_by_id]
+
+    out = io.StringIO()
+    csv.writer(out).writerows(
+        iter_export_rows(model.objects.filter(pk__in=pks).order_by('pk'), fields, terms, chunk_size=len(pks) or 1)
+    )
+    return out.getvalue()
+
+
+def export_csv(queryset, out, fields=SAMPLE_EXPORT_FIELDS, terms=(), processes=0, chunk_size=EXPORT_CHUNK_SIZE,
+               progress=None):
+    """
+    Writes a CSV export of queryset to out (a text file), ordered by primary key. The objects are
+    split into chunks of chunk_size primary keys that are rendered by a pool of processes worker
+    processes (None for one per CPU, 0 to render them in this process) and written in order.
+    progress is called with the fraction of objects written after each chunk.
+    """
+    terms = list(terms)
+    term_ids = [term.pk for term in terms]
+    model_name = queryset.model.__name__
+
+    writer = csv.writer(out)
+    writer.writerow(export_header(fields, terms))
+
+    n_objects = max(queryset.count(), 1)
+    n_done = 0
+    chunks = iter_pk_chunks(queryset, chunk_size)
+
+    # a single chunk isn't worth starting processes for, and a job already running in a worker
+    # (e.g., of run_jobs) renders its chunks in that worker
+    if processes == 0 or n_objects <= chunk_size or in_worker():
+        for pks in chunks:
+            out.write(render_export_chunk(model_name, pks, fields, term_ids))
+            n_done += len(pks)
+            if progress is not None:
+                progress(n_done / n_objects)
+        return
+
+    # spawned workers set up Django from scratch rather than inheriting database connections
+    connections.close_all()
+    max_workers = processes or os.cpu_count() or 1
+    executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=get_context('spawn'), initializer=setup_worker)
+    try:
+        # a few chunks per worker are in flight at once, and are written in the order they were submitted
+        pending = deque()
+        for pks in chunks:
+            pending.append((len(pks), executor.submit(render_export_chunk, model_name, pks, fields, term_ids)))
+            while len(pending) >= max_workers * 2:
+                n_done += _write_chunk(out, pending.popleft())
+                if progress is not None:
+                    progress(n_done / n_objects)
+        while pending:
+            n_done += _write_chunk(out, pending.popleft())
+            if progress is not None:
+                progress(n_done / n_objects)
+    finally:
+        executor.shutdown()
+
+
+def _write_chunk(out, pending_chunk):
+    n_objects, future = pending_chunk
+    out.write(future.result())
+    return n_objects
+
+
+def export_queryset(model_name, ids=None, selection=None, project=None):
+    """The objects for an export job: explicit ids, a (frozen) SelectionSet, or all objects of a project"""
+    model = apps.get_model('lims', model_name)
+    if selection is not None:
+        return SelectionSet.objects.get(pk=selection).item_queryset()
+    elif ids is not None:
+        return model.objects.filter(pk__in=ids)
+    elif project is not None:
+        return model.objects.filter(project__slug=project)
+    else:
+        raise ExportError('One of ids, selection, or project is required')
+
+
+@register_job
+def export_job(job, model='Sample', ids=None, selection=None, project=None, processes=None,
+               chunk_size=EXPORT_CHUNK_SIZE):
+    """Writes a (possibly very large) CSV export as the result of job, using a pool of processes"""
+    queryset = export_queryset(model, ids=ids, selection=selection, project=project)
+    terms = queryset.model.get_all_terms(queryset)
+
+    with tempfile.TemporaryFile(mode='w+b') as f:
+        text = io.TextIOWrapper(f, encoding='utf-8', newline='')
+        export_csv(queryset, text, SAMPLE_EXPORT_FIELDS, terms, processes=processes, chunk_size=chunk_size,
+                   progress=job.set_progress)
+        text.flush()
+        f.seek(0)
+        job.result.save('LIMS_export.csv', File(f), save=False)
+        text.detach()
+
+    job.add_message('Exported %d %ss' % (queryset.count(), model.lower()))
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise ExportError('numpy is required for numeric matrix exports')
+    return numpy
+
+
+def numeric_terms(queryset):
+    """The terms with numeric values for the objects in queryset"""
+    tag_model = queryset.model._meta.get_field('tags').related_model
+    key_ids = tag_model.objects.filter(object__in=queryset, numeric_value__isnull=False).values('key_id')
+    return Term.objects.filter(pk__in=key_ids).order_by('slug')
+
+
+def numeric_matrix(queryset, terms):
+    """
+    The numeric values of terms (columns) for the objects in queryset (rows, ordered by primary
+    key) as (object ids, object slugs, term slugs, rows, columns, values). rows and columns are
+    the indices of values in the matrix.
+    """
+    np = _numpy()
+    terms = list(terms)
+    objects = list(queryset.order_by('pk').values_list('pk', 'slug'))
+    ids = np.fromiter((pk for pk, slug in objects), dtype=np.int64, count=len(objects))
+    slugs = np.array([slug for pk, slug in objects], dtype=str)
+
+    term_ids = np.array([term.pk for term in terms], dtype=np.int64)
+    term_order = np.argsort(term_ids)
+    term_slugs = np.array([term.slug for term in terms], dtype=str)
+
+    tag_model = queryset.model._meta.get_field('tags').related_model
+    tags = tag_model.objects.filter(object__in=queryset, key_id__in=term_ids.tolist(), numeric_value__isnull=False) \
+        .order_by('pk') \
+        .values_list('object_id', 'key_id', 'numeric_value')
+    triples = np.array(list(tags), dtype=np.float64).reshape(-1, 3)
+
+    # both id arrays are sorted, so positions are found by binary search instead of per-tag lookups
+    rows = np.searchsorted(ids, triples[:, 0].astype(np.int64))
+    columns = term_order[np.searchsorted(term_ids[term_order], triples[:, 1].astype(np.int64))]
+    return ids, slugs, term_slugs, rows, columns, triples[:, 2]
+
+
+def dense_matrix(n_rows, n_columns, rows, columns, values):
+    """A float64 matrix with values at (rows, columns) and NaN elsewhere (later values take precedence)"""
+    np = _numpy()
+
+    matrix = np.full((n_rows, n_columns), np.nan, dtype=np.float64)
+    matrix[rows, columns] = values
+    return matrix
+
+
+def export_npz(queryset, out, terms=None, sparse=False):
+    """
+    Writes the numeric values of terms (by default, all terms with numeric values) for the objects
+    in queryset to out as a NumPy .npz file: a dense 'values' matrix (NaN for missing values) or,
+    if sparse, the 'rows', 'columns', and 'values' of the values that exist and the matrix 'shape'.
+    Rows are labelled by 'id' and 'slug' and columns are labelled by 'term'.
+    """
+    np = _numpy()
+
+    terms = numeric_terms(queryset) if terms is None else terms
+    ids, slugs, term_slugs, rows, columns, values = numeric_matrix(queryset, terms)
+    arrays = {'id': ids, 'slug': slugs, 'term': term_slugs}
+    if sparse:
+        arrays.update(
+            rows=rows,
+            columns=columns,
+            values=values,
+            shape=np.array([len(ids), len(term_slugs)], dtype=np.int64)
+        )
+    else:
+        arrays['values'] = dense_matrix(len(ids), len(term_slugs), rows, columns, values)
+    np.savez_compressed(out, **arrays)
+
+
+def export_feather(queryset, out, terms=None):
+    """
+    Writes the numeric values of terms (by default, all terms with numeric values) for the objects
+    in queryset to out as an Arrow (Feather) file with id and slug columns and one float64 column
+    per term (null for missing values)
+    """
+    try:
+        import pyarrow as pa
+        from pyarrow import feather
+    except ImportError:
+        raise ExportError('pyarrow is required for Arrow exports')
+    np = _numpy()
+
+    terms = numeric_terms(queryset) if terms is None else terms
+    ids, slugs, term_slugs, rows, columns, values = numeric_matrix(queryset, terms)
+    matrix = dense_matrix(len(ids), len(term_slugs), rows, columns, values)
+
+    arrays = [pa.array(ids), pa.array(slugs.tolist(), type=pa.string())]
+    for i in range(len(term_slugs)):
+        column = np.ascontiguousarray(matrix[:, i])
+        arrays.append(pa.array(column, mask=np.isnan(column)))
+    feather.write_feather(pa.table(arrays, names=['id', 'slug'] + term_slugs.tolist()), out)
+
+
+LONG_EXPORT_OBJECT_FIELDS = ('id', 'slug', 'name', 'collected')
+LONG_EXPORT_TAG_FIELDS = ('key__slug', 'value', 'numeric_value', 'comment', 'user__username', 'created', 'modified')
+LONG_EXPORT_TAG_HEADER = ('term', 'value', 'numeric_value', 'comment', 'user', 'created', 'modified')
+
+
+def long_export_tag_terms(queryset):
+    """The terms of the tags of the tags (e.g., method or unit) of the objects in queryset"""
+    tag_model = queryset.model._meta.get_field('tags').related_model
+    if not has_tags(tag_model):
+        return Term.objects.none()
+    tag_tag_model = tag_model._meta.get_field('tags').related_model
+    key_ids = tag_tag_model.objects.filter(object__object__in=queryset).values('key_id')
+    return Term.objects.filter(pk__in=key_ids).order_by('slug')
+
+
+def long_export_header(queryset, tag_terms=()):
+    object_prefix = queryset.model.__name__.lower() + '_'
+    return [object_prefix + field for field in LONG_EXPORT_OBJECT_FIELDS] + list(LONG_EXPORT_TAG_HEADER) + \
+        ['tag_' + term.slug for term in tag_terms]
+
+
+def iter_long_export_rows(queryset, tag_terms=(), chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yields one row per tag of the objects in queryset (ordered by object, then tag): the object's
+    fields, the tag's fields, and one column for the value of each of tag_terms in the tag's own
+    tags (e.g., a SampleTagTag recording the method or unit of a SampleTag). The rows come from
+    one ordered query (joining the objects and the tags of the tags) that is streamed using
+    iterator(), so that the export never needs more than a chunk of rows in memory.
+    """
+    target_tz = timezone.get_default_timezone()
+    tag_model = queryset.model._meta.get_field('tags').related_model
+    tag_terms = list(tag_terms)
+    tag_term_index = {term.slug: i for i, term in enumerate(tag_terms)}
+
+    fields = ['pk'] + ['object__' + field for field in LONG_EXPORT_OBJECT_FIELDS] + list(LONG_EXPORT_TAG_FIELDS)
+    if tag_terms:
+        fields.extend(['tags__key__slug', 'tags__value'])
+    n_fields = len(LONG_EXPORT_OBJECT_FIELDS) + len(LONG_EXPORT_TAG_FIELDS)
+
+    rows = tag_model.objects.filter(object__in=queryset).order_by('object_id', 'pk').values_list(*fields)
+    for tag_pk, tag_rows in groupby(rows.iterator(chunk_size=chunk_size), key=itemgetter(0)):
+        tag_values = ['NA'] * len(tag_terms)
+        for item in tag_rows:
+            if tag_terms and item[-2] in tag_term_index:
+                tag_values[tag_term_index[item[-2]]] = item[-1]
+
+        row = ['NA' if value is None else format_export_value(value, target_tz) for value in item[1:(n_fields + 1)]]
+        yield row + tag_values
+
+
+def export_xlsx(queryset, out, fields=SAMPLE_EXPORT_FIELDS, terms=(), sheet_title=None):
+    """
+    Writes an Excel workbook of queryset (the same columns as the CSV export) to out, with numbers
+    and date/times as typed cells. The workbook is written in write-only mode, so rows are written
+    as they are read from the database rather than kept in memory.
+    """
+    try:
+        from openpyxl import Workbook
+        from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+    except ImportError:
+        raise ExportError('openpyxl is required for Excel exports')
+
+    terms = list(terms)
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(sheet_title or queryset.model.__name__)
+    sheet.append(export_header(fields, terms))
+    for row in iter_export_rows(queryset, fields, terms, typed=True):
+        # control characters can't be written to a worksheet
+        sheet.append([ILLEGAL_CHARACTERS_RE.sub('', value) if isinstance(value, str) else value for value in row])
+    workbook.save(out)
+
+
+def geojson_export_value(item, target_tz=None):
+    """Values for GeoJSON properties: numbers as numbers, and date/times as ISO 8601 strings"""
+    if item is None or isinstance(item, (bool, int, float)):
+        return item
+    elif hasattr(item, 'strftime'):
+        target_tz = target_tz if target_tz is not None else timezone.get_default_timezone()
+        return item.astimezone(target_tz).isoformat()
+    else:
+        return str(item)
+
+
+def geopackage_export_value(item, target_tz=None):
+    """Values for GeoPackage columns: date/times are UTC (YYYY-MM-DDTHH:MM:SS.SSSZ)"""
+    if hasattr(item, 'strftime'):
+        return item.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+    return geojson_export_value(item, target_tz)
+
+
+def iter_export_geometries(queryset, fields, terms, format_value, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yields (GeoJSON geometry, row) for the objects in queryset (see iter_export_rows()). Objects
+    whose geometry is missing or is not valid well-known text have a geometry of None.
+    """
+    n_fields = len(fields)
+    rows = iter_export_rows(
+        queryset, list(fields) + ['geometry'], terms, chunk_size=chunk_size, typed=True, format_value=format_value
+    )
+    for row in rows:
+        wkt = row.pop(n_fields)
+        try:
+            geometry = parse_wkt(wkt)
+        except WKTError:
+            geometry = None
+        yield geometry, row
+
+
+def iter_geojson(queryset, fields=SAMPLE_EXPORT_FIELDS, terms=()):
+    """
+    Yields the pieces of a GeoJSON FeatureCollection of queryset, one feature per object with the
+    fields and the value of each term as properties (named by unique_export_header())
+    """
+    terms = list(terms)
+    header = unique_export_header(fields, terms)
+    yield '{"type": "FeatureCollection", "features": [\n'
+    separator = ''
+    for geometry, row in iter_export_geometries(queryset, fields, terms, geojson_export_value):
+        feature = {'type': 'Feature', 'geometry': geometry, 'properties': dict(zip(header, row))}
+        yield separator + json.dumps(feature)
+        separator = ',\n'
+    yield '\n]}\n'
+
+
+GEOPACKAGE_SCHEMA = """
+CREATE TABLE gpkg_spatial_ref_sys (
+    srs_name TEXT NOT NULL,
+    srs_id INTEGER NOT NULL PRIMARY KEY,
+    organization TEXT NOT NULL,
+    organization_coordsys_id INTEGER NOT NULL,
+    definition TEXT NOT NULL,
+    description TEXT
+);
+CREATE TABLE gpkg_contents (
+    table_name TEXT NOT NULL PRIMARY KEY,
+    data_type TEXT NOT NULL,
+    identifier TEXT UNIQUE,
+    description TEXT DEFAULT '',
+    last_change DATETIME NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ','now')),
+    min_x DOUBLE,
+    min_y DOUBLE,
+    max_x DOUBLE,
+    max_y DOUBLE,
+    srs_id INTEGER,
+    CONSTRAINT fk_gc_r_srs_id FOREIGN KEY (srs_id) REFERENCES gpkg_spatial_ref_sys(srs_id)
+);
+CREATE TABLE gpkg_geometry_columns (
+    table_name TEXT NOT NULL,
+    column_name TEXT NOT NULL,
+    geometry_type_name TEXT NOT NULL,
+    srs_id INTEGER NOT NULL,
+    z TINYINT NOT NULL,
+    m TINYINT NOT NULL,
+    CONSTRAINT pk_geom_cols PRIMARY KEY (table_name, column_name),
+    CONSTRAINT fk_gc_tn FOREIGN KEY (table_name) REFERENCES gpkg_contents(table_name),
+    CONSTRAINT fk_gc_srs FOREIGN KEY (srs_id) REFERENCES gpkg_spatial_ref_sys (srs_id)
+);
+"""
+
+GEOPACKAGE_SPATIAL_REF_SYS = (
+    ('Undefined cartesian SRS', -1, 'NONE', -1, 'undefined', 'undefined cartesian coordinate reference system'),
+    ('Undefined geographic SRS', 0, 'NONE', 0, 'undefined', 'undefined geographic coordinate reference system'),
+    (
+        'WGS 84 geodetic', 4326, 'EPSG', 4326,
+        'GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.257223563,AUTHORITY["EPSG","7030"]],'
+        'AUTHORITY["EPSG","6326"]],PRIMEM["Greenwich",0,AUTHORITY["EPSG","8901"]],'
+        'UNIT["degree",0.0174532925199433,AUTHORITY["EPSG","9122"]],AUTHORITY["EPSG","4326"]]',
+        'longitude/latitude coordinates in decimal degrees on the WGS 84 spheroid'
+    )
+)
+GEOPACKAGE_COLUMN_TYPES = {'id': 'INTEGER', 'collected': 'DATETIME'}
+
+# the GeoPackage application id ("GPKG") and version (1.2)
+GEOPACKAGE_APPLICATION_ID = 0x47504B47
+GEOPACKAGE_USER_VERSION = 10200
+
+
+def geopackage_geometry(geometry, srs_id=4326):
+    """A GeoPackage geometry blob: a little-endian header with the x/y envelope, then well-known binary"""
+    bounds = geometry_bounds(geometry)
+    header = b'GP' + struct.pack('<BBi4d', 0, 0b00000011, srs_id, *bounds)
+    return header + geometry_wkb(geometry)
+
+
+def _quote_identifier(name):
+    return '"%s"' % name.replace('"', '""')
+
+
+def export_geopackage(queryset, path, fields=SAMPLE_EXPORT_FIELDS, terms=(), table_name='samples',
+                      chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Writes a GeoPackage (a SQLite database) with one feature table of queryset (the columns of the
+    CSV export, named by unique_export_header(), with the geometry in the geom column) to path,
+    which must not already exist.
+    Coordinates are assumed to be longitude/latitude (WGS 84).
+    """
+    if os.path.exists(path) and os.path.getsize(path) > 0:
+        raise ExportError('GeoPackage "%s" already exists' % path)
+
+    terms = list(terms)
+    header = unique_export_header(fields, terms, reserved=('fid', 'geom'))
+    columns = ', '.join(
+        '%s %s' % (_quote_identifier(name), GEOPACKAGE_COLUMN_TYPES.get(name, 'TEXT')) for name in header
+    )
+    insert = 'INSERT INTO %s (geom, %s) VALUES (%s)' % (
+        _quote_identifier(table_name),
+        ', '.join(_quote_identifier(name) for name in header),
+        ', '.join('?' * (len(header) + 1))
+    )
+
+    connection = sqlite3.connect(path)
+    try:
+        connection.execute('PRAGMA application_id = %d' % GEOPACKAGE_APPLICATION_ID)
+        connection.execute('PRAGMA user_version = %d' % GEOPACKAGE_USER_VERSION)
+        connection.executescript(GEOPACKAGE_SCHEMA)
+        connection.executemany('INSERT INTO gpkg_spatial_ref_sys VALUES (?, ?, ?, ?, ?, ?)', GEOPACKAGE_SPATIAL_REF_SYS)
+        connection.execute(
+            'CREATE TABLE %s (fid INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, geom GEOMETRY, %s)' % (
+                _quote_identifier(table_name), columns
+            )
+        )
+
+        extent = None
+        rows = iter_export_geometries(queryset, fields, terms, geopackage_export_value, chunk_size=chunk_size)
+        while True:
+            chunk = []
+            for geometry, row in islice(rows, chunk_size):
+                blob = None
+                if geometry is not None:
+                    bounds = geometry_bounds(geometry)
+                    extent = bounds if extent is None else (
+                        min(extent[0], bounds[0]), max(extent[1], bounds[1]),
+                        min(extent[2], bounds[2]), max(extent[3], bounds[3])
+                    )
+                    blob = geopackage_geometry(geometry)
+                chunk.append([blob] + row)
+            if not chunk:
+                break
+            connection.executemany(insert, chunk)
+
+        min_x, max_x, min_y, max_y = extent or (None, None, None, None)
+        connection.execute(
+            'INSERT INTO gpkg_contents (table_name, data_type, identifier, min_x, min_y, max_x, max_y, srs_id) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (table_name, 'features', table_name, min_x, min_y, max_x, max_y, 4326)
+        )
+        connection.execute(
+            'INSERT INTO gpkg_geometry_columns VALUES (?, ?, ?, ?, ?, ?)',
+            (table_name, 'geom', 'GEOMETRY', 4326, 0, 0)
+        )
+        connection.commit()
+    finally:
+        connection.close()
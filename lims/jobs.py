@@ -0,0 +1,139 @@
+import re
+import json
+import datetime
+import traceback
+
+from django.db import connections
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Job
+
+
+# running jobs whose heartbeat is older than this are assumed to have lost their worker
+JOB_STALE_AFTER = datetime.timedelta(minutes=30)
+
+
+class JobError(Exception):
+    pass
+
+
+_jobs = {}
+
+
+def register_job(job_function, name=None):
+    global _jobs
+    if name is None:
+        name = re.sub(r'_job$', '', job_function.__name__)
+    if not callable(job_function):
+        raise JobError('Job function is not callable')
+    _jobs[name] = job_function
+    return job_function
+
+
+def resolve_job_function(name):
+    try:
+        return _jobs[name]
+    except KeyError:
+        raise JobError('Job must be one of %s' % ', '.join(str(x) for x in _jobs.keys()))
+
+
+def submit_job(name, user, description='', **params):
+    """
+    Queues a job to be run by the run_jobs management command. The job function registered as
+    name is called with the Job object and params, which must be serializable as JSON.
+    """
+    resolve_job_function(name)
+    return Job.objects.create(
+        name=name,
+        user=user,
+        description=description,
+        params=json.dumps(params)
+    )
+
+
+def claim_job():
+    """Marks the oldest queued job as running and returns its pk (or None if there are no queued jobs)"""
+    for pk in Job.objects.filter(status='queued').order_by('created').values_list('pk', flat=True)[:10]:
+        # only one worker can change the status from 'queued'
+        now = timezone.now()
+        if Job.objects.filter(pk=pk, status='queued').update(status='running', started=now, heartbeat=now):
+            return pk
+    return None
+
+
+def job_heartbeat(*pks):
+    """Records that the claimed jobs in pks are still running"""
+    Job.objects.filter(pk__in=pks, status='running').update(heartbeat=timezone.now())
+
+
+def fail_job(pk, error):
+    """Marks a claimed job as failed without running it (e.g., when its worker process died)"""
+    job = Job.objects.get(pk=pk)
+    if job.status != 'running':
+        return job.status
+
+    job.add_error(error)
+    job.status = 'failed'
+    job.progress = 1
+    job.finished = timezone.now()
+    job.save()
+    return job.status
+
+
+def recover_stale_jobs(stale_after=JOB_STALE_AFTER):
+    """
+    Marks running jobs whose heartbeat (or start, for jobs without one) is older than stale_after
+    as failed, because their worker stopped before the job finished. Returns their pks.
+    """
+    cutoff = timezone.now() - stale_after
+    stale = Job.objects.filter(status='running').filter(
+        Q(heartbeat__lt=cutoff) | Q(heartbeat__isnull=True, started__lt=cutoff)
+    )
+    recovered = []
+    for job in stale.only('pk', 'heartbeat', 'started'):
+        # only one runner changes the status (the job may also have just finished)
+        if Job.objects.filter(pk=job.pk, status='running', heartbeat=job.heartbeat).update(
+                status='failed', progress=1, finished=timezone.now()):
+            job = Job.objects.get(pk=job.pk)
+            job.add_error('The job stopped running before it finished (last heartbeat: %s)' %
+                          (job.heartbeat or job.started))
+            job.save(update_fields=['errors'])
+            recovered.append(job.pk)
+    return recovered
+
+
+def run_job(pk):
+    """Runs a claimed job, recording its result and any error on the Job"""
+    job = Job.objects.get(pk=pk)
+    try:
+        job_function = resolve_job_function(job.name)
+        job_function(job, **job.get_params())
+        job.status = 'failed' if job.errors else 'complete'
+    except Exception as e:
+        job.add_error('%s: %s' % (type(e).__name__, e))
+        job.traceback = traceback.format_exc()
+        job.status = 'failed'
+
+    # a job that was recovered as stale while it ran keeps its 'failed' status
+    finished = Job.objects.filter(pk=pk, status='running').update(
+        status=job.status,
+        progress=1,
+        finished=timezone.now(),
+        messages=job.messages,
+        errors=job.errors,
+        traceback=job.traceback,
+        result=job.result.name or ''
+    )
+    if not finished:
+        if job.result:
+            job.result.delete(save=False)
+        return Job.objects.values_list('status', flat=True).get(pk=pk)
+    return job.status
+
+
+def run_job_in_worker(pk):
+    try:
+        return run_job(pk)
+    finally:
+        connections.close_all()
@@ -0,0 +1,50 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+
+from lims.models import Project, Sample
+from lims.jobs import submit_job
+from lims.export import export_csv, EXPORT_CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Exports the samples in a project and their tags (one per column) to a CSV file, using a pool of processes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', nargs='?', default='-', help='CSV file to write (default: standard output)')
+        parser.add_argument('--project', required=True, help='Slug of the project to export')
+        parser.add_argument('--processes', type=int, default=None,
+                            help='Number of worker processes (default: number of CPUs, 0 to export in this process)')
+        parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE,
+                            help='Number of samples rendered by a worker at a time')
+        parser.add_argument('--submit', metavar='USER', default=None,
+                            help='Queue the export as a job owned by USER (run by run_jobs) instead of running it')
+
+    def handle(self, *args, file='-', project=None, processes=None, chunk_size=EXPORT_CHUNK_SIZE, submit=None,
+               **options):
+        try:
+            project = Project.objects.get(slug=project)
+        except Project.DoesNotExist:
+            raise CommandError('No such project: "%s"' % project)
+
+        if submit is not None:
+            try:
+                user = User.objects.get(username=submit)
+            except User.DoesNotExist:
+                raise CommandError('No such user: "%s"' % submit)
+            job = submit_job('export', user, description='export project %s' % project.slug,
+                             model='Sample', project=project.slug, processes=processes, chunk_size=chunk_size)
+            self.stdout.write('Submitted job %s' % job.pk)
+            return
+
+        queryset = Sample.objects.filter(project=project)
+        terms = Sample.get_all_terms(queryset)
+
+        start = time.time()
+        if file == '-':
+            export_csv(queryset, self.stdout, terms=terms, processes=processes, chunk_size=chunk_size)
+        else:
+            with open(file, 'w', newline='', encoding='utf-8') as f:
+                export_csv(queryset, f, terms=terms, processes=processes, chunk_size=chunk_size)
+        self.stderr.write('Exported %d samples in %0.1f seconds' % (queryset.count(), time.time() - start))
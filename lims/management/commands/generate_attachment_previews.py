@@ -0,0 +1,101 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.models import Exists, OuterRef
+
+from lims.models import Attachment, AttachmentPreview
+from lims.utils.previews import generate_preview
+
+
+def attachments_without_previews():
+    previews = AttachmentPreview.objects.filter(file_hash=OuterRef('file_hash'))
+    return Attachment.objects.exclude(file='').annotate(has_preview=Exists(previews)).filter(has_preview=False)
+
+
+def preview_task(name, mime_type, calculated_hash):
+    # runs in a worker process, so errors are returned rather than raised (an exception would
+    # end executor.map() and the command). If the hash is known, the error is recorded as a
+    # failed preview.
+    try:
+        return generate_preview(name, mime_type, calculated_hash)
+    except Exception as e:
+        return {
+            'file_hash': calculated_hash,
+            'preview_type': 'none',
+            'thumbnail': None,
+            'text': '',
+            'error': str(e) or type(e).__name__
+        }
+
+
+class Command(BaseCommand):
+    help = 'Generates thumbnails and text previews for attachments that do not have one yet, ' \
+           'using a pool of worker processes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=None,
+                            help='Number of worker processes (default: number of CPUs, 0 to run in this process)')
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Number of attachments to process per batch')
+        parser.add_argument('--watch', action='store_true',
+                            help='Keep checking for new attachments instead of exiting when done')
+        parser.add_argument('--interval', type=float, default=10,
+                            help='Seconds to wait between checks when using --watch')
+
+    def handle(self, *args, processes=None, batch_size=100, watch=False, interval=10, **options):
+        # attachments whose files can't be read are skipped until the command is restarted
+        self.skipped = set()
+
+        executor = None
+        if processes is None or processes > 0:
+            # worker processes only use storage, but shouldn't inherit open database connections
+            connections.close_all()
+            executor = ProcessPoolExecutor(max_workers=processes)
+
+        try:
+            while True:
+                n_processed = self.process_batch(executor, batch_size)
+                if n_processed:
+                    self.stdout.write('Generated %d previews' % n_processed)
+                elif not watch:
+                    break
+                else:
+                    time.sleep(interval)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+    def process_batch(self, executor, batch_size):
+        # one preview per file hash; attachments without a hash get one calculated by the worker
+        tasks = {}
+        queryset = attachments_without_previews().exclude(pk__in=self.skipped).order_by('pk')
+        for attachment in queryset[:batch_size]:
+            key = attachment.file_hash or 'pk-%s' % attachment.pk
+            tasks.setdefault(key, []).append(attachment)
+
+        if not tasks:
+            return 0
+
+        args = [(items[0].file.name, items[0].mime_type, items[0].file_hash) for items in tasks.values()]
+        if executor is None:
+            results = [preview_task(*arg) for arg in args]
+        else:
+            results = executor.map(preview_task, *zip(*args))
+
+        n_processed = 0
+        for items, result in zip(tasks.values(), results):
+            if result['error']:
+                self.stderr.write('%s: %s' % (items[0].file.name, result['error']))
+            if not result['file_hash']:
+                self.skipped.update(attachment.pk for attachment in items)
+                continue
+
+            unhashed = [attachment.pk for attachment in items if not attachment.file_hash]
+            if unhashed:
+                Attachment.objects.filter(pk__in=unhashed).update(file_hash=result['file_hash'])
+            AttachmentPreview.from_result(result)
+            n_processed += 1
+
+        return n_processed
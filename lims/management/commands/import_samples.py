@@ -0,0 +1,52 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+
+from lims.models import Project
+from lims.bulk import import_samples, ImportValidationError
+
+
+class Command(BaseCommand):
+    help = 'Imports samples (one per row) and their tags (one per column) from a CSV or TSV file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', help='CSV or TSV file to import (tab-delimited if it ends with .tsv or .txt)')
+        parser.add_argument('--project', required=True, help='Slug of the project to import into')
+        parser.add_argument('--user', required=True, help='Username of the user that owns the new samples')
+        parser.add_argument('--status', default='draft', choices=('draft', 'published'),
+                            help='Status of the new samples')
+        parser.add_argument('--delimiter', default=None, help='Field delimiter (guessed from the file name)')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of rows per transaction')
+        parser.add_argument('--no-validate', action='store_true',
+                            help='Skip validating the whole file before importing it')
+
+    def handle(self, *args, file=None, project=None, user=None, status='draft', delimiter=None, batch_size=1000,
+               no_validate=False, **options):
+        try:
+            project = Project.objects.get(slug=project)
+        except Project.DoesNotExist:
+            raise CommandError('No such project: "%s"' % project)
+
+        try:
+            user = User.objects.get(username=user)
+        except User.DoesNotExist:
+            raise CommandError('No such user: "%s"' % user)
+
+        start = time.time()
+        with open(file, 'r', newline='', encoding='utf-8-sig') as f:
+            try:
+                n_samples, n_tags = import_samples(
+                    f, project, user,
+                    validate=not no_validate,
+                    status=status,
+                    delimiter=delimiter,
+                    batch_size=batch_size
+                )
+            except ImportValidationError as e:
+                messages = list(e.messages)
+                if e.new_terms:
+                    messages.append('Columns that would be added as new terms: %s' % ', '.join(e.new_terms))
+                raise CommandError('File contains errors:\n' + '\n'.join(messages))
+
+        self.stdout.write('Imported %d samples and %d tags in %0.1f seconds' % (n_samples, n_tags, time.time() - start))
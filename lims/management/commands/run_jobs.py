@@ -0,0 +1,125 @@
+import os
+import time
+import threading
+from multiprocessing import get_context
+from datetime import timedelta
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from lims.jobs import claim_job, run_job, run_job_in_worker, job_heartbeat, fail_job, recover_stale_jobs, \
+    JOB_STALE_AFTER
+from lims.workers import setup_worker
+
+
+class Command(BaseCommand):
+    help = 'Runs queued jobs (e.g., large bulk actions) using a pool of worker processes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=None,
+                            help='Number of worker processes (default: number of CPUs, 0 to run in this process)')
+        parser.add_argument('--watch', action='store_true',
+                            help='Keep checking for new jobs instead of exiting when done')
+        parser.add_argument('--interval', type=float, default=5,
+                            help='Seconds to wait between checks when using --watch')
+        parser.add_argument('--stale-after', type=float, default=JOB_STALE_AFTER.total_seconds(),
+                            help='Seconds without a heartbeat after which a running job is marked as failed')
+
+    def handle(self, *args, processes=None, watch=False, interval=5, stale_after=None, **options):
+        # job functions are registered when the views are imported
+        import lims.views  # noqa: F401
+
+        self.stale_after = JOB_STALE_AFTER if stale_after is None else timedelta(seconds=stale_after)
+        if processes == 0:
+            self.run_inline(watch, interval)
+        else:
+            self.run_pool(processes, watch, interval)
+
+    def recover(self):
+        for pk in recover_stale_jobs(self.stale_after):
+            self.report(pk, 'failed (no heartbeat)')
+
+    def run_inline(self, watch, interval):
+        while True:
+            self.recover()
+            pk = claim_job()
+            if pk is not None:
+                self.report(pk, self.run_with_heartbeat(pk, interval))
+            elif not watch:
+                break
+            else:
+                time.sleep(interval)
+
+    def run_with_heartbeat(self, pk, interval):
+        # the job blocks this process, so another thread records the heartbeat while it runs
+        done = threading.Event()
+
+        def heartbeat():
+            while not done.wait(interval):
+                job_heartbeat(pk)
+            connections.close_all()
+
+        thread = threading.Thread(target=heartbeat, daemon=True)
+        thread.start()
+        try:
+            return run_job(pk)
+        finally:
+            done.set()
+            thread.join()
+
+    def run_pool(self, processes, watch, interval):
+        # spawned workers set up Django from scratch rather than inheriting database connections
+        connections.close_all()
+        max_running = processes or os.cpu_count() or 1
+        executor = self.make_executor(max_running)
+        running = {}
+
+        try:
+            while True:
+                self.recover()
+
+                # jobs are only claimed when a worker is free, so other runners can pick them up
+                while len(running) < max_running:
+                    pk = claim_job()
+                    if pk is None:
+                        break
+                    running[executor.submit(run_job_in_worker, pk)] = pk
+
+                if not running:
+                    if not watch:
+                        break
+                    time.sleep(interval)
+                    continue
+
+                done, _ = wait(list(running), timeout=interval, return_when=FIRST_COMPLETED)
+                broken = False
+                for future in done:
+                    pk = running.pop(future)
+                    try:
+                        status = future.result()
+                    except Exception as e:
+                        # e.g., the worker process died (BrokenProcessPool), so the job can't record its result
+                        broken = broken or isinstance(e, BrokenProcessPool)
+                        status = fail_job(pk, 'The worker running the job stopped: %s: %s' % (type(e).__name__, e))
+                    self.report(pk, status)
+
+                if broken:
+                    # the other jobs in a broken pool fail too, and a new pool is needed for the next jobs
+                    for future, pk in running.items():
+                        self.report(pk, fail_job(pk, 'The worker pool stopped before the job finished'))
+                    running = {}
+                    executor.shutdown(wait=False)
+                    executor = self.make_executor(max_running)
+                elif running:
+                    job_heartbeat(*running.values())
+        finally:
+            executor.shutdown()
+
+    def make_executor(self, max_running):
+        return ProcessPoolExecutor(max_workers=max_running, mp_context=get_context('spawn'),
+                                   initializer=setup_worker)
+
+    def report(self, pk, status):
+        self.stdout.write('Job %s: %s' % (pk, status))
@@ -0,0 +1,26 @@
+# Generated by Django 2.2.28 on 2026-10-19 00:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lims', '0002_attachment_upload'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttachmentPreview',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file_hash', models.CharField(max_length=128, unique=True)),
+                ('preview_type', models.CharField(choices=[('image', 'Image'), ('text', 'Text'), ('none', 'None')], default='none', max_length=55)),
+                ('thumbnail', models.FileField(blank=True, upload_to='attachment_previews')),
+                ('text', models.TextField(blank=True)),
+                ('error', models.TextField(blank=True)),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='created')),
+                ('modified', models.DateTimeField(auto_now=True, verbose_name='modified')),
+            ],
+        ),
+    ]
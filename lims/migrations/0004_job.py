@@ -0,0 +1,36 @@
+# Generated by Django 2.2.28 on 2026-10-19 00:30
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import lims.validators
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('lims', '0003_attachment_preview'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=55)),
+                ('description', models.CharField(blank=True, max_length=256)),
+                ('params', models.TextField(blank=True, validators=[lims.validators.JSONDictValidator()])),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('complete', 'Complete'), ('failed', 'Failed')], db_index=True, default='queued', max_length=55)),
+                ('progress', models.FloatField(default=0)),
+                ('messages', models.TextField(blank=True)),
+                ('errors', models.TextField(blank=True)),
+                ('traceback', models.TextField(blank=True)),
+                ('result', models.FileField(blank=True, upload_to='job_results')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='created')),
+                ('started', models.DateTimeField(blank=True, null=True, verbose_name='started')),
+                ('finished', models.DateTimeField(blank=True, null=True, verbose_name='finished')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lims_jobs', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
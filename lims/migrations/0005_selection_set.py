@@ -0,0 +1,39 @@
+# Generated by Django 2.2.28 on 2026-10-19 00:36
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import lims.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('lims', '0004_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SelectionSet',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', lims.models.LimsModelField(choices=[('Sample', 'Sample'), ('SampleTag', 'Sample Tag'), ('Attachment', 'Attachment'), ('AttachmentTag', 'Attachment Tag'), ('Term', 'Term'), ('TermTag', 'Term Tag')], max_length=55)),
+                ('data_widget', models.CharField(blank=True, max_length=55)),
+                ('query_string', models.TextField(blank=True)),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='created')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lims_selection_sets', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SelectionSetItem',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.IntegerField()),
+                ('selection', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='lims.SelectionSet')),
+            ],
+            options={
+                'unique_together': {('selection', 'object_id')},
+            },
+        ),
+    ]
@@ -0,0 +1,140 @@
+# Generated by Django 2.2.28 on 2026-10-19 00:44
+
+from django.db import migrations, models
+
+from lims.utils.tag_values import datetime_value, boolean_value
+
+TAG_MODELS = ('TermTag', 'ProjectTag', 'SampleTag', 'SampleTagTag', 'AttachmentTag')
+
+
+def set_typed_values(apps, schema_editor):
+    for model_name in TAG_MODELS:
+        model = apps.get_model('lims', model_name)
+        changed = []
+        for tag in model.objects.only('pk', 'value').iterator():
+            tag.datetime_value = datetime_value(tag.value)
+            tag.boolean_value = boolean_value(tag.value)
+            if tag.datetime_value is not None or tag.boolean_value is not None:
+                changed.append(tag)
+        model.objects.bulk_update(changed, ['datetime_value', 'boolean_value'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lims', '0005_selection_set'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attachmenttag',
+            name='boolean_value',
+            field=models.BooleanField(blank=True, default=None, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='attachmenttag',
+            name='datetime_value',
+            field=models.DateTimeField(blank=True, default=None, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='projecttag',
+            name='boolean_value',
+            field=models.BooleanField(blank=True, default=None, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='projecttag',
+            name='datetime_value',
+            field=models.DateTimeField(blank=True, default=None, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='sampletag',
+            name='boolean_value',
+            field=models.BooleanField(blank=True, default=None, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='sampletag',
+            name='datetime_value',
+            field=models.DateTimeField(blank=True, default=None, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='sampletagtag',
+            name='boolean_value',
+            field=models.BooleanField(blank=True, default=None, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='sampletagtag',
+            name='datetime_value',
+            field=models.DateTimeField(blank=True, default=None, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='termtag',
+            name='boolean_value',
+            field=models.BooleanField(blank=True, default=None, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='termtag',
+            name='datetime_value',
+            field=models.DateTimeField(blank=True, default=None, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='attachmenttag',
+            index=models.Index(fields=['key', 'numeric_value'], name='lims_attachmenttag_num_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='attachmenttag',
+            index=models.Index(fields=['key', 'datetime_value'], name='lims_attachmenttag_dt_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='attachmenttag',
+            index=models.Index(fields=['key', 'boolean_value'], name='lims_attachmenttag_bool_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='projecttag',
+            index=models.Index(fields=['key', 'numeric_value'], name='lims_projecttag_num_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='projecttag',
+            index=models.Index(fields=['key', 'datetime_value'], name='lims_projecttag_dt_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='projecttag',
+            index=models.Index(fields=['key', 'boolean_value'], name='lims_projecttag_bool_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sampletag',
+            index=models.Index(fields=['key', 'numeric_value'], name='lims_sampletag_num_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sampletag',
+            index=models.Index(fields=['key', 'datetime_value'], name='lims_sampletag_dt_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sampletag',
+            index=models.Index(fields=['key', 'boolean_value'], name='lims_sampletag_bool_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sampletagtag',
+            index=models.Index(fields=['key', 'numeric_value'], name='lims_sampletagtag_num_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sampletagtag',
+            index=models.Index(fields=['key', 'datetime_value'], name='lims_sampletagtag_dt_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sampletagtag',
+            index=models.Index(fields=['key', 'boolean_value'], name='lims_sampletagtag_bool_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='termtag',
+            index=models.Index(fields=['key', 'numeric_value'], name='lims_termtag_num_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='termtag',
+            index=models.Index(fields=['key', 'datetime_value'], name='lims_termtag_dt_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='termtag',
+            index=models.Index(fields=['key', 'boolean_value'], name='lims_termtag_bool_idx'),
+        ),
+        migrations.RunPython(set_typed_values, migrations.RunPython.noop),
+    ]
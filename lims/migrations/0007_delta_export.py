@@ -0,0 +1,65 @@
+# Generated by Django 2.2.28 on 2026-10-19 01:14
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lims', '0006_tag_typed_values'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tombstone',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=55)),
+                ('object_id', models.IntegerField()),
+                ('parent_id', models.IntegerField(blank=True, null=True)),
+                ('project_id', models.IntegerField(blank=True, null=True)),
+                ('deleted', models.DateTimeField(default=django.utils.timezone.now, verbose_name='deleted')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='attachment',
+            index=models.Index(fields=['modified', 'id'], name='lims_attachment_mod_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='attachmenttag',
+            index=models.Index(fields=['modified', 'id'], name='lims_attachmenttag_mod_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='project',
+            index=models.Index(fields=['modified', 'id'], name='lims_project_mod_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='projecttag',
+            index=models.Index(fields=['modified', 'id'], name='lims_projecttag_mod_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sample',
+            index=models.Index(fields=['modified', 'id'], name='lims_sample_mod_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sampletag',
+            index=models.Index(fields=['modified', 'id'], name='lims_sampletag_mod_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sampletagtag',
+            index=models.Index(fields=['modified', 'id'], name='lims_sampletagtag_mod_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='term',
+            index=models.Index(fields=['modified', 'id'], name='lims_term_mod_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='termtag',
+            index=models.Index(fields=['modified', 'id'], name='lims_termtag_mod_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tombstone',
+            index=models.Index(fields=['model', 'deleted', 'id'], name='lims_tombstone_deleted_idx'),
+        ),
+    ]
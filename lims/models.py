@@ -1,7 +1,13 @@
 import re
 import json
-
-from django.db import models
+import mimetypes
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+from django.db import models, transaction, IntegrityError
+from django.db.models.signals import m2m_changed, post_save, post_delete
 from django.contrib.auth.models import User
 from django.utils import timezone
 from django.urls import reverse_lazy
@@ -10,13 +16,17 @@ from django.utils.safestring import mark_safe
 from django.core.exceptions import ValidationError, ObjectDoesNotExist
 from django.forms import CharField
 from django.core.validators import RegexValidator
+from django.core.files import File
+from django.core.files.base import ContentFile
 from django.utils.functional import cached_property
 
 import reversion
 
 from .utils.geometry import validate_wkt, wkt_bounds
 from .utils.barcode import qrcode_html
-from .validators import JSONDictValidator, resolve_validator, ValidatorError
+from .utils.files import HashingReader, ConcatenatedReader
+from .utils import tag_values
+from .validators import JSONDictValidator, resolve_validator, validate_column, ValidatorError
 from .widgets.widgets import resolve_input_widget, resolve_output_widget, WidgetError
 from .widgets.data_widget import filter_queryset_for_user
 
@@ -155,7 +165,9 @@ class TagsMixin:
 
     def set_tags(self, _values=None, taxonomy=None, **kwargs):
         taxonomy = self.default_taxonomy() if taxonomy is None else taxonomy
-        self.tags.all().delete()
+        with transaction.atomic():
+            record_tombstones(self.tags.all())
+            self.tags.all().delete()
         return self.add_tags(_values, taxonomy=taxonomy, **kwargs)
 
     def add_tags(self, _values=None, taxonomy=None, **kwargs):
@@ -175,31 +187,46 @@ class TagsMixin:
                 tag.delete()
                 raise e
 
-    def update_tags(self, _values=None, taxonomy=None, **kwargs):
+    def update_tags(self, _values=None, taxonomy=None, save_object=True, **kwargs):
+        """
+        Sets the values of the given tags, deleting tags whose new value is empty. Only tags whose
+        value changed are written, and the object is saved once (to update its modified time) if
+        any tags changed, unless save_object is False.
+        """
         taxonomy = self.default_taxonomy() if taxonomy is None else taxonomy
 
         if _values is not None:
             kwargs.update(_values)
 
         # make sure all names are defined terms
+        terms = Term.get_terms(list(kwargs.keys()), self.project, taxonomy=taxonomy, create=True)
+        existing = {tag.key_id: tag for tag in self.tags.filter(key__in=list(terms.values())).order_by('pk')}
+
+        changed = False
         for key, value in kwargs.items():
-            term = Term.get_term(key, self.project, taxonomy=taxonomy, create=True)
-            try:
-                tag = self.tags.get(key=term)
-                if value:
-                    tag.value = value
-                    tag.full_clean()
-                    tag.save()
-                else:
-                    tag.delete()
-            except ObjectDoesNotExist:
-                if value:
-                    tag = self.tags.create(key=term, value=value)
-                    try:
-                        tag.full_clean()
-                    except ValidationError as e:
-                        tag.delete()
-                        raise e
+            term = terms.get(key)
+            if term is None:
+                continue
+
+            tag = existing.get(term.pk)
+            if tag is not None and not value:
+                tag.delete()
+                changed = True
+            elif tag is not None and tag.value != value:
+                tag.value = value
+                tag.full_clean()
+                tag.save(update_object=False)
+                changed = True
+            elif tag is None and value:
+                tag = self.tags.model(object=self, key=term, value=value)
+                tag.full_clean()
+                tag.save(update_object=False)
+                changed = True
+
+        if changed and save_object:
+            self.save()
+
+        return changed
 
     def get_tag(self, key, taxonomy=None, as_list=False):
         taxonomy = self.default_taxonomy() if taxonomy is None else taxonomy
@@ -224,6 +251,11 @@ class TagsMixin:
         return {tag.key.slug: tag.value for tag in self.tags.filter(key__taxonomy=taxonomy)}
 
 
+def modified_index(prefix):
+    # (modified, id) keyset scans for delta exports (see lims.delta)
+    return models.Index(fields=['modified', 'id'], name='lims_%s_mod_idx' % prefix)
+
+
 class BaseObjectModel(TagsMixin, models.Model):
     name = models.CharField(max_length=256)
     slug = SlugIdField()
@@ -284,6 +316,12 @@ class BaseObjectModel(TagsMixin, models.Model):
         self.geo_ymax = bounds['ymax']
         super().save(*args, **kwargs)
 
+    def delete(self, *args, **kwargs):
+        # the tombstones of the object and its tags are written before the cascade deletes them
+        with transaction.atomic():
+            record_tombstones(type(self).objects.filter(pk=self.pk))
+            return super().delete(*args, **kwargs)
+
     def auto_slug_use(self):
         return [SlugIdField.idify(self.name)]
 
@@ -293,8 +331,11 @@ class BaseObjectModel(TagsMixin, models.Model):
     def _possible_duplicate_slug_queryset(self, slug_prefix):
         return type(self).objects.filter(project=self.project, slug__startswith=slug_prefix)
 
+    def slug_base(self):
+        return '_'.join(item for item in self.auto_slug_use() if item)
+
     def calculate_slug(self):
-        slug_parts = self.auto_slug_use()
+        slug_base = self.slug_base()
 
         # this is constructed such that it should always finish in 2 iterations
         suffix_index = 0
@@ -303,8 +344,7 @@ class BaseObjectModel(TagsMixin, models.Model):
             suffix = '__%d' % suffix_index if suffix_index else ''
 
             # construct the sample slug
-            id_str_prefix = '_'.join(item for item in slug_parts if item)
-            id_str_prefix = id_str_prefix[:(55 - len(suffix))]
+            id_str_prefix = slug_base[:(55 - len(suffix))]
             id_str = id_str_prefix + suffix
 
             # make sure the id_str is unique
@@ -370,6 +410,7 @@ class Term(BaseObjectModel):
 
     class Meta:
         unique_together = ['project', 'taxonomy', 'slug']
+        indexes = [modified_index('term')]
 
     def _duplicate_slug_queryset(self, possible_slug):
         return type(self).objects.filter(project=self.project, taxonomy=self.taxonomy, slug=possible_slug)
@@ -383,9 +424,13 @@ class Term(BaseObjectModel):
     def get_absolute_url(self):
         return reverse_lazy('lims:term_detail', kwargs={'pk': self.pk})
 
+    def compiled(self):
+        """The validators, widgets and form field for this term, shared with other instances of this term"""
+        return compiled_term(self)
+
     @cached_property
     def validators(self):
-        return self.resolve_validators(strict=False)
+        return self.compiled().validators
 
     def resolve_validators(self, strict=False):
         if strict:
@@ -397,11 +442,11 @@ class Term(BaseObjectModel):
 
     @cached_property
     def input_widget(self):
-        return self.resolve_input_widget(strict=False)
+        return self.compiled().input_widget
 
     @cached_property
     def output_widget(self):
-        return self.resolve_output_widget(strict=False)
+        return self.compiled().output_widget
 
     def resolve_input_widget(self, strict=False):
         try:
@@ -425,17 +470,26 @@ class Term(BaseObjectModel):
 
     @cached_property
     def field(self):
-        return self.resolve_field()
+        return self.compiled().field
+
+    def validate_values(self, values):
+        """
+        Validates many values for this term at once, returning an OrderedDict of {index: messages}
+        for the values that Tag.full_clean() would reject
+        """
+        return validate_column(self.field, values)
 
     def resolve_field(self, klass=CharField, **kwargs):
         defaults = {
             'label': '%s' % self,
-            'validators': self.validators,
             'required': False,
-            'help_text': self.description,
-            'widget': self.input_widget
+            'help_text': self.description
         }
         defaults.update(**kwargs)
+        if 'validators' not in defaults:
+            defaults['validators'] = self.validators
+        if 'widget' not in defaults:
+            defaults['widget'] = self.input_widget
         return klass(**defaults)
 
     def clean_fields(self, exclude=None):
@@ -478,11 +532,98 @@ class Term(BaseObjectModel):
                 else:
                     return None
 
+    @staticmethod
+    def get_terms(string_keys, project, taxonomy, create=True):
+        """
+        Resolves many keys as get_term() would, using one query for all the terms that already
+        exist. Returns an OrderedDict mapping each key to its term (keys that can't be resolved
+        are omitted).
+        """
+        keys = [key.strip() for key in string_keys if key and not isinstance(key, Term)]
+        by_slug = {}
+        by_name = {}
+        if keys:
+            candidates = Term.objects.filter(project=project, taxonomy=taxonomy).filter(
+                models.Q(slug__in=[SlugIdField.idify(key) for key in keys]) | models.Q(name__in=keys)
+            )
+            for term in candidates:
+                by_slug[term.slug] = term
+                by_name[term.name] = term
+
+        terms = OrderedDict()
+        for string_key in string_keys:
+            if isinstance(string_key, Term):
+                terms[string_key] = string_key
+                continue
+            if not string_key:
+                continue
+
+            key = string_key.strip()
+            term = by_slug.get(SlugIdField.idify(key)) or by_name.get(key)
+            if term is None and create:
+                term = Term.get_term(key, project, taxonomy=taxonomy, create=True)
+                by_slug[term.slug] = term
+            if term is not None:
+                terms[string_key] = term
+
+        return terms
+
     @staticmethod
     def queryset_for_user(user, permission='view'):
         return queryset_for_user(Term, user=user, permission=permission)
 
 
+class CompiledTerm:
+    """
+    The validators, input and output widgets, and form field for a term. These are expensive to
+    create (they require a query for the term's validators, parsing JSON arguments, and
+    compiling regular expressions), so they are cached for each version of a term by
+    compiled_term().
+    """
+
+    def __init__(self, term):
+        self.validators = term.resolve_validators(strict=False)
+        self.input_widget = term.resolve_input_widget(strict=False)
+        self.output_widget = term.resolve_output_widget(strict=False)
+        self.field = term.resolve_field(validators=self.validators, widget=self.input_widget)
+
+
+COMPILED_TERM_CACHE_SIZE = 1000
+_compiled_terms = OrderedDict()
+_compiled_terms_lock = threading.Lock()
+
+
+def compiled_term(term):
+    """
+    Returns the CompiledTerm for term from a process-wide cache keyed by the term's pk and modified
+    time, so that terms are recompiled when they change (changes to a term's validators are
+    handled by term_changed_handler())
+    """
+    if term.pk is None or term.modified is None:
+        return CompiledTerm(term)
+
+    key = (term.pk, term.modified)
+    with _compiled_terms_lock:
+        compiled = _compiled_terms.get(key, None)
+        if compiled is not None:
+            _compiled_terms.move_to_end(key)
+            return compiled
+
+    compiled = CompiledTerm(term)
+    with _compiled_terms_lock:
+        _compiled_terms[key] = compiled
+        while len(_compiled_terms) > COMPILED_TERM_CACHE_SIZE:
+            _compiled_terms.popitem(last=False)
+
+    return compiled
+
+
+def invalidate_compiled_term(term_pk):
+    with _compiled_terms_lock:
+        for key in [key for key in _compiled_terms if key[0] == term_pk]:
+            del _compiled_terms[key]
+
+
 class TermValidator(models.Model):
     term = models.ForeignKey(Term, on_delete=models.CASCADE, related_name='term_validators')
     order = models.IntegerField(default=0)
@@ -523,6 +664,8 @@ class Tag(models.Model):
 
     numeric_value = models.FloatField(default=None, editable=False, blank=True, null=True)
     numeric_value_autoset = models.BooleanField(default=True, editable=False)
+    datetime_value = models.DateTimeField(default=None, editable=False, blank=True, null=True)
+    boolean_value = models.BooleanField(default=None, editable=False, blank=True, null=True)
 
     class Meta:
         abstract = True
@@ -543,28 +686,45 @@ class Tag(models.Model):
                     {'object': ['Object project must match term project, or the term project must be None']}
                 )
 
-    def save(self, *args, **kwargs):
+    def save(self, *args, update_object=True, **kwargs):
         # update parent object modified tag
-        self.object.modified = timezone.now()
-        self.object.save()
+        if update_object:
+            self.object.modified = timezone.now()
+            self.object.save()
 
-        # cache numeric value
-        if self.numeric_value_autoset:
-            if self.value is None:
-                self.numeric_value = None
-            else:
-                try:
-                    self.numeric_value = float(self.value)
-                except ValueError:
-                    if self.value.lower() == 'true':
-                        self.numeric_value = 1
-                    elif self.value.lower() == 'false':
-                        self.numeric_value = 0
-                    else:
-                        self.numeric_value = None
+        # cache typed values
+        self.set_typed_values()
 
         super().save(*args, **kwargs)
 
+    def set_typed_values(self):
+        if self.numeric_value_autoset:
+            self.numeric_value = tag_values.numeric_value(self.value)
+        self.datetime_value = tag_values.datetime_value(self.value)
+        self.boolean_value = tag_values.boolean_value(self.value)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            record_tombstones(type(self).objects.filter(pk=self.pk))
+            return super().delete(*args, **kwargs)
+
+    @staticmethod
+    def calculate_numeric_value(value):
+        return tag_values.numeric_value(value)
+
+    @staticmethod
+    def calculate_typed_values(value):
+        return tag_values.typed_values(value)
+
+    @staticmethod
+    def typed_value_indexes(prefix):
+        # composite indexes so that range filters on a term's values are index range scans
+        return [
+            models.Index(fields=['key', 'numeric_value'], name='lims_%s_num_idx' % prefix),
+            models.Index(fields=['key', 'datetime_value'], name='lims_%s_dt_idx' % prefix),
+            models.Index(fields=['key', 'boolean_value'], name='lims_%s_bool_idx' % prefix),
+        ]
+
     @cached_property
     def project(self):
         return self.object.project
@@ -582,6 +742,9 @@ class TermTag(Tag):
     user = models.ForeignKey(User, on_delete=models.PROTECT, null=True, blank=True, related_name='lims_term_tags')
     key = models.ForeignKey(Term, on_delete=models.PROTECT, db_index=True, related_name='term_tags')
 
+    class Meta:
+        indexes = Tag.typed_value_indexes('termtag') + [modified_index('termtag')]
+
     @staticmethod
     def queryset_for_user(user, permission='view'):
         queryset_for_user(TermTag, user=user, permission=permission)
@@ -593,6 +756,7 @@ class Project(BaseObjectModel):
 
     class Meta:
         unique_together = ['slug']
+        indexes = [modified_index('project')]
 
     def _duplicate_slug_queryset(self, possible_slug):
         return type(self).objects.filter(slug=possible_slug)
@@ -631,6 +795,9 @@ class ProjectTag(Tag):
     user = models.ForeignKey(User, on_delete=models.PROTECT, null=True, blank=True, related_name='lims_project_tags')
     key = models.ForeignKey(Term, on_delete=models.PROTECT, db_index=True, related_name='project_tags')
 
+    class Meta:
+        indexes = Tag.typed_value_indexes('projecttag') + [modified_index('projecttag')]
+
     @cached_property
     def project(self):
         return None
@@ -676,6 +843,9 @@ class Sample(BaseObjectModel):
     user = models.ForeignKey(User, on_delete=models.PROTECT, null=True, blank=True, related_name='lims_samples')
     status = LimsStatusField(default='draft')
 
+    class Meta(BaseObjectModel.Meta):
+        indexes = [modified_index('sample')]
+
     def auto_slug_use(self):
         # get parts of the calculated sample slug
         dt_str = str(self.collected.astimezone(timezone.get_default_timezone()).date()) if self.collected else ''
@@ -718,6 +888,9 @@ class SampleTag(TagsMixin, Tag):
     user = models.ForeignKey(User, on_delete=models.PROTECT, null=True, blank=True, related_name='lims_sample_tags')
     key = models.ForeignKey(Term, on_delete=models.PROTECT, db_index=True, related_name='sample_tags')
 
+    class Meta:
+        indexes = Tag.typed_value_indexes('sampletag') + [modified_index('sampletag')]
+
     def delete(self, *args, **kwargs):
         # clear relations so they don't delete attachments
         self.attachments.clear()
@@ -734,6 +907,9 @@ class SampleTagTag(Tag):
     user = models.ForeignKey(User, on_delete=models.PROTECT, null=True, blank=True, related_name='lims_sample_tag_tags')
     key = models.ForeignKey(Term, on_delete=models.PROTECT, db_index=True, related_name='sample_tag_tags')
 
+    class Meta:
+        indexes = Tag.typed_value_indexes('sampletagtag') + [modified_index('sampletagtag')]
+
     @staticmethod
     def queryset_for_user(user, permission='view'):
         return queryset_for_user(SampleTagTag, user=user, permission=permission)
@@ -752,6 +928,9 @@ class Attachment(BaseObjectModel):
     terms = models.ManyToManyField(Term, related_name='attachments', blank=True)
     term_tags = models.ManyToManyField(TermTag, related_name='attachments', blank=True)
 
+    class Meta(BaseObjectModel.Meta):
+        indexes = [modified_index('attachment')]
+
     def delete(self, *args, **kwargs):
         # clear relations so they don't get deleted with attachments
         self.samples.clear()
@@ -760,28 +939,52 @@ class Attachment(BaseObjectModel):
         self.term_tags.clear()
         super().delete(*args, **kwargs)
 
-    def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-
-        for sample in self.samples.all():
-            if sample.project != self.project:
-                raise ValidationError({'samples': ['At least one related sample is of a different project']})
+    # lookups from each related model to the project that must match this attachment's project
+    relation_project_lookups = OrderedDict([
+        ('samples', 'project'),
+        ('sample_tags', 'object__project'),
+        ('terms', 'project'),
+        ('term_tags', 'object__project'),
+    ])
+
+    relation_errors = {
+        'samples': 'At least one related sample is of a different project',
+        'sample_tags': 'At least one related sample tag is of a different project',
+        'terms': 'At least one related term is of a different project',
+        'term_tags': 'At least one related term tag is of a different project'
+    }
+
+    def invalid_relation_ids(self, relation, pk_set=None):
+        """
+        Find the ids of related objects that are of a different project than this attachment
+        using a single query. If pk_set is None, the objects currently related are checked,
+        otherwise the objects with those primary keys are checked (e.g., before they are added).
+        """
+        lookup = self.relation_project_lookups[relation]
+        if pk_set is None:
+            queryset = getattr(self, relation).all()
+        else:
+            queryset = self._meta.get_field(relation).related_model.objects.filter(pk__in=pk_set)
 
-        for sample_tag in self.sample_tags.all():
-            if sample_tag.object.project != self.project:
-                raise ValidationError({'sample_tags': ['At least one related sample tag is of a different project']})
+        return list(queryset.exclude(**{lookup: self.project_id}).values_list('pk', flat=True))
 
-        for term in self.terms.all():
-            if term.project != self.project:
-                raise ValidationError({'samples': ['At least one related term is of a different project']})
+    def validate_relations(self):
+        for relation in self.relation_project_lookups:
+            if self.invalid_relation_ids(relation):
+                raise ValidationError({relation: [self.relation_errors[relation]]})
 
-        for sample_tag in self.term_tags.all():
-            if sample_tag.object.project != self.project:
-                raise ValidationError({'term_tags': ['At least one related term tag is of a different project']})
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self.validate_relations()
 
     def get_absolute_url(self):
         return reverse_lazy('lims:attachment_detail', kwargs={'pk': self.pk})
 
+    def get_preview(self):
+        if not self.file_hash:
+            return None
+        return AttachmentPreview.objects.filter(file_hash=self.file_hash).first()
+
     @staticmethod
     def get_all_terms(queryset):
         return Term.objects.filter(attachment_tags__object__in=queryset).distinct()
@@ -797,7 +1000,391 @@ class AttachmentTag(Tag):
     user = models.ForeignKey(User, on_delete=models.PROTECT, null=True, blank=True, related_name='lims_attachment_tags')
     key = models.ForeignKey(Term, on_delete=models.PROTECT, db_index=True, related_name='attachment_tags')
 
+    class Meta:
+        indexes = Tag.typed_value_indexes('attachmenttag') + [modified_index('attachmenttag')]
+
     @staticmethod
     def queryset_for_user(user, permission='view'):
         return queryset_for_user(AttachmentTag, user=user, permission=permission)
 
+
+class AttachmentPreview(models.Model):
+    """
+    A thumbnail and/or text preview of an attachment's file. Previews are keyed by file hash so
+    that files that are attached more than once only get one preview.
+    """
+    file_hash = models.CharField(max_length=128, unique=True)
+    preview_type = models.CharField(max_length=55, default='none', choices=(
+        ('image', 'Image'),
+        ('text', 'Text'),
+        ('none', 'None')
+    ))
+    thumbnail = models.FileField(upload_to='attachment_previews', blank=True)
+    text = models.TextField(blank=True)
+    error = models.TextField(blank=True)
+
+    created = models.DateTimeField('created', auto_now_add=True)
+    modified = models.DateTimeField('modified', auto_now=True)
+
+    @staticmethod
+    def from_result(result):
+        """Creates or updates a preview from the output of utils.previews.generate_preview()"""
+        preview = AttachmentPreview.objects.filter(file_hash=result['file_hash']).first()
+        if preview is None:
+            preview = AttachmentPreview(file_hash=result['file_hash'])
+        elif preview.thumbnail:
+            preview.thumbnail.delete(save=False)
+
+        preview.preview_type = result['preview_type']
+        preview.text = result['text']
+        preview.error = result['error']
+        if result['thumbnail'] is not None:
+            preview.thumbnail.save(result['file_hash'][:32] + '.png', ContentFile(result['thumbnail']), save=False)
+        preview.save()
+        return preview
+
+    def __str__(self):
+        return '%s preview for %s' % (self.preview_type, self.file_hash)
+
+
+class AttachmentUpload(models.Model):
+    """
+    A chunked upload of a (possibly very large) file that will become an Attachment. Chunks are
+    written to storage as they arrive, so an interrupted upload can be resumed by sending
+    only the chunks that are missing.
+    """
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='attachment_uploads')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='lims_attachment_uploads')
+    name = models.CharField(max_length=256, blank=True)
+    filename = models.CharField(max_length=256)
+    size = models.BigIntegerField(null=True, blank=True)
+    status = models.CharField(max_length=55, default='in-progress', choices=(
+        ('in-progress', 'In Progress'),
+        ('complete', 'Complete')
+    ))
+    attachment = models.ForeignKey(Attachment, on_delete=models.SET_NULL, null=True, blank=True,
+                                   related_name='uploads')
+
+    created = models.DateTimeField('created', auto_now_add=True)
+    modified = models.DateTimeField('modified', auto_now=True)
+
+    def received_chunks(self):
+        return list(self.chunks.order_by('index').values_list('index', flat=True))
+
+    def received_size(self):
+        return self.chunks.aggregate(total=models.Sum('size'))['total'] or 0
+
+    def write_chunk(self, index, stream, max_size=None):
+        """
+        Writes a chunk from stream, hashing it as it is read. Re-sending a chunk replaces the
+        previous version, but only once the new version has been read completely: the stream is
+        spooled to a temporary file first (so a stream that is too large or is cut off leaves
+        nothing in storage), then the chunk rows are swapped in a transaction.
+        """
+        reader = HashingReader(stream, max_size=max_size)
+        with tempfile.TemporaryFile() as spooled:
+            shutil.copyfileobj(reader, spooled)
+            spooled.seek(0)
+            chunk = AttachmentUploadChunk(upload=self, index=index, size=reader.bytes_read,
+                                          chunk_hash=reader.hexdigest())
+            chunk.file.save('%s.%s' % (self.pk, index), File(spooled), save=False)
+
+        try:
+            with transaction.atomic():
+                previous = list(self.chunks.select_for_update().filter(index=index))
+                AttachmentUploadChunk.objects.filter(pk__in=[item.pk for item in previous]).delete()
+                chunk.save()
+                # keeps track of the last activity for this upload
+                self.save()
+        except IntegrityError:
+            chunk.file.delete(save=False)
+            raise ValueError('Chunk %s was written by another request at the same time' % index)
+        except Exception:
+            chunk.file.delete(save=False)
+            raise
+
+        for item in previous:
+            item.file.delete(save=False)
+        return chunk
+
+    def finalize(self, **kwargs):
+        """
+        Concatenates the chunks in order into the file of a new Attachment, computing the
+        file hash in the same pass, then removes the chunks. The file is written before the
+        transaction starts, so that the upload row is only locked to create the Attachment and
+        mark the upload as complete (not while a large file is copied).
+        """
+        defaults = {
+            'project': self.project,
+            'user': self.user,
+            'name': self.name or self.filename,
+            'mime_type': mimetypes.guess_type(self.filename)[0] or ''
+        }
+        defaults.update(**kwargs)
+        attachment = Attachment(**defaults)
+
+        if type(self).objects.get(pk=self.pk).status == 'complete':
+            raise ValidationError('Upload has already been finalized')
+
+        chunks = list(self.chunks.order_by('index'))
+        indices = [chunk.index for chunk in chunks]
+        if not indices or indices != list(range(len(indices))):
+            raise ValidationError('Upload is missing at least one chunk')
+
+        size = sum(chunk.size for chunk in chunks)
+        if self.size is not None and size != self.size:
+            raise ValidationError('Upload size (%s) does not match expected size (%s)' % (size, self.size))
+
+        reader = HashingReader(ConcatenatedReader(chunk.file for chunk in chunks))
+        attachment.file.save(self.filename, File(reader), save=False)
+        attachment.file_hash = reader.hexdigest()
+
+        # the attachment, the chunk rows and the status change together (or not at all)
+        try:
+            with transaction.atomic():
+                if type(self).objects.select_for_update().get(pk=self.pk).status == 'complete':
+                    raise ValidationError('Upload has already been finalized')
+                # a chunk that was re-sent while the file was written has a new row
+                if set(self.chunks.values_list('pk', flat=True)) != {chunk.pk for chunk in chunks}:
+                    raise ValidationError('Upload changed while it was being finalized')
+
+                attachment.save()
+                AttachmentUploadChunk.objects.filter(pk__in=[chunk.pk for chunk in chunks]).delete()
+                self.status = 'complete'
+                self.attachment = attachment
+                self.save()
+        except Exception:
+            attachment.file.delete(save=False)
+            raise
+
+        for chunk in chunks:
+            chunk.file.delete(save=False)
+        return attachment
+
+    def delete(self, *args, **kwargs):
+        # chunk files aren't removed by the cascade
+        for chunk in self.chunks.all():
+            chunk.delete()
+        return super().delete(*args, **kwargs)
+
+    def __str__(self):
+        return '%s/%s (%s)' % (self.project, self.filename, self.status)
+
+
+class AttachmentUploadChunk(models.Model):
+    upload = models.ForeignKey(AttachmentUpload, on_delete=models.CASCADE, related_name='chunks')
+    index = models.IntegerField()
+    size = models.BigIntegerField()
+    chunk_hash = models.CharField(max_length=128, blank=True)
+    file = models.FileField(upload_to='attachment_uploads')
+
+    class Meta:
+        unique_together = ('upload', 'index')
+
+    def delete(self, *args, **kwargs):
+        self.file.delete(save=False)
+        return super().delete(*args, **kwargs)
+
+
+class Job(models.Model):
+    """
+    A long-running operation that is queued from a request and run by the run_jobs
+    management command (see jobs.py).
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='lims_jobs')
+    name = models.CharField(max_length=55)
+    description = models.CharField(max_length=256, blank=True)
+    params = models.TextField(validators=[JSONDictValidator(), ], blank=True)
+    status = models.CharField(max_length=55, default='queued', db_index=True, choices=(
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('complete', 'Complete'),
+        ('failed', 'Failed')
+    ))
+    progress = models.FloatField(default=0)
+    messages = models.TextField(blank=True)
+    errors = models.TextField(blank=True)
+    traceback = models.TextField(blank=True)
+    result = models.FileField(upload_to='job_results', blank=True)
+
+    created = models.DateTimeField('created', auto_now_add=True)
+    started = models.DateTimeField('started', null=True, blank=True)
+    finished = models.DateTimeField('finished', null=True, blank=True)
+    # updated while the job is running, so that jobs whose worker has died can be recovered
+    heartbeat = models.DateTimeField('heartbeat', null=True, blank=True)
+
+    def get_params(self):
+        return json.loads(self.params) if self.params else {}
+
+    def add_message(self, message):
+        self.messages = '\n'.join(item for item in (self.messages, str(message)) if item)
+
+    def add_error(self, error):
+        self.errors = '\n'.join(item for item in (self.errors, str(error)) if item)
+
+    def set_progress(self, progress):
+        # doesn't touch the other fields, which the job function may be changing
+        self.progress = progress
+        self.heartbeat = timezone.now()
+        Job.objects.filter(pk=self.pk).update(progress=progress, heartbeat=self.heartbeat)
+
+    def save_response(self, response, filename=None):
+        """Saves the content of an HttpResponse (or StreamingHttpResponse) as the result of this job"""
+        if filename is None:
+            filename_match = re.search(r'filename\s*=\s*"(.*?)"', response.get('Content-Disposition', ''))
+            filename = filename_match.group(1) if filename_match else 'result'
+
+        with tempfile.TemporaryFile() as f:
+            if response.streaming:
+                for chunk in response.streaming_content:
+                    f.write(chunk)
+            else:
+                f.write(response.content)
+            f.seek(0)
+            self.result.save(filename, File(f), save=False)
+
+    def get_absolute_url(self):
+        return reverse_lazy('lims:job_detail', kwargs={'pk': self.pk})
+
+    def __str__(self):
+        return '%s (%s)' % (self.description or self.name, self.status)
+
+
+class SelectionSet(models.Model):
+    """
+    A set of objects selected for a bulk action, stored on the server so that large selections
+    don't have to be encoded in a URL. A selection is either a list of explicit ids (stored as
+    SelectionSetItems) or a data widget filter (a registered data widget name and its query string,
+    including restrictions like parent_id or term_id), which is evaluated when the selection is used.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='lims_selection_sets')
+    model = LimsModelField()
+    data_widget = models.CharField(max_length=55, blank=True)
+    query_string = models.TextField(blank=True)
+    created = models.DateTimeField('created', auto_now_add=True)
+
+    def is_filter(self):
+        return bool(self.data_widget)
+
+    def get_model(self):
+        return LimsModelField.get_model(self.model)
+
+    def set_ids(self, ids, batch_size=1000):
+        """Stores ids (any iterable, e.g. a values_list() iterator) as the explicit items of this selection"""
+        self.items.all().delete()
+        batch = []
+        for object_id in ids:
+            batch.append(SelectionSetItem(selection=self, object_id=object_id))
+            if len(batch) >= batch_size:
+                SelectionSetItem.objects.bulk_create(batch)
+                batch = []
+        if batch:
+            SelectionSetItem.objects.bulk_create(batch)
+
+    def freeze(self, queryset):
+        """Replaces a filter with the ids of the objects it currently selects"""
+        self.set_ids(queryset.order_by('pk').values_list('pk', flat=True).iterator())
+        self.data_widget = ''
+        self.query_string = ''
+        self.save()
+
+    def item_queryset(self):
+        return self.get_model().objects.filter(pk__in=self.items.values('object_id'))
+
+    def __str__(self):
+        return '%s selection %s' % (self.model, self.pk)
+
+
+class SelectionSetItem(models.Model):
+    selection = models.ForeignKey(SelectionSet, on_delete=models.CASCADE, related_name='items')
+    object_id = models.IntegerField()
+
+    class Meta:
+        unique_together = ('selection', 'object_id')
+
+
+class Tombstone(models.Model):
+    """
+    A record of a deleted object or tag, so that delta exports (see lims.delta) can tell downstream
+    copies what to delete. Tombstones of tags keep the id of the tagged object as parent_id.
+    """
+    model = models.CharField(max_length=55)
+    object_id = models.IntegerField()
+    parent_id = models.IntegerField(null=True, blank=True)
+    project_id = models.IntegerField(null=True, blank=True)
+    deleted = models.DateTimeField('deleted', default=timezone.now)
+
+    class Meta:
+        indexes = [models.Index(fields=['model', 'deleted', 'id'], name='lims_tombstone_deleted_idx')]
+
+    def __str__(self):
+        return '%s %s (deleted %s)' % (self.model, self.object_id, self.deleted)
+
+
+def record_tombstones(queryset, tags=True):
+    """
+    Writes the tombstones of the objects or tags in queryset (and of their tags, if tags is True)
+    using bulk_create() from their ids, without loading the model instances. Call it in the same
+    transaction, before the queryset (or the instance) is deleted.
+    """
+    model = queryset.model
+    if issubclass(model, Tag):
+        tombstones = [
+            Tombstone(model=model.__name__, object_id=pk, parent_id=object_id)
+            for pk, object_id in queryset.order_by().values_list('pk', 'object_id')
+        ]
+    else:
+        tombstones = [
+            Tombstone(model=model.__name__, object_id=pk, project_id=project_id)
+            for pk, project_id in queryset.order_by().values_list('pk', 'pk' if model is Project else 'project_id')
+        ]
+    Tombstone.objects.bulk_create(tombstones)
+
+    if tags and getattr(model, 'tags', None) is not None:
+        record_tombstones(model.tags.rel.related_model.objects.filter(object__in=queryset.order_by().values('pk')))
+
+
+def term_changed_handler(sender, instance, **kwargs):
+    if sender is TermValidator:
+        invalidate_compiled_term(instance.term_id)
+        # other processes see the change because the cache key includes the modified time
+        Term.objects.filter(pk=instance.term_id).update(modified=timezone.now())
+    else:
+        invalidate_compiled_term(instance.pk)
+
+
+for _term_model in (Term, TermValidator):
+    post_save.connect(term_changed_handler, sender=_term_model)
+    post_delete.connect(term_changed_handler, sender=_term_model)
+
+
+def attachment_relations_changed_handler(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Checks that objects added to an attachment relation are of the same project as the attachment
+    before they are added, using one query per call to add().
+    """
+    if action != 'pre_add' or not pk_set:
+        return
+
+    relation = ATTACHMENT_RELATIONS[sender]
+    if not reverse:
+        if instance.invalid_relation_ids(relation, pk_set):
+            raise ValidationError({relation: [Attachment.relation_errors[relation]]})
+    else:
+        # instance is the sample/term/tag, pk_set are attachment ids
+        project_lookup = Attachment.relation_project_lookups[relation].split('__')
+        project_id = instance
+        for attr in project_lookup[:-1]:
+            project_id = getattr(project_id, attr)
+        project_id = getattr(project_id, project_lookup[-1] + '_id')
+
+        if Attachment.objects.filter(pk__in=pk_set).exclude(project_id=project_id).exists():
+            raise ValidationError({'attachments': [Attachment.relation_errors[relation]]})
+
+
+ATTACHMENT_RELATIONS = {
+    getattr(Attachment, relation).through: relation for relation in Attachment.relation_project_lookups
+}
+
+for _through_model in ATTACHMENT_RELATIONS:
+    m2m_changed.connect(attachment_relations_changed_handler, sender=_through_model)
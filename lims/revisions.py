@@ -0,0 +1,132 @@
+import json
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.core import serializers
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction, router
+from django.db.models.signals import post_save
+from django.utils import timezone
+from django.utils.encoding import force_str
+import reversion
+from reversion.models import Revision, Version
+from reversion.revisions import _get_options, _get_content_type
+
+_local = threading.local()
+
+
+def current_bulk_revision():
+    return getattr(_local, 'revision', None)
+
+
+class BulkRevision:
+    """
+    A lightweight alternative to reversion.create_revision() for bulk operations. Instead of
+    serializing each saved object and everything it follows (e.g. a sample and all of its tags)
+    at the time it is saved, only the rows that were actually saved (or explicitly added) are
+    recorded, and they are serialized in one pass per model when the revision is saved. The
+    result is a normal reversion Revision with one Version per changed row.
+    """
+
+    def __init__(self, user=None, comment='', using=None):
+        self.user = user
+        self.comment = comment
+        self.using = using or router.db_for_write(Revision)
+        self.date_created = timezone.now()
+        self.changed = OrderedDict()
+        self.versions = []
+
+    def add(self, obj):
+        """Records that obj has changed; it is serialized in its final state when the revision is saved"""
+        if obj.pk is not None and reversion.is_registered(type(obj)):
+            self.changed.setdefault(type(obj), set()).add(obj.pk)
+
+    def add_queryset(self, queryset):
+        """Records that all the objects in queryset have changed (one query)"""
+        if reversion.is_registered(queryset.model):
+            self.changed.setdefault(queryset.model, set()).update(queryset.values_list('pk', flat=True))
+
+    def add_deleted(self, queryset):
+        """
+        Serializes the objects in queryset immediately so that they can be recovered after they
+        are deleted. This must be called before the objects are deleted.
+        """
+        if reversion.is_registered(queryset.model):
+            self.versions.extend(self.serialize(queryset.model, queryset.iterator()))
+
+    def serialize(self, model, objects):
+        version_options = _get_options(model)
+        content_type = _get_content_type(model, self.using)
+        model_db = router.db_for_write(model)
+
+        objects = list(objects)
+        data = serializers.serialize(
+            'python',
+            objects,
+            fields=version_options.fields,
+            use_natural_foreign_keys=version_options.use_natural_foreign_keys
+        )
+
+        for obj, obj_data in zip(objects, data):
+            yield Version(
+                content_type=content_type,
+                object_id=force_str(obj.pk),
+                db=model_db,
+                format=version_options.format,
+                serialized_data=json.dumps([obj_data], cls=DjangoJSONEncoder),
+                object_repr=force_str(obj)
+            )
+
+    def save(self, chunk_size=1000):
+        versions = list(self.versions)
+        for model, pks in self.changed.items():
+            pks = sorted(pks)
+            for start in range(0, len(pks), chunk_size):
+                queryset = model._base_manager.using(router.db_for_write(model)).filter(
+                    pk__in=pks[start:(start + chunk_size)]
+                )
+                versions.extend(self.serialize(model, queryset))
+
+        if not versions:
+            return None
+
+        revision = Revision.objects.using(self.using).create(
+            date_created=self.date_created,
+            user=self.user,
+            comment=self.comment
+        )
+        for version in versions:
+            version.revision = revision
+        Version.objects.using(self.using).bulk_create(versions)
+        return revision
+
+
+@contextmanager
+def bulk_revision(user=None, comment=''):
+    """
+    Records the registered objects that are saved within the block in a BulkRevision, which is
+    saved at the end of the block (inside the same transaction).
+    """
+    if current_bulk_revision() is not None:
+        # nested blocks are recorded in the outer revision
+        yield current_bulk_revision()
+        return
+
+    revision = BulkRevision(user=user, comment=comment)
+    with transaction.atomic(using=revision.using):
+        _local.revision = revision
+        try:
+            yield revision
+        finally:
+            _local.revision = None
+        revision.save()
+
+
+def bulk_revision_save_handler(sender, instance, raw=False, **kwargs):
+    revision = current_bulk_revision()
+    if revision is not None and not raw:
+        revision.add(instance)
+
+
+post_save.connect(bulk_revision_save_handler)
@@ -54,13 +54,87 @@ function limsRegisterDataViewTable(object) {
     });
 }
 
+function limsLoadLazyDataView(object, url) {
+    // loads a data view table from the data_view endpoint into a placeholder
+    var $placeholder = $(object);
+    url = url || $placeholder.data('url');
+    $placeholder.data('url', url);
+
+    $.get(url, function(html) {
+        $placeholder.html(html);
+        $placeholder.find('form.dv-form').each(function() {
+            limsRegisterDataViewTable($(this));
+        });
+
+        // hide sections whose table has no objects
+        var $section = $placeholder.closest('.dv-lazy-section[data-hide-empty="true"]');
+        if($placeholder.find('.dv-list-container').data('count') === 0) {
+            $section.hide();
+        } else {
+            $section.show();
+        }
+    }).fail(function() {
+        $placeholder.find('.dv-lazy-loading').text('This table could not be loaded.');
+    });
+}
+
+function limsRegisterLazyDataView(object) {
+    var $placeholder = $(object);
+    var baseUrl = $placeholder.data('url').split('?')[0];
+
+    // sorting and pagination links (relative query strings) reload only this table
+    $placeholder.on('click', 'a[href^="?"]', function(e) {
+        e.preventDefault();
+        limsLoadLazyDataView($placeholder, baseUrl + $(this).attr('href'));
+    });
+
+    // filters keep the rest of this table's query string
+    $placeholder.on('submit', 'form.dv-filter-form', function(e) {
+        e.preventDefault();
+        var query = new URLSearchParams($placeholder.data('url').split('?')[1] || '');
+        $.each($(this).serializeArray(), function(i, field) {
+            query.set(field.name, field.value);
+        });
+        limsLoadLazyDataView($placeholder, baseUrl + '?' + query.toString());
+    });
+}
+
+function limsObserveLazyDataViews($placeholders) {
+    // tables are loaded when they are about to scroll into view (all at once in older browsers)
+    if(!('IntersectionObserver' in window)) {
+        $placeholders.each(function() {
+            limsLoadLazyDataView($(this));
+        });
+        return;
+    }
+
+    var observer = new IntersectionObserver(function(entries) {
+        $.each(entries, function(i, entry) {
+            if(entry.isIntersecting) {
+                observer.unobserve(entry.target);
+                limsLoadLazyDataView($(entry.target));
+            }
+        });
+    }, {rootMargin: '200px'});
+
+    $placeholders.each(function() {
+        observer.observe(this);
+    });
+}
+
 $(function() {
+    // load tables that are rendered after the page
+    $('.dv-lazy').each(function() {
+        limsRegisterLazyDataView($(this));
+    });
+    limsObserveLazyDataViews($('.dv-lazy'));
+
     // find all data view tables, register listeners
     var dataViewForms = $('form.dv-form').each(function(index) {
         limsRegisterDataViewTable($(this));
     });
 
-    if(dataViewForms.length > 0) {
+    if(dataViewForms.length > 0 || $('.dv-lazy').length > 0) {
 
         // register the onKeyDown listener for the shift key
         window.shiftKeyDown = false;
@@ -0,0 +1,130 @@
+import math
+
+from django.apps import apps
+from django.core.cache import cache
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Count, Sum, Min, Max, Avg, StdDev, F, FloatField, ExpressionWrapper, Value
+from django.db.models.functions import Floor
+
+from .widgets.data_widget import filter_queryset_for_user
+
+TERM_STATS_BINS = 20
+TERM_STATS_TOP_VALUES = 10
+TERM_STATS_QUANTILES = (0.25, 0.5, 0.75)
+TERM_STATS_CACHE_TIMEOUT = 24 * 60 * 60
+
+
+def term_stats_cache_key(term, tags, user):
+    """
+    The cache key for the statistics of tags (the values of term that user can view). The key
+    includes a version of the tags (their count, pk sum, and last modified time), so that a change
+    made by any process is seen without having to clear the cache of every other process.
+    """
+    version = tags.aggregate(count=Count('pk'), pk_sum=Sum('pk'), modified=Max('modified'))
+    return 'lims:term_stats:%s:%s:%s:%s:%s' % (
+        term.pk,
+        'staff' if user.is_staff else user.pk,
+        version['count'],
+        version['pk_sum'] or 0,
+        version['modified'].timestamp() if version['modified'] else ''
+    )
+
+
+def term_tag_model(term):
+    """The tag model that holds the values for term (e.g., SampleTag for a term whose taxonomy is Sample)"""
+    try:
+        model = apps.get_model('lims', term.taxonomy)
+        return model._meta.get_field('tags').related_model
+    except (LookupError, FieldDoesNotExist):
+        return apps.get_model('lims', 'SampleTag')
+
+
+def quantile(numeric_values, n, q):
+    """
+    The q quantile (linear interpolation between the closest ranks) of numeric_values, a queryset
+    of n values. Each rank is one indexed ORDER BY ... LIMIT 1 OFFSET query.
+    """
+    position = q * (n - 1)
+    lower = math.floor(position)
+    values = list(numeric_values[lower:(lower + 2)])
+    if len(values) == 1 or position == lower:
+        return values[0]
+    return values[0] + (values[1] - values[0]) * (position - lower)
+
+
+def histogram(numeric_tags, minimum, maximum, bins=TERM_STATS_BINS):
+    """Counts the numeric values in bins equal-width bins between minimum and maximum using a GROUP BY"""
+    if minimum == maximum:
+        bins = 1
+    width = (maximum - minimum) / bins if maximum > minimum else 1
+
+    counts = [0] * bins
+    bin_expression = Floor(
+        ExpressionWrapper((F('numeric_value') - Value(minimum)) / Value(width), output_field=FloatField())
+    )
+    bin_counts = numeric_tags.annotate(bin=bin_expression).order_by().values('bin').annotate(n=Count('pk'))
+    for item in bin_counts.values_list('bin', 'n'):
+        # the maximum value is in the last bin
+        counts[min(max(int(item[0]), 0), bins - 1)] += item[1]
+
+    return [
+        {'min': minimum + width * i, 'max': maximum if i == bins - 1 else minimum + width * (i + 1), 'count': n}
+        for i, n in enumerate(counts)
+    ]
+
+
+def term_stats_queryset(term, user):
+    """The tags summarized by the statistics of term: those of term_tag_model(term) that user can view"""
+    return filter_queryset_for_user(term_tag_model(term).objects.filter(key=term), user, 'view')
+
+
+def calculate_term_stats(term, tags, bins=TERM_STATS_BINS):
+    """
+    Calculates the count, number of distinct values, most common values, numeric summary, and
+    histogram of the values of term in tags using database aggregates (no values are loaded into
+    memory)
+    """
+    numeric_tags = tags.filter(numeric_value__isnull=False)
+
+    summary = tags.aggregate(count=Count('pk'), distinct=Count('value', distinct=True))
+    top_values = tags.order_by().values('value').annotate(n=Count('pk')).order_by('-n', 'value')
+    stats = {
+        'term_id': term.pk,
+        'model': tags.model.__name__,
+        'count': summary['count'],
+        'distinct': summary['distinct'],
+        'top_values': [{'value': item['value'], 'count': item['n']} for item in top_values[:TERM_STATS_TOP_VALUES]],
+        'numeric': None
+    }
+
+    numeric = numeric_tags.aggregate(
+        count=Count('pk'),
+        min=Min('numeric_value'),
+        max=Max('numeric_value'),
+        mean=Avg('numeric_value')
+    )
+    # the sample SD is undefined for a single value (and raises an error on some backends)
+    numeric['std'] = None
+    if numeric['count'] > 1:
+        numeric['std'] = numeric_tags.aggregate(std=StdDev('numeric_value', sample=True))['std']
+    if numeric['count']:
+        numeric_values = numeric_tags.order_by('numeric_value').values_list('numeric_value', flat=True)
+        numeric['quantiles'] = [
+            {'q': q, 'value': quantile(numeric_values, numeric['count'], q)} for q in TERM_STATS_QUANTILES
+        ]
+        numeric['histogram'] = histogram(numeric_tags, numeric['min'], numeric['max'], bins=bins)
+        numeric['max_bin_count'] = max(item['count'] for item in numeric['histogram'])
+        stats['numeric'] = numeric
+
+    return stats
+
+
+def term_stats(term, user):
+    """The statistics of the values of term that user can view, cached until one of these tags changes"""
+    tags = term_stats_queryset(term, user)
+    key = term_stats_cache_key(term, tags, user)
+    stats = cache.get(key)
+    if stats is None:
+        stats = calculate_term_stats(term, tags)
+        cache.set(key, stats, TERM_STATS_CACHE_TIMEOUT)
+    return stats
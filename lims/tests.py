@@ -1,18 +1,53 @@
 
+import io
+import os
 import re
+import csv
 import json
+import shutil
+import hashlib
 import datetime
+import tempfile
+import time
+import threading
 
+from html import unescape
 from random import randint
-from django.test import TestCase
+from concurrent.futures import Future
+from unittest import mock, skipUnless
+from importlib.util import find_spec
+from django.test import TestCase, TransactionTestCase, RequestFactory, override_settings
 from django.http import QueryDict
 from django.utils import timezone
-from django.db import transaction
+from django.db import transaction, connection, IntegrityError
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
 from django.contrib.staticfiles import finders
-
-from .models import Sample, SampleTag, Term, Project, ProjectPermission, Attachment
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.cache import cache
+from django.urls import reverse
+
+from reversion.models import Revision, Version
+
+from .bulk import import_samples, ImportValidationError, bulk_delete
+from .delta import delta_export, parse_delta_cursor, format_delta_cursor, DeltaError
+from .jobs import submit_job, resolve_job_function, run_job
+from .stats import term_stats
+from .export import export_csv, export_npz, export_feather, numeric_terms, ExportError, SAMPLE_EXPORT_FIELDS, \
+    long_export_tag_terms, long_export_header, iter_long_export_rows, iter_export_rows, export_geopackage, \
+    iter_geojson, unique_export_header
+from .models import Sample, SampleTag, Term, TermValidator, Project, ProjectPermission, Attachment, AttachmentPreview, Job, \
+    SelectionSet, AttachmentUpload, Tombstone
+from .views import SampleDeleteView, SampleExportView, ProjectDetailView, SampleDetailView
+from .views.actions import export_response, selection_queryset
+from .workers import in_worker
+from .widgets.data_widget import query_string_filter, query_string_paginate, can_evaluate_concurrently, \
+    evaluate_bound_widgets, BoundDataWidget, SampleDataWidget, TermDataWidget, ProjectDataWidget, TermField, \
+    compile_data_widget
+from .utils.files import ConcatenatedReader
+from .utils.tag_values import TagFilterError
 
 
 def populate_halifax_lakes_data(test_user=None, test_proj=None, quiet=False, clear=True, max_data=100):
@@ -369,6 +404,27 @@ class GeometryTestCase(TestCase):
         with self.assertRaisesRegex(ValidationError, "The value is not valid"):
             validate_wkt('not valid wkt')
 
+    def test_parse_wkt(self):
+        from .utils.geometry import parse_wkt, geometry_bounds, WKTError
+
+        self.assertEqual(parse_wkt('POINT (30 10)'), {'type': 'Point', 'coordinates': [30, 10]})
+        self.assertEqual(
+            parse_wkt('polygon((30 10, 40 40, 10 20, 30 10))'),
+            {'type': 'Polygon', 'coordinates': [[[30, 10], [40, 40], [10, 20], [30, 10]]]}
+        )
+        self.assertEqual(parse_wkt('MULTIPOINT ((10 40), (40 30))'), parse_wkt('MULTIPOINT (10 40, 40 30)'))
+        self.assertEqual(
+            parse_wkt('MULTIPOLYGON (((30 20, 45 40, 10 40, 30 20)), ((15 5, 40 10, 10 20, 15 5)))')['type'],
+            'MultiPolygon'
+        )
+        self.assertEqual(geometry_bounds(parse_wkt('LINESTRING (30 10, 10 30, 40 40)')), (10, 40, 10, 40))
+        self.assertIsNone(parse_wkt('POINT EMPTY'))
+        self.assertIsNone(parse_wkt(''))
+
+        for value in ('not valid wkt', 'POINT (30)', 'POINT (30 10', 'LINESTRING ((30 10, 10 30))', 'POINT (1 2) 3'):
+            with self.assertRaises(WKTError):
+                parse_wkt(value)
+
 
 class SampleRecursionTestCase(TestCase):
 
@@ -441,6 +497,88 @@ class TagsTestCase(TestCase):
             sample_tag_numeric_bad = SampleTag(object=self.sample, key=self.number_term, value='AAA')
             sample_tag_numeric_bad.full_clean()
 
+    def test_typed_values(self):
+        self.sample.set_tags(**{'generic-tag': '2025-01-02', 'number-tag': '6.5'})
+        date_tag = self.sample.tags.get(key__slug='generic-tag')
+        self.assertEqual(date_tag.datetime_value, timezone.make_aware(datetime.datetime(2025, 1, 2)))
+        self.assertIsNone(date_tag.numeric_value)
+        number_tag = self.sample.tags.get(key__slug='number-tag')
+        self.assertEqual(number_tag.numeric_value, 6.5)
+        self.assertIsNone(number_tag.datetime_value)
+
+        self.sample.set_tags(**{'generic-tag': 'TRUE'})
+        bool_tag = self.sample.tags.get(key__slug='generic-tag')
+        self.assertIs(bool_tag.boolean_value, True)
+        self.assertEqual(bool_tag.numeric_value, 1)
+        self.assertIsNone(bool_tag.datetime_value)
+
+    def test_tag_range_filters(self):
+        other = Sample.objects.create(project=self.sample.project, collected=timezone.now(), name='other sample')
+        self.sample.set_tags(**{'number-tag': '6.5', 'generic-tag': '2025-03-01'})
+        other.set_tags(**{'number-tag': '12', 'generic-tag': '2024-12-31'})
+
+        def filtered(query_string):
+            queryset = query_string_filter(Sample.objects.all(), QueryDict(query_string), prefix='dv_')
+            return set(queryset.values_list('name', flat=True))
+
+        self.assertEqual(filtered('dv_tag__number-tag__range=6,7'), {'a sample'})
+        self.assertEqual(filtered('dv_tag__number-tag__gte=6&dv_tag__number-tag__lte=100'), {'a sample', 'other sample'})
+        self.assertEqual(filtered('dv_tag__number-tag__gt=7'), {'other sample'})
+        self.assertEqual(filtered('dv_tag__generic-tag__gt=2025-01-01'), {'a sample'})
+        self.assertEqual(filtered('dv_tag__generic-tag=2024-12-31'), {'other sample'})
+        self.assertEqual(filtered('dv_tag__number-tag__gt=7&dv_tag__generic-tag__gt=2025-01-01'), set())
+        # values that can't be compared are ignored
+        self.assertEqual(filtered('dv_tag__number-tag__gt=abc'), {'a sample', 'other sample'})
+
+        # the filter is an EXISTS subquery, so it combines with pagination and counts
+        queryset = query_string_filter(Sample.objects.all(), QueryDict('dv_tag__number-tag__lt=100'), prefix='dv_')
+        self.assertEqual(queryset.count(), 2)
+        self.assertIn('EXISTS', str(queryset.query))
+
+    def test_tag_filter_expressions(self):
+        other = Sample.objects.create(project=self.sample.project, collected=timezone.now(), name='other sample')
+        third = Sample.objects.create(project=self.sample.project, collected=timezone.now(), name='third sample')
+        self.sample.set_tags(**{'number-tag': '6.5', 'generic-tag': 'Bedford'})
+        other.set_tags(**{'number-tag': '12', 'generic-tag': 'Bedford Basin'})
+        third.set_tags(**{'generic-tag': 'Bedford'})
+
+        def filtered(expression):
+            query_dict = QueryDict(mutable=True)
+            query_dict['dv_filter'] = expression
+            queryset = query_string_filter(Sample.objects.all(), query_dict, prefix='dv_')
+            return set(queryset.values_list('name', flat=True))
+
+        self.assertEqual(filtered('t.number-tag>10'), {'other sample'})
+        self.assertEqual(filtered('t.number-tag>5 and t.generic-tag="Bedford"'), {'a sample'})
+        self.assertEqual(filtered('t.number-tag > 10 or t.generic-tag = "Bedford"'),
+                         {'a sample', 'other sample', 'third sample'})
+        self.assertEqual(filtered('t.generic-tag="Bedford" and not t.number-tag'), {'third sample'})
+        self.assertEqual(filtered('t.generic-tag!="Bedford"'), {'other sample'})
+        self.assertEqual(filtered('(t.number-tag<7 or t.number-tag>=12) and t.number-tag<=12'),
+                         {'a sample', 'other sample'})
+        self.assertEqual(filtered("t.generic-tag='Bedford Basin'"), {'other sample'})
+        self.assertEqual(filtered('t.no-such-term=1'), set())
+        # term slugs can contain dots
+        Term.objects.create(project=self.sample.project, name='Depth (m)', slug='depth.m')
+        other.set_tags(**{'depth.m': '1.5'})
+        self.assertEqual(filtered('t.depth.m>1'), {'other sample'})
+
+        # the filter is applied in the database query for the page
+        query_dict = QueryDict(mutable=True)
+        query_dict['dv_filter'] = 't.number-tag>5 and t.generic-tag=Bedford'
+        queryset = query_string_filter(Sample.objects.order_by('name'), query_dict, prefix='dv_')
+        with CaptureQueriesContext(connection) as queries:
+            page = query_string_paginate(queryset, query_dict, default_limit=1, prefix='dv_')
+            self.assertEqual([s.name for s in page], ['a sample'])
+        self.assertEqual(len(queries), 2)
+        self.assertIn('EXISTS', queries[1]['sql'])
+        self.assertIn('LIMIT', queries[1]['sql'])
+
+        for bad_expression in ('t.number-tag >', 'number-tag > 5', '(t.number-tag > 5', 't.number-tag > abc',
+                               't.number-tag > 5 t.generic-tag'):
+            with self.assertRaises(TagFilterError):
+                filtered(bad_expression)
+
 
 class SampleTestCase(TestCase):
 
@@ -497,6 +635,209 @@ class SampleTestCase(TestCase):
             self.assertEqual(n1, n2)
 
 
+class SampleImportTestCase(TestCase):
+
+    def setUp(self):
+        self.proj = Project.objects.create(name="Test Project", slug="test-proj")
+        self.user = User.objects.create(username="importer")
+        ProjectPermission.objects.create(project=self.proj, user=self.user, model='Sample', permission='edit')
+        self.parent = Sample.objects.create(project=self.proj, user=self.user, name='core')
+
+    def test_slug_allocation(self):
+        """Bulk slug allocation gives the same slugs as creating samples one at a time"""
+        from .bulk import SlugAllocator
+
+        now = timezone.now()
+        Sample.objects.create(project=self.proj, collected=now, user=self.user, name='repeat')
+        Sample.objects.create(project=self.proj, collected=now, user=self.user, name='repeat')
+
+        base = Sample(project=self.proj, collected=now, user=self.user, name='repeat').slug_base()
+        allocator = SlugAllocator(Sample.objects.all())
+        slugs = allocator.allocate([base] * 3) + allocator.allocate([base, base + '-new'])
+        self.assertEqual(slugs, [base + '__%d' % i for i in range(2, 6)] + [base + '-new'])
+
+    def test_import(self):
+        csv_text = 'name,collected,parent,depth_cm,lake\n' + ''.join(
+            'slice %d,2018-07-01 12:00,%s,%d,%s\n' % (i, self.parent.slug, i, 'Bedford' if i % 2 else '')
+            for i in range(25)
+        )
+        n_samples, n_tags = import_samples(io.StringIO(csv_text), self.proj, self.user, batch_size=10)
+        self.assertEqual((n_samples, n_tags), (25, 37))
+
+        samples = Sample.objects.filter(parent=self.parent)
+        self.assertEqual(samples.count(), 25)
+        self.assertEqual(len(set(samples.values_list('slug', flat=True))), 25)
+        sample = samples.get(name='slice 3')
+        self.assertEqual(sample.recursive_depth, 1)
+        self.assertEqual(sample.get_tags(), {'depth_cm': '3', 'lake': 'Bedford'})
+        self.assertEqual(sample.tags.get(key__slug='depth_cm').numeric_value, 3)
+
+    def test_large_batches(self):
+        # more rows in a batch than SQLite allows in one INSERT
+        csv_text = 'name,depth_cm\n' + ''.join('row %d,%d\n' % (i, i) for i in range(600))
+        self.assertEqual(import_samples(io.StringIO(csv_text), self.proj, self.user), (600, 600))
+
+    def test_import_errors(self):
+        Term.objects.create(project=self.proj, name='depth_cm', taxonomy='Sample').term_validators.create(
+            validator_class='Float'
+        )
+        csv_text = 'name,collected,depth_cm\na,2018-07-01,1\nb,not a date,2\nc,2018-07-01,deep\n'
+        with self.assertRaises(ImportValidationError) as e:
+            import_samples(io.StringIO(csv_text), self.proj, self.user)
+        self.assertEqual([(line, column) for line, column, messages in e.exception.import_errors],
+                         [(3, 'collected'), (4, 'depth_cm')])
+        self.assertEqual(Sample.objects.filter(project=self.proj).count(), 1)
+
+        # validating a file doesn't create the terms for its columns
+        n_terms = Term.objects.count()
+        with self.assertRaises(ImportValidationError) as e:
+            import_samples(io.StringIO('name,collected,new_column\na,not a date,1\n'), self.proj, self.user)
+        self.assertEqual(e.exception.new_terms, ['new_column'])
+        self.assertEqual(Term.objects.count(), n_terms)
+
+    def test_import_view(self):
+        self.client.force_login(self.user)
+        upload = ContentFile(b'name\tgeometry\tph\nlake1\tPOINT (1 2)\t7.1\n', name='samples.tsv')
+        response = self.client.post('/lims/project/%s/sample/import/' % self.proj.pk,
+                                    {'file': upload, 'status': 'published'})
+        self.assertEqual(response.status_code, 302)
+        sample = Sample.objects.get(name='lake1')
+        self.assertEqual(sample.status, 'published')
+        self.assertEqual(sample.geo_xmin, 1)
+        self.assertEqual(sample.get_tag('ph'), '7.1')
+
+
+class CompiledTermTestCase(TestCase):
+
+    def test_compiled_term_cache(self):
+        term = Term.objects.create(name='Depth', slug='depth', taxonomy='Sample')
+        TermValidator.objects.create(term=term, validator_class='Float')
+
+        # freshly loaded instances of the same term share validators, widgets, and fields
+        field = Term.objects.get(pk=term.pk).field
+        fresh_term = Term.objects.get(pk=term.pk)
+        with self.assertNumQueries(0):
+            self.assertIs(fresh_term.field, field)
+        with self.assertRaises(ValidationError):
+            field.clean('not a number')
+
+        # changing the validators recompiles the term
+        TermValidator.objects.filter(term=term).delete()
+        TermValidator.objects.create(term=term, validator_class='Integer')
+        field = Term.objects.get(pk=term.pk).field
+        field.clean('10')
+        with self.assertRaises(ValidationError):
+            field.clean('10.5')
+
+    def test_validate_values(self):
+        term = Term.objects.create(name='Depth', slug='depth', taxonomy='Sample')
+        TermValidator.objects.create(term=term, order=0, validator_class='Regex',
+                                     validator_arguments='{"regex": "^[0-9.e-]+$"}')
+        TermValidator.objects.create(term=term, order=1, validator_class='MinValue',
+                                     validator_arguments='{"limit_value": 0}')
+        TermValidator.objects.create(term=term, order=2, validator_class='MaxValue',
+                                     validator_arguments='{"limit_value": 100.5}')
+        TermValidator.objects.create(term=term, order=3, validator_class='Integer')
+        term = Term.objects.get(pk=term.pk)
+
+        values = ['1', ' 50 ', '', None, '100.5', '101', '-1', '1e3', 'deep', '[1]', 'a\x00b', 'nan', '-']
+        errors = term.validate_values(values)
+
+        # the same values, one at a time
+        expected = {}
+        for i, value in enumerate(values):
+            try:
+                term.field.clean(value)
+            except ValidationError as e:
+                expected[i] = e.messages
+
+        self.assertEqual(dict(errors), expected)
+        self.assertEqual(list(errors.keys()), [4, 5, 6, 7, 8, 9, 10, 11, 12])
+        self.assertEqual(errors[5], ['Ensure this value is less than or equal to 100.5.'])
+        self.assertEqual(errors[7], ['Ensure this value is less than or equal to 100.5.',
+                                     'Value cannot be converted to an integer'])
+
+
+class TermStatsTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.proj = Project.objects.create(name="Test Project", slug="test-proj")
+        self.user = User.objects.create(username="stats_user")
+        ProjectPermission.objects.create(project=self.proj, user=self.user, model='Sample', permission='view')
+        for i, value in enumerate(['1', '2', '3', '4', '10', 'ND']):
+            sample = Sample.objects.create(project=self.proj, user=self.user, name='sample %s' % i)
+            sample.set_tags(depth_cm=value)
+        self.term = Term.objects.get(slug='depth_cm')
+
+    def test_term_stats(self):
+        stats = term_stats(self.term, self.user)
+        self.assertEqual(stats['model'], 'SampleTag')
+        self.assertEqual(stats['count'], 6)
+        self.assertEqual(stats['distinct'], 6)
+        numeric = stats['numeric']
+        self.assertEqual(numeric['count'], 5)
+        self.assertEqual((numeric['min'], numeric['max'], numeric['mean']), (1, 10, 4))
+        self.assertEqual([item['value'] for item in numeric['quantiles']], [2, 3, 4])
+        self.assertEqual(sum(item['count'] for item in numeric['histogram']), 5)
+        self.assertEqual([item['count'] for item in numeric['histogram'][:5]], [1, 0, 1, 0, 1])
+        self.assertEqual(numeric['histogram'][-1]['count'], 1)
+        self.assertEqual(numeric['histogram'][-1]['max'], 10)
+
+        # cached until a tag with this key changes (checked with one query)
+        with self.assertNumQueries(1):
+            self.assertEqual(term_stats(self.term, self.user), stats)
+        Sample.objects.get(name='sample 5').set_tags(depth_cm='22')
+        stats = term_stats(self.term, self.user)
+        self.assertEqual(stats['numeric']['max'], 22)
+        self.assertEqual(stats['numeric']['count'], 6)
+
+        # the same statistics are available as JSON
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('lims:term_stats', kwargs={'pk': self.term.pk}))
+        self.assertEqual(json.loads(response.content.decode('utf-8'))['numeric']['max'], 22)
+        response = self.client.get(reverse('lims:term_detail', kwargs={'pk': self.term.pk}))
+        self.assertContains(response, 'Statistics')
+
+    def test_single_value(self):
+        # the sample standard deviation of one value is undefined (StdDev raises an error on SQLite)
+        Sample.objects.get(name='sample 0').set_tags(length_cm='7')
+        term = Term.objects.get(slug='length_cm')
+        numeric = term_stats(term, self.user)['numeric']
+        self.assertEqual((numeric['count'], numeric['min'], numeric['max']), (1, 7, 7))
+        self.assertIsNone(numeric['std'])
+        self.assertEqual([item['value'] for item in numeric['quantiles']], [7, 7, 7])
+        self.assertEqual(sum(item['count'] for item in numeric['histogram']), 1)
+
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('lims:term_detail', kwargs={'pk': term.pk}))
+        self.assertContains(response, 'Statistics')
+
+    def test_changed_by_another_process(self):
+        stats = term_stats(self.term, self.user)
+
+        # e.g., an import in another process, which can't clear this process' cache
+        sample = Sample.objects.get(name='sample 0')
+        SampleTag.objects.bulk_create([SampleTag(object=sample, key=self.term, value='100', numeric_value=100)])
+        self.assertEqual(term_stats(self.term, self.user)['count'], stats['count'] + 1)
+        SampleTag.objects.filter(value='100').update(value='101', numeric_value=101, modified=timezone.now())
+        self.assertEqual(term_stats(self.term, self.user)['numeric']['max'], 101)
+
+    def test_permissions(self):
+        other_proj = Project.objects.create(name="Other Project", slug="other-proj")
+        secret = Sample.objects.create(project=other_proj, user=self.user, name='secret')
+        SampleTag.objects.create(object=secret, key=self.term, value='secret value')
+
+        # only the values the user can view are counted (and cached separately from those of staff)
+        stats = term_stats(self.term, self.user)
+        self.assertEqual(stats['count'], 6)
+        self.assertNotIn('secret value', [item['value'] for item in stats['top_values']])
+        staff = User.objects.create(username='stats_staff', is_staff=True)
+        self.assertEqual(term_stats(self.term, staff)['count'], 7)
+        nobody = User.objects.create(username='stats_nobody')
+        self.assertEqual(term_stats(self.term, nobody)['count'], 0)
+
+
 class TestDataTestCase(TestCase):
 
     def setUp(self):
@@ -571,6 +912,1251 @@ class ProjectLayerTestCase(TestCase):
             news.full_clean()
 
 
+class AttachmentRelationTestCase(TestCase):
+
+    def setUp(self):
+        self.proj1 = Project.objects.create(name="Project 1", slug="project-1")
+        self.proj2 = Project.objects.create(name="Project 2", slug="project-2")
+        self.samples1 = [Sample.objects.create(project=self.proj1, name='s%d' % i) for i in range(5)]
+        self.sample2 = Sample.objects.create(project=self.proj2, name='other')
+        self.attachment = Attachment.objects.create(project=self.proj1, name='attachment1')
+
+    def test_add_related(self):
+        self.attachment.samples.add(*self.samples1)
+        self.assertEqual(self.attachment.samples.count(), 5)
+        self.attachment.save()
+
+        with self.assertRaisesRegex(ValidationError, 'At least one related sample is of a different project'):
+            with transaction.atomic():
+                self.attachment.samples.add(self.sample2)
+        self.assertEqual(self.attachment.samples.count(), 5)
+
+        with self.assertRaisesRegex(ValidationError, 'At least one related sample is of a different project'):
+            with transaction.atomic():
+                self.sample2.attachments.add(self.attachment)
+        self.assertEqual(self.attachment.samples.count(), 5)
+
+    def test_invalid_relation_ids(self):
+        self.attachment.samples.add(*self.samples1)
+        self.assertEqual(self.attachment.invalid_relation_ids('samples'), [])
+        self.assertEqual(
+            self.attachment.invalid_relation_ids('samples', [s.pk for s in self.samples1] + [self.sample2.pk]),
+            [self.sample2.pk]
+        )
+
+        # one query per relation regardless of the number of related objects
+        with self.assertNumQueries(4):
+            self.attachment.validate_relations()
+
+
+class TemporaryMediaMixin:
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+
+        self.user = User.objects.create(username='uploader')
+        self.proj = Project.objects.create(name='Upload Project', slug='upload-project')
+        ProjectPermission.objects.create(project=self.proj, user=self.user, model='Attachment', permission='edit')
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+
+class AttachmentUploadTestCase(TemporaryMediaMixin, TestCase):
+
+    def test_chunked_upload(self):
+        self.client.force_login(self.user)
+        content = b''.join(b'line %d\n' % i for i in range(1000))
+        chunks = [content[i:(i + 1000)] for i in range(0, len(content), 1000)]
+
+        init = self.client.post(
+            '/lims/project/%s/attachment/upload/' % self.proj.pk,
+            {'filename': 'data.txt', 'size': len(content)}
+        ).json()
+        upload_id = init['upload_id']
+        self.assertEqual(init['received_chunks'], [])
+
+        # send chunks out of order, and one of them twice
+        for index in reversed(range(len(chunks))):
+            response = self.client.put(
+                '/lims/attachment/upload/%s/chunk/%s' % (upload_id, index),
+                chunks[index],
+                content_type='application/octet-stream'
+            ).json()
+            self.assertEqual(response['size'], len(chunks[index]))
+        self.client.put('/lims/attachment/upload/%s/chunk/0' % upload_id, chunks[0],
+                        content_type='application/octet-stream')
+
+        status = self.client.get('/lims/attachment/upload/%s' % upload_id).json()
+        self.assertEqual(status['received_chunks'], list(range(len(chunks))))
+        self.assertEqual(status['received_size'], len(content))
+
+        final = self.client.post('/lims/attachment/upload/%s/finalize/' % upload_id).json()
+        attachment = Attachment.objects.get(pk=final['attachment_id'])
+        self.assertEqual(attachment.file_hash, hashlib.sha256(content).hexdigest())
+        self.assertEqual(attachment.mime_type, 'text/plain')
+        self.assertEqual(attachment.user, self.user)
+        with attachment.file.open('rb') as f:
+            self.assertEqual(f.read(), content)
+
+    def test_missing_chunks(self):
+        self.client.force_login(self.user)
+        init = self.client.post(
+            '/lims/project/%s/attachment/upload/' % self.proj.pk,
+            {'filename': 'data.bin'}
+        ).json()
+        self.client.put('/lims/attachment/upload/%s/chunk/1' % init['upload_id'], b'abc',
+                        content_type='application/octet-stream')
+        final = self.client.post('/lims/attachment/upload/%s/finalize/' % init['upload_id']).json()
+        self.assertIn('missing', final['error'])
+        self.assertEqual(Attachment.objects.count(), 0)
+
+    def test_failed_chunk(self):
+        upload = AttachmentUpload.objects.create(project=self.proj, user=self.user, filename='data.bin')
+        upload.write_chunk(0, io.BytesIO(b'abc'))
+        chunk_dir = os.path.join(self.media_root, 'attachment_uploads')
+
+        # a re-sent chunk that is too large keeps the previous version (and leaves no file behind)
+        with self.assertRaises(ValueError):
+            upload.write_chunk(0, io.BytesIO(b'abcdefgh'), max_size=5)
+        chunk = upload.chunks.get()
+        self.assertEqual(chunk.size, 3)
+        self.assertEqual(os.listdir(chunk_dir), [os.path.basename(chunk.file.name)])
+
+        # a chunk that another request wrote first is reported rather than raising an IntegrityError
+        with mock.patch.object(AttachmentUpload, 'save', side_effect=IntegrityError('duplicate')):
+            with self.assertRaisesRegex(ValueError, 'another request'):
+                upload.write_chunk(0, io.BytesIO(b'xyz'))
+        self.assertEqual(len(os.listdir(chunk_dir)), 1)
+
+        upload.write_chunk(0, io.BytesIO(b'abcd'))
+        self.assertEqual(upload.chunks.get().size, 4)
+        self.assertEqual(len(os.listdir(chunk_dir)), 1)
+
+        upload.finalize()
+        self.assertEqual(os.listdir(chunk_dir), [])
+        with self.assertRaisesRegex(ValidationError, 'already'):
+            AttachmentUpload.objects.get(pk=upload.pk).finalize()
+        self.assertEqual(Attachment.objects.count(), 1)
+
+    def test_changed_during_finalize(self):
+        upload = AttachmentUpload.objects.create(project=self.proj, user=self.user, filename='data.bin')
+        upload.write_chunk(0, io.BytesIO(b'abc'))
+        attachment_dir = os.path.join(self.media_root, 'attachments')
+
+        # the file is written before the upload is locked, so a chunk can be re-sent meanwhile
+        def resend_chunk(files):
+            content = ConcatenatedReader(files).read()
+            upload.write_chunk(0, io.BytesIO(b'xyz'))
+            return io.BytesIO(content)
+
+        with mock.patch('lims.models.ConcatenatedReader', side_effect=resend_chunk):
+            with self.assertRaisesRegex(ValidationError, 'changed'):
+                upload.finalize()
+        self.assertEqual(Attachment.objects.count(), 0)
+        self.assertEqual(os.listdir(attachment_dir), [])
+
+        attachment = upload.finalize()
+        with attachment.file.open('rb') as f:
+            self.assertEqual(f.read(), b'xyz')
+
+
+class AttachmentPreviewTestCase(TemporaryMediaMixin, TestCase):
+
+    def test_text_preview(self):
+        content = b''.join(b'col1,col2\n' if i == 0 else b'%d,%d\n' % (i, i * 2) for i in range(100))
+        attachment = Attachment(project=self.proj, name='data')
+        attachment.file.save('data.csv', ContentFile(content), save=False)
+        attachment.save()
+        duplicate = Attachment(project=self.proj, name='data again')
+        duplicate.file.save('data2.csv', ContentFile(content), save=False)
+        duplicate.save()
+
+        call_command('generate_attachment_previews', processes=0, stdout=io.StringIO())
+
+        attachment.refresh_from_db()
+        duplicate.refresh_from_db()
+        self.assertEqual(attachment.file_hash, hashlib.sha256(content).hexdigest())
+        self.assertEqual(duplicate.file_hash, attachment.file_hash)
+        self.assertEqual(AttachmentPreview.objects.count(), 1)
+
+        preview = attachment.get_preview()
+        self.assertEqual(preview.preview_type, 'text')
+        self.assertEqual(preview.text.splitlines()[:2], ['col1,col2', '1,2'])
+
+        self.client.force_login(User.objects.create(username='staffer', is_staff=True))
+        response = self.client.get('/lims/attachment/')
+        self.assertContains(response, 'attachment-text-preview')
+
+    def test_failed_preview(self):
+        content = b'not really an image'
+        attachment = Attachment(project=self.proj, name='image', mime_type='image/png')
+        attachment.file.save('image.png', ContentFile(content), save=False)
+        attachment.save()
+
+        # e.g., Pillow's DecompressionBombError, which is not an IOError
+        with mock.patch('lims.utils.previews.image_thumbnail', side_effect=RuntimeError('bomb')):
+            call_command('generate_attachment_previews', processes=0, stdout=io.StringIO(), stderr=io.StringIO())
+
+        preview = AttachmentPreview.objects.get(file_hash=hashlib.sha256(content).hexdigest())
+        self.assertEqual(preview.preview_type, 'none')
+        self.assertEqual(preview.error, 'bomb')
+
+        # errors before the file is hashed are returned too
+        from .management.commands.generate_attachment_previews import preview_task
+        with mock.patch('lims.management.commands.generate_attachment_previews.generate_preview',
+                        side_effect=MemoryError()):
+            self.assertEqual(preview_task('image.png', 'image/png', 'abc')['error'], 'MemoryError')
+
+
+class JobTestCase(TemporaryMediaMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        ProjectPermission.objects.create(project=self.proj, user=self.user, model='Sample', permission='edit')
+        self.samples = [
+            Sample.objects.create(project=self.proj, user=self.user, name='sample %d' % i, collected=timezone.now())
+            for i in range(5)
+        ]
+        self.ids = '&'.join('id__in=%s' % sample.pk for sample in self.samples)
+        self.client.force_login(self.user)
+
+    def test_bulk_delete_job(self):
+        with mock.patch.object(SampleDeleteView, 'job_threshold', 2), \
+                mock.patch.object(SampleDeleteView, 'job_chunk_size', 2):
+            response = self.client.post('/lims/sample/action/delete?' + self.ids)
+
+            job = Job.objects.get()
+            self.assertRedirects(response, job.get_absolute_url())
+            self.assertEqual(job.status, 'queued')
+            self.assertEqual(Sample.objects.filter(project=self.proj).count(), 5)
+
+            call_command('run_jobs', processes=0, stdout=io.StringIO())
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'complete')
+        self.assertEqual(job.progress, 1)
+        self.assertEqual(job.messages.splitlines(), ['2 items were successfully deleted',
+                                                     '2 items were successfully deleted',
+                                                     '1 items were successfully deleted'])
+        self.assertFalse(Sample.objects.filter(project=self.proj).exists())
+
+        response = self.client.get('/lims/job/%s/status/' % job.pk)
+        self.assertEqual(json.loads(response.content.decode('utf-8'))['status'], 'complete')
+
+    def test_export_job(self):
+        with mock.patch.object(SampleExportView, 'job_threshold', 2):
+            self.client.post('/lims/sample/action/export?' + self.ids)
+
+        call_command('run_jobs', processes=0, stdout=io.StringIO())
+        job = Job.objects.get()
+        self.assertEqual(job.status, 'complete')
+        self.assertTrue(job.result)
+
+        response = self.client.get('/lims/job/%s/result/' % job.pk)
+        content = b''.join(response.streaming_content).decode('utf-8')
+        self.assertEqual(len(content.strip().splitlines()), 6)
+
+        # other users can't see the job
+        self.client.force_login(User.objects.create(username='someone else'))
+        self.assertEqual(self.client.get(job.get_absolute_url()).status_code, 404)
+
+    def test_worker_pool(self):
+        from .management.commands.run_jobs import Command
+
+        # spawned workers set up Django and register the job functions before running anything
+        executor = Command().make_executor(1)
+        try:
+            self.assertIs(executor.submit(resolve_job_function, 'bulk_action').result(timeout=120),
+                          resolve_job_function('bulk_action'))
+            # so a job running in the worker doesn't start a process pool of its own
+            self.assertTrue(executor.submit(in_worker).result(timeout=120))
+        finally:
+            executor.shutdown()
+
+    def test_broken_pool(self):
+        from concurrent.futures.process import BrokenProcessPool
+
+        class BrokenExecutor(SyncExecutor):
+            def submit(self, fn, *args):
+                future = Future()
+                future.set_exception(BrokenProcessPool('A worker process terminated abruptly'))
+                return future
+
+        job = submit_job('bulk_action', self.user, action='delete', model='Sample', ids=[])
+        with mock.patch('lims.management.commands.run_jobs.Command.make_executor', return_value=BrokenExecutor()):
+            call_command('run_jobs', processes=1, stdout=io.StringIO())
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+        self.assertIn('BrokenProcessPool', job.errors)
+
+    def test_recover_stale_jobs(self):
+        now = timezone.now()
+        stale = Job.objects.create(user=self.user, name='bulk_action', status='running', started=now,
+                                   heartbeat=now - datetime.timedelta(hours=2))
+        running = Job.objects.create(user=self.user, name='bulk_action', status='running', started=now,
+                                     heartbeat=now)
+
+        call_command('run_jobs', processes=0, stdout=io.StringIO())
+        stale.refresh_from_db()
+        running.refresh_from_db()
+        self.assertEqual(stale.status, 'failed')
+        self.assertIn('stopped running', stale.errors)
+        self.assertEqual(running.status, 'running')
+
+    def test_recovered_job_finishes_late(self):
+        job = submit_job('bulk_action', self.user, action='delete', model='Sample', ids=[self.samples[0].pk])
+        Job.objects.filter(pk=job.pk).update(status='running', started=timezone.now())
+
+        # another runner recovers the job as stale while its worker is still running it
+        def recover_while_running(job, **params):
+            Job.objects.filter(pk=job.pk).update(status='failed', errors='The job stopped running')
+
+        with mock.patch.dict('lims.jobs._jobs', bulk_action=recover_while_running):
+            self.assertEqual(run_job(job.pk), 'failed')
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+        self.assertEqual(job.errors, 'The job stopped running')
+
+
+    def test_inline_heartbeat(self):
+        from .management.commands.run_jobs import Command
+
+        job = submit_job('bulk_action', self.user, action='delete', model='Sample', ids=[])
+        Job.objects.filter(pk=job.pk).update(status='running', started=timezone.now())
+
+        # jobs run in the runner's process still record a heartbeat while they run
+        with mock.patch.dict('lims.jobs._jobs', bulk_action=lambda job, **params: time.sleep(0.2)), \
+                mock.patch('lims.management.commands.run_jobs.job_heartbeat') as heartbeat:
+            self.assertEqual(Command().run_with_heartbeat(job.pk, 0.01), 'complete')
+        heartbeat.assert_called_with(job.pk)
+
+
+class SyncExecutor:
+    """Runs submitted functions immediately (spawned processes can't see the test database)"""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def submit(self, fn, *args):
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+
+    def shutdown(self, wait=True):
+        pass
+
+
+class PartitionedExportTestCase(TemporaryMediaMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.samples = [
+            Sample.objects.create(project=self.proj, user=self.user, name='sample %d' % i, collected=timezone.now())
+            for i in range(5)
+        ]
+        for i, sample in enumerate(self.samples):
+            sample.set_tags(depth_cm=str(i))
+        self.samples[2].set_tags(depth_cm='2', lake='Bedford, NS')
+        self.queryset = Sample.objects.filter(project=self.proj)
+
+    def read_export(self, content):
+        return list(csv.reader(io.StringIO(content)))
+
+    def test_export(self):
+        out = io.StringIO()
+        with mock.patch('lims.export.ProcessPoolExecutor', SyncExecutor), \
+                mock.patch('lims.export.connections'):
+            export_csv(self.queryset, out, terms=Sample.get_all_terms(self.queryset), processes=2, chunk_size=2)
+        rows = self.read_export(out.getvalue())
+
+        self.assertEqual(rows[0][:6], list(SAMPLE_EXPORT_FIELDS))
+        self.assertEqual(sorted(rows[0][6:]), ['depth_cm', 'lake'])
+        self.assertEqual([row[0] for row in rows[1:]], [str(sample.pk) for sample in self.samples])
+        depth = rows[0].index('depth_cm')
+        lake = rows[0].index('lake')
+        self.assertEqual([row[depth] for row in rows[1:]], ['0', '1', '2', '3', '4'])
+        self.assertEqual([row[lake] for row in rows[1:]], ['NA', 'NA', 'Bedford, NS', 'NA', 'NA'])
+
+        # the same rows are exported in this process and by the bulk action
+        inline = io.StringIO()
+        export_csv(self.queryset, inline, terms=Sample.get_all_terms(self.queryset), processes=0, chunk_size=2)
+        self.assertEqual(inline.getvalue(), out.getvalue())
+
+        response = export_response(self.queryset.order_by('pk'), SAMPLE_EXPORT_FIELDS, Sample.get_all_terms(self.queryset))
+        self.assertEqual(b''.join(response.streaming_content).decode('utf-8'), out.getvalue())
+
+    def test_export_in_worker(self):
+        out = io.StringIO()
+        with mock.patch('lims.export.ProcessPoolExecutor', side_effect=AssertionError('nested pool')):
+            with mock.patch('lims.export.in_worker', return_value=True):
+                export_csv(self.queryset, out, processes=2, chunk_size=2)
+        self.assertEqual(len(self.read_export(out.getvalue())), 6)
+
+    def test_export_command(self):
+        out = io.StringIO()
+        call_command('export_samples', project=self.proj.slug, processes=0, chunk_size=2, stdout=out,
+                     stderr=io.StringIO())
+        self.assertEqual(len(self.read_export(out.getvalue())), 6)
+
+        call_command('export_samples', project=self.proj.slug, submit=self.user.username, stdout=io.StringIO())
+        call_command('run_jobs', processes=0, stdout=io.StringIO())
+        job = Job.objects.get()
+        self.assertEqual(job.name, 'export')
+        self.assertEqual(job.status, 'complete')
+        self.assertEqual(job.result.read().decode('utf-8').replace('\r\n', '\n'),
+                         out.getvalue().replace('\r\n', '\n'))
+
+
+class XlsxExportTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='xlsx_user', is_staff=True)
+        self.proj = Project.objects.create(name='Xlsx Project', slug='xlsx-project')
+        self.collected = timezone.make_aware(datetime.datetime(2019, 5, 1, 12, 30))
+        self.sample = Sample.objects.create(project=self.proj, user=self.user, name='2019-05-01',
+                                            collected=self.collected)
+        self.sample.set_tags(depth_cm='1.5', lake='Bedford')
+        self.ids = 'id__in=%s' % self.sample.pk
+        self.client.force_login(self.user)
+
+    def test_typed_rows(self):
+        queryset = Sample.objects.filter(pk=self.sample.pk)
+        terms = list(Sample.get_all_terms(queryset).order_by('slug'))
+        row = list(iter_export_rows(queryset, ('id', 'name', 'collected'), terms, typed=True))[0]
+        self.assertEqual(row, [self.sample.pk, '2019-05-01', datetime.datetime(2019, 5, 1, 12, 30), 1.5, 'Bedford'])
+
+    def test_typed_columns(self):
+        other = Sample.objects.create(project=self.proj, user=self.user, name='other')
+        self.sample.set_tags(depth_cm='1.5', lake='Bedford', code='00123', flag='true', count='7')
+        other.set_tags(depth_cm='2', code='5', flag='false', count='003')
+        Term.objects.get(slug='count').term_validators.create(validator_class='Integer')
+
+        # only columns of numeric terms, or of values that are unchanged as numbers, are numeric
+        queryset = Sample.objects.filter(pk__in=[self.sample.pk, other.pk]).order_by('pk')
+        terms = list(Sample.get_all_terms(queryset).order_by('slug'))
+        self.assertEqual([term.slug for term in terms], ['code', 'count', 'depth_cm', 'flag', 'lake'])
+        rows = list(iter_export_rows(queryset, ('name', ), terms, typed=True))
+        self.assertEqual(rows, [
+            ['2019-05-01', '00123', 7, 1.5, 'true', 'Bedford'],
+            ['other', '5', 3, 2, 'false', None]
+        ])
+
+    @skipUnless(find_spec('openpyxl'), 'openpyxl is not installed')
+    def test_xlsx(self):
+        from openpyxl import load_workbook
+
+        response = self.client.post('/lims/sample/action/export-xlsx?' + self.ids)
+        workbook = load_workbook(io.BytesIO(b''.join(response.streaming_content)))
+        rows = list(workbook.active.values)
+        self.assertEqual(rows[0][:6], SAMPLE_EXPORT_FIELDS)
+        values = dict(zip(rows[0], rows[1]))
+        self.assertEqual(values['name'], '2019-05-01')
+        self.assertEqual(values['collected'], datetime.datetime(2019, 5, 1, 12, 30))
+        self.assertEqual(values['depth_cm'], 1.5)
+        self.assertEqual(values['lake'], 'Bedford')
+
+    def test_missing_openpyxl(self):
+        with mock.patch.dict('sys.modules', {'openpyxl': None}):
+            response = self.client.post('/lims/sample/action/export-xlsx?' + self.ids)
+        self.assertContains(response, 'openpyxl is required')
+
+
+class LongExportTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='long_user', is_staff=True)
+        self.proj = Project.objects.create(name='Long Project', slug='long-project')
+        self.samples = [
+            Sample.objects.create(project=self.proj, user=self.user, name='long %d' % i) for i in range(2)
+        ]
+        self.samples[0].set_tags(depth_cm='1.5', lake='Bedford')
+        self.depth = self.samples[0].tags.get(key__slug='depth_cm')
+        self.depth.add_tags(unit='cm', method='ruler')
+        SampleTag.objects.filter(pk=self.depth.pk).update(comment='measured twice', user=self.user)
+        self.client.force_login(self.user)
+
+    def test_long_export(self):
+        queryset = Sample.objects.filter(project=self.proj)
+        tag_terms = list(long_export_tag_terms(queryset))
+        self.assertEqual([term.slug for term in tag_terms], ['method', 'unit'])
+
+        header = long_export_header(queryset, tag_terms)
+        self.assertEqual(header[:4], ['sample_id', 'sample_slug', 'sample_name', 'sample_collected'])
+        self.assertEqual(header[-2:], ['tag_method', 'tag_unit'])
+
+        # one query for all of the rows
+        with self.assertNumQueries(1):
+            rows = [dict(zip(header, row)) for row in iter_long_export_rows(queryset, tag_terms)]
+        self.assertEqual(len(rows), 2)
+        depth, lake = sorted(rows, key=lambda row: row['term'])
+        self.assertEqual(depth['sample_slug'], self.samples[0].slug)
+        self.assertEqual(depth['value'], '1.5')
+        self.assertEqual(depth['numeric_value'], '1.5')
+        self.assertEqual(depth['comment'], 'measured twice')
+        self.assertEqual(depth['user'], 'long_user')
+        self.assertEqual((depth['tag_method'], depth['tag_unit']), ('ruler', 'cm'))
+        self.assertEqual((lake['value'], lake['numeric_value'], lake['user']), ('Bedford', 'NA', 'NA'))
+        self.assertEqual((lake['tag_method'], lake['tag_unit']), ('NA', 'NA'))
+
+        ids = '&'.join('id__in=%s' % sample.pk for sample in self.samples)
+        response = self.client.post('/lims/sample/action/export-long?' + ids)
+        content = b''.join(response.streaming_content).decode('utf-8')
+        self.assertEqual(len(list(csv.reader(io.StringIO(content)))), 3)
+
+
+class DeltaExportTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='delta_user', is_staff=True)
+        self.proj = Project.objects.create(name='Delta Project', slug='delta-project')
+        self.samples = [
+            Sample.objects.create(project=self.proj, user=self.user, name='delta %d' % i) for i in range(3)
+        ]
+        self.samples[0].set_tags(depth_cm='1.5')
+        lag = mock.patch('lims.delta.DELTA_EXPORT_LAG', datetime.timedelta(0))
+        lag.start()
+        self.addCleanup(lag.stop)
+
+    def delta(self, cursor=None, **kwargs):
+        return delta_export(Sample, cursor, project=self.proj, **kwargs)
+
+    def test_delta(self):
+        delta = self.delta()
+        # in the order they were last modified (tagging the first sample saved it)
+        self.assertEqual(
+            [obj['id'] for obj in delta['objects']],
+            list(Sample.objects.order_by('modified', 'id').values_list('pk', flat=True))
+        )
+        self.assertEqual([(tag['term'], tag['value']) for tag in delta['tags']], [('depth_cm', '1.5')])
+        self.assertEqual(delta['deleted'], [])
+        self.assertTrue(delta['complete'])
+
+        # nothing has changed since the cursor
+        unchanged = self.delta(delta['cursor'])
+        self.assertEqual((unchanged['objects'], unchanged['tags'], unchanged['cursor']), ([], [], delta['cursor']))
+
+        # tags are followed even if the object isn't saved
+        self.samples[1].update_tags(depth_cm='2', save_object=False)
+        changed = self.delta(delta['cursor'])
+        self.assertEqual(changed['objects'], [])
+        self.assertEqual([tag['object_id'] for tag in changed['tags']], [self.samples[1].pk])
+
+        # deleted objects and tags come from their tombstones
+        bulk_delete(Sample.objects.filter(pk=self.samples[0].pk))
+        self.samples[1].update_tags(depth_cm='')
+        deleted = self.delta(changed['cursor'])
+        self.assertEqual(
+            sorted((item['model'], item['object_id']) for item in deleted['deleted'] if item['model'] == 'Sample'),
+            [('Sample', self.samples[0].pk)]
+        )
+        self.assertEqual(
+            [item['parent_id'] for item in deleted['deleted'] if item['model'] == 'SampleTag'],
+            [self.samples[1].pk]
+        )
+        self.assertEqual([obj['id'] for obj in deleted['objects']], [self.samples[1].pk])
+
+    def test_tombstones(self):
+        from .models import SampleTagTag
+
+        sample = self.samples[2]
+        sample.set_tags(depth_cm='1', lake='Bedford')
+        sample.tags.get(key__slug='lake').set_tags(note='checked')
+        tag_pks = sorted(sample.tags.values_list('pk', flat=True))
+
+        # replaced tags are recorded along with their own tags
+        sample.set_tags(depth_cm='2')
+        self.assertEqual(sorted(Tombstone.objects.filter(model='SampleTag').values_list('object_id', flat=True)),
+                         tag_pks)
+        self.assertEqual(Tombstone.objects.filter(model='SampleTagTag').count(), 1)
+
+        # deleting an instance records the object and the tags deleted by the cascade
+        sample_pk, tag_pk = sample.pk, sample.tags.get().pk
+        sample.delete()
+        self.assertEqual(list(Tombstone.objects.filter(model='Sample').values_list('object_id', 'project_id')),
+                         [(sample_pk, self.proj.pk)])
+        self.assertTrue(Tombstone.objects.filter(model='SampleTag', object_id=tag_pk, parent_id=sample_pk).exists())
+        self.assertFalse(SampleTagTag.objects.exists())
+
+    def test_pages(self):
+        ids = []
+        cursor = None
+        while True:
+            delta = self.delta(cursor, limit=2)
+            ids.extend(obj['id'] for obj in delta['objects'])
+            cursor = delta['cursor']
+            if delta['complete']:
+                break
+        self.assertEqual(sorted(ids), [sample.pk for sample in self.samples])
+
+        # recent changes are left for the next call
+        self.assertEqual(self.delta(lag=datetime.timedelta(seconds=60))['objects'], [])
+        # changes from transactions that are still open could be missed with a shorter lag
+        with mock.patch('lims.delta.DELTA_EXPORT_LAG', datetime.timedelta(seconds=60)):
+            self.assertEqual(self.delta()['objects'], [])
+            with self.assertRaises(DeltaError):
+                self.delta(lag=datetime.timedelta(seconds=1))
+
+    def test_cursor(self):
+        cursors = parse_delta_cursor(self.delta()['cursor'])
+        last_modified = Sample.objects.order_by('modified', 'id').last()
+        self.assertEqual(cursors['objects'], (last_modified.modified, last_modified.pk))
+        self.assertEqual(parse_delta_cursor(format_delta_cursor(cursors)), cursors)
+        with self.assertRaises(DeltaError):
+            parse_delta_cursor('not a cursor')
+
+    def test_view(self):
+        self.client.force_login(self.user)
+        delta = self.client.get('/lims/sample/delta/?project=%s' % self.proj.pk).json()
+        self.assertEqual(len(delta['objects']), 3)
+        self.assertIn('error', self.client.get('/lims/sample/delta/?cursor=not-a-cursor').json())
+        self.assertIn('error', self.client.get('/lims/user/delta/').json())
+
+        # users only see changes to objects they can view
+        other_user = User.objects.create(username='delta_other_user')
+        self.client.force_login(other_user)
+        with mock.patch('lims.delta.DELTA_EXPORT_LAG', datetime.timedelta(0)):
+            self.assertEqual(self.client.get('/lims/sample/delta/').json()['objects'], [])
+            ProjectPermission.objects.create(project=self.proj, user=other_user, model='Sample', permission='view')
+            self.assertEqual(len(self.client.get('/lims/sample/delta/').json()['objects']), 3)
+
+
+class GeoExportTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='geo_user', is_staff=True)
+        self.proj = Project.objects.create(name='Geo Project', slug='geo-project')
+        self.located = Sample.objects.create(project=self.proj, user=self.user, name='located',
+                                             geometry='POINT (-64.36 45.09)')
+        self.located.set_tags(depth_cm='1.5')
+        self.unlocated = Sample.objects.create(project=self.proj, user=self.user, name='unlocated')
+        self.ids = 'id__in=%s&id__in=%s' % (self.located.pk, self.unlocated.pk)
+        self.client.force_login(self.user)
+
+    def test_geojson(self):
+        response = self.client.post('/lims/sample/action/export-geojson?' + self.ids)
+        collection = json.loads(b''.join(response.streaming_content).decode('utf-8'))
+        self.assertEqual(collection['type'], 'FeatureCollection')
+        features = {feature['properties']['name']: feature for feature in collection['features']}
+        self.assertEqual(features['located']['geometry'], {'type': 'Point', 'coordinates': [-64.36, 45.09]})
+        self.assertEqual(features['located']['properties']['depth_cm'], 1.5)
+        self.assertIsNone(features['unlocated']['geometry'])
+        self.assertIsNone(features['unlocated']['properties']['depth_cm'])
+
+    def test_geopackage(self):
+        import sqlite3
+
+        path = os.path.join(tempfile.mkdtemp(), 'export.gpkg')
+        queryset = Sample.objects.filter(project=self.proj).order_by('pk')
+        export_geopackage(queryset, path, terms=Sample.get_all_terms(queryset))
+        connection = sqlite3.connect(path)
+        try:
+            self.assertEqual(connection.execute('PRAGMA application_id').fetchone()[0], 0x47504B47)
+            self.assertEqual(
+                connection.execute('SELECT min_x, max_y FROM gpkg_contents').fetchone(), (-64.36, 45.09)
+            )
+            rows = connection.execute('SELECT name, depth_cm, geom FROM samples ORDER BY fid').fetchall()
+        finally:
+            connection.close()
+            shutil.rmtree(os.path.dirname(path))
+
+        self.assertEqual([row[:2] for row in rows], [('located', '1.5'), ('unlocated', None)])
+        self.assertEqual(rows[0][2][:2], b'GP')
+        self.assertIsNone(rows[1][2])
+
+        with self.assertRaises(ExportError):
+            export_geopackage(queryset, os.path.abspath(__file__))
+
+        response = self.client.post('/lims/sample/action/export-gpkg?' + self.ids)
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'SQLite format 3'))
+
+    def test_duplicate_columns(self):
+        import sqlite3
+
+        # terms can have the same name as a field or a GeoPackage column
+        self.located.set_tags(depth_cm='1.5', name='alias', geom='core')
+        id_term = Term.objects.create(project=self.proj, name='ID', slug='ID')
+        SampleTag.objects.create(object=self.located, key=id_term, value='A1')
+        queryset = Sample.objects.filter(project=self.proj).order_by('pk')
+        terms = list(Sample.get_all_terms(queryset).order_by('slug'))
+        self.assertEqual(unique_export_header(SAMPLE_EXPORT_FIELDS, terms, reserved=['fid', 'geom'])[-4:],
+                         ['tag_ID', 'depth_cm', 'tag_geom', 'tag_name'])
+
+        collection = json.loads(''.join(iter_geojson(queryset, terms=terms)))
+        properties = collection['features'][0]['properties']
+        self.assertEqual((properties['id'], properties['tag_ID']), (self.located.pk, 'A1'))
+        self.assertEqual((properties['name'], properties['tag_name'], properties['geom']), ('located', 'alias', 'core'))
+
+        path = os.path.join(tempfile.mkdtemp(), 'export.gpkg')
+        export_geopackage(queryset, path, terms=terms)
+        connection = sqlite3.connect(path)
+        try:
+            row = connection.execute('SELECT id, tag_ID, name, tag_name, tag_geom FROM samples ORDER BY fid').fetchone()
+        finally:
+            connection.close()
+            shutil.rmtree(os.path.dirname(path))
+        self.assertEqual(row, (self.located.pk, 'A1', 'located', 'alias', 'core'))
+
+
+class MatrixExportTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='matrix_user', is_staff=True)
+        self.proj = Project.objects.create(name='Matrix Project', slug='matrix-project')
+        self.samples = [
+            Sample.objects.create(project=self.proj, user=self.user, name='matrix %d' % i) for i in range(3)
+        ]
+        self.samples[0].set_tags(depth_cm='1.5', ph='7')
+        self.samples[1].set_tags(depth_cm='2.5', lake='Bedford')
+        self.queryset = Sample.objects.filter(project=self.proj)
+        self.client.force_login(self.user)
+
+    def test_numeric_terms(self):
+        self.assertEqual([term.slug for term in numeric_terms(self.queryset)], ['depth_cm', 'ph'])
+
+    @skipUnless(find_spec('numpy'), 'numpy is not installed')
+    def test_npz(self):
+        import numpy as np
+
+        out = io.BytesIO()
+        export_npz(self.queryset, out)
+        out.seek(0)
+        matrix = np.load(out)
+        self.assertEqual(matrix['id'].tolist(), [sample.pk for sample in self.samples])
+        self.assertEqual(matrix['term'].tolist(), ['depth_cm', 'ph'])
+        np.testing.assert_array_equal(matrix['values'], [[1.5, 7], [2.5, np.nan], [np.nan, np.nan]])
+
+        out = io.BytesIO()
+        export_npz(self.queryset, out, sparse=True)
+        out.seek(0)
+        matrix = np.load(out)
+        self.assertEqual(matrix['shape'].tolist(), [3, 2])
+        self.assertEqual(
+            sorted(zip(matrix['rows'].tolist(), matrix['columns'].tolist(), matrix['values'].tolist())),
+            [(0, 0, 1.5), (0, 1, 7), (1, 0, 2.5)]
+        )
+
+    @skipUnless(find_spec('numpy') and find_spec('pyarrow'), 'numpy and pyarrow are not installed')
+    def test_feather(self):
+        from pyarrow import feather
+
+        out = io.BytesIO()
+        export_feather(self.queryset, out)
+        out.seek(0)
+        table = feather.read_table(out)
+        self.assertEqual(table.column_names, ['id', 'slug', 'depth_cm', 'ph'])
+        self.assertEqual(table.column('slug').to_pylist(), [sample.slug for sample in self.samples])
+        self.assertEqual(table.column('depth_cm').to_pylist(), [1.5, 2.5, None])
+        self.assertEqual(table.column('ph').to_pylist(), [7, None, None])
+
+    def test_missing_dependencies(self):
+        with mock.patch.dict('sys.modules', {'numpy': None, 'pyarrow': None}):
+            with self.assertRaises(ExportError):
+                export_npz(self.queryset, io.BytesIO())
+            with self.assertRaises(ExportError):
+                export_feather(self.queryset, io.BytesIO())
+
+            ids = '&'.join('id__in=%s' % sample.pk for sample in self.samples)
+            response = self.client.post('/lims/sample/action/export-npz?' + ids)
+            self.assertContains(response, 'numpy is required')
+
+
+class BulkRevisionTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='reviser', is_staff=True)
+        self.proj = Project.objects.create(name='Revision Project', slug='revision-project')
+        self.samples = []
+        for i in range(3):
+            sample = Sample.objects.create(project=self.proj, user=self.user, name='sample %d' % i)
+            sample.set_tags(depth=str(i), lake='Bedford')
+            self.samples.append(sample)
+        self.ids = '&'.join('id__in=%s' % sample.pk for sample in self.samples)
+        self.client.force_login(self.user)
+
+    def test_publish_revision(self):
+        self.client.post('/lims/sample/action/publish?' + self.ids)
+        self.assertFalse(Sample.objects.filter(project=self.proj, status='draft').exists())
+
+        # one revision with the changed samples (and their project), but not their tags
+        revision = Revision.objects.get()
+        self.assertEqual(revision.user, self.user)
+        self.assertEqual(revision.version_set.filter(content_type__model='sample').count(), 3)
+        self.assertFalse(revision.version_set.filter(content_type__model='sampletag').exists())
+
+        version = Version.objects.get_for_object(self.samples[0]).get()
+        self.assertEqual(version.field_dict['status'], 'published')
+
+    def test_large_revision(self):
+        # more versions than SQLite allows in one INSERT
+        Sample.objects.bulk_create(
+            Sample(project=self.proj, user=self.user, name='many %d' % i, slug='many-%d' % i) for i in range(600)
+        )
+        selection = SelectionSet.objects.create(user=self.user, model='Sample')
+        selection.set_ids(Sample.objects.filter(name__startswith='many').values_list('pk', flat=True))
+        response = self.client.post('/lims/sample/action/publish?selection=%s' % selection.pk)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Revision.objects.get().version_set.filter(content_type__model='sample').count(), 600)
+
+    def test_publish_slugs(self):
+        # a draft whose slug is out of date (e.g., after a queryset update) gets a new one
+        Sample.objects.filter(pk=self.samples[0].pk).update(name='renamed')
+        taken = Sample.objects.create(project=self.proj, user=self.user, name='renamed',
+                                      collected=self.samples[0].collected)
+        slugs = [sample.slug for sample in self.samples]
+
+        self.client.post('/lims/sample/action/publish?' + self.ids)
+        for sample in self.samples:
+            sample.refresh_from_db()
+
+        self.assertEqual(self.samples[0].slug, taken.slug + '__1')
+        self.assertEqual([sample.slug for sample in self.samples[1:]], slugs[1:])
+
+    def test_delete_revision(self):
+        self.client.post('/lims/sample/action/delete?' + self.ids)
+        self.assertFalse(Sample.objects.filter(project=self.proj).exists())
+
+        self.assertEqual(Version.objects.get_deleted(Sample).count(), 3)
+        self.assertEqual(Version.objects.get_deleted(SampleTag).count(), 6)
+
+        Version.objects.get_deleted(Sample).get(object_id=str(self.samples[0].pk)).revert()
+        self.assertEqual(Sample.objects.get(pk=self.samples[0].pk).name, 'sample 0')
+
+
+class BulkDeleteTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='deleter')
+        self.proj = Project.objects.create(name='Delete Project', slug='delete-project')
+        ProjectPermission.objects.create(project=self.proj, user=self.user, model='Sample', permission='edit')
+        self.samples = []
+        for i in range(3):
+            sample = Sample.objects.create(project=self.proj, user=self.user, name='sample %d' % i)
+            sample.set_tags(depth=str(i))
+            sample.tags.get().set_tags(units='cm')
+            self.samples.append(sample)
+
+        self.attachment = Attachment.objects.create(project=self.proj, name='attached', file='attachments/a.txt')
+        self.attachment.samples.add(self.samples[0])
+        self.attachment.sample_tags.add(self.samples[1].tags.get())
+        self.client.force_login(self.user)
+
+    def test_bulk_delete(self):
+        ids = '&'.join('id__in=%s' % sample.pk for sample in self.samples)
+        response = self.client.post('/lims/sample/action/delete?' + ids)
+        self.assertRedirects(response, reverse('lims:sample_list'), fetch_redirect_response=False)
+
+        self.assertFalse(Sample.objects.filter(project=self.proj).exists())
+        self.assertFalse(SampleTag.objects.filter(object__project=self.proj).exists())
+        self.assertTrue(Attachment.objects.filter(pk=self.attachment.pk).exists())
+
+    def test_bulk_delete_queries(self):
+        def delete_queries(n):
+            samples = []
+            for i in range(n):
+                sample = Sample.objects.create(project=self.proj, user=self.user, name='queries %d' % i)
+                sample.set_tags(depth=str(i), lake='Bedford')
+                sample.tags.get(key__slug='depth').set_tags(units='cm')
+                samples.append(sample)
+            with CaptureQueriesContext(connection) as queries:
+                bulk_delete(Sample.objects.filter(pk__in=[sample.pk for sample in samples]))
+            self.assertEqual(Tombstone.objects.filter(model='Sample', object_id__in=[s.pk for s in samples]).count(), n)
+            return len(queries)
+
+        # objects, tags and their tombstones are deleted and written set-based, not row by row
+        self.assertEqual(delete_queries(4), delete_queries(2))
+        self.assertEqual(delete_queries(8), delete_queries(2))
+
+    def test_bulk_delete_many(self):
+        # more tombstones than SQLite allows in one INSERT
+        Sample.objects.bulk_create(
+            Sample(project=self.proj, user=self.user, name='many %d' % i, slug='many-%d' % i) for i in range(600)
+        )
+        selection = SelectionSet.objects.create(user=self.user, model='Sample')
+        selection.set_ids(Sample.objects.filter(name__startswith='many').values_list('pk', flat=True))
+        response = self.client.post('/lims/sample/action/delete?selection=%s' % selection.pk)
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Sample.objects.filter(name__startswith='many').exists())
+        self.assertEqual(Tombstone.objects.filter(model='Sample').count(), 600)
+
+    def test_bulk_delete_errors(self):
+        child = Sample.objects.create(project=self.proj, user=self.user, name='child', parent=self.samples[0])
+        response = self.client.post('/lims/sample/action/delete?id__in=%s' % self.samples[0].pk)
+        self.assertContains(response, 'could not be deleted due to relationships')
+        self.assertContains(response, child.slug)
+        self.assertTrue(Sample.objects.filter(pk=self.samples[0].pk).exists())
+        self.assertEqual(self.samples[0].tags.count(), 1)
+
+        other_proj = Project.objects.create(name='Other Project', slug='other-project')
+        other = Sample.objects.create(project=other_proj, name='other')
+        response = self.client.post('/lims/sample/action/delete?id__in=%s&id__in=%s' % (self.samples[1].pk, other.pk))
+        self.assertContains(response, 'You are not allowed to delete')
+        self.assertEqual(Sample.objects.filter(pk__in=[self.samples[1].pk, other.pk]).count(), 2)
+
+
+class SelectionSetTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='selector', is_staff=True)
+        self.proj = Project.objects.create(name='Selection Project', slug='selection-project')
+        self.keep = [Sample.objects.create(project=self.proj, user=self.user, name='keep %d' % i) for i in range(3)]
+        other_proj = Project.objects.create(name='Other Selection Project', slug='other-selection-project')
+        self.skip = [Sample.objects.create(project=other_proj, user=self.user, name='skip %d' % i) for i in range(2)]
+        self.client.force_login(self.user)
+
+    def test_explicit_selection(self):
+        data = {'action': 'publish'}
+        data.update({'object-%s-selected' % sample.pk: 'on' for sample in self.keep})
+        response = self.client.post('/lims/sample/action/', data)
+
+        selection = SelectionSet.objects.get()
+        self.assertRedirects(response, '/lims/sample/action/publish?selection=%s' % selection.pk)
+        self.assertEqual(selection.items.count(), 3)
+
+        response = self.client.get('/lims/sample/action/publish?selection=%s' % selection.pk)
+        self.assertContains(response, self.keep[0].slug)
+        self.assertNotContains(response, self.skip[0].slug)
+
+        self.client.post('/lims/sample/action/publish?selection=%s' % selection.pk)
+        self.assertEqual(Sample.objects.filter(status='published').count(), 3)
+
+        # selections belong to the user that made them
+        self.client.force_login(User.objects.create(username='someone else', is_staff=True))
+        response = self.client.get('/lims/sample/action/publish?selection=%s' % selection.pk)
+        self.assertEqual(response.status_code, 404)
+
+    def test_filter_selection(self):
+        response = self.client.post('/lims/sample/action/', {
+            'action': 'delete',
+            'select_all': '1',
+            'selection_data_widget': 'Sample',
+            'selection_query': 'project_id=%s&page_number=2' % self.proj.pk
+        })
+        selection = SelectionSet.objects.get()
+        self.assertTrue(selection.is_filter())
+
+        with mock.patch.object(SampleDeleteView, 'job_threshold', 2), \
+                mock.patch.object(SampleDeleteView, 'job_chunk_size', 2):
+            self.client.post(response.url)
+            selection.refresh_from_db()
+            self.assertFalse(selection.is_filter())
+            self.assertEqual(selection.items.count(), 3)
+
+            call_command('run_jobs', processes=0, stdout=io.StringIO())
+
+        self.assertEqual(Job.objects.get().status, 'complete')
+        self.assertEqual(set(Sample.objects.values_list('name', flat=True)), {'skip 0', 'skip 1'})
+
+    def selection_form(self, url):
+        content = self.client.get(url).content.decode('utf-8')
+        inputs = re.findall(r'name="(selection_[a-z_]+)" value="([^"]*)"', content)
+        data = {key: unescape(value) for key, value in inputs}
+        return dict(data, action='publish', select_all='1')
+
+    def test_child_table_selection(self):
+        parent = self.keep[0]
+        children = [Sample.objects.create(project=self.proj, user=self.user, name='child %d' % i, parent=parent)
+                    for i in range(12)]
+        for i, child in enumerate(children):
+            child.set_tags(depth_cm=str(i))
+        self.keep[1].set_tags(depth_cm='20')
+        response = self.client.get(reverse('lims:sample_detail', kwargs={'pk': parent.pk}))
+        url = [url.replace('&amp;', '&') for url in re.findall(r'data-url="([^"]+)"', response.content.decode('utf-8'))
+               if '/Sample/' in url][0]
+
+        # the selection keeps the restriction of the table (parent_id) as well as its filter
+        response = self.client.post('/lims/sample/action/', self.selection_form(url))
+        response = self.client.get(response.url)
+        self.assertEqual(response.context['object_count'], 12)
+
+        filtered_url = url + '&Sample_filter=t.depth_cm>9&Sample_item_limit=1'
+        self.client.post('/lims/sample/action/', self.selection_form(filtered_url))
+        selection = SelectionSet.objects.latest('pk')
+        self.assertEqual(
+            set(selection_queryset(selection, response.wsgi_request)),
+            {children[10], children[11]}
+        )
+
+        # tables of other querysets can't be rebuilt from their query string
+        with mock.patch.object(SampleDetailView, 'lazy_tables', False):
+            response = self.client.get(reverse('lims:sample_detail', kwargs={'pk': parent.pk}))
+        self.assertContains(response, 'name="action"')
+        self.assertNotContains(response, 'select_all')
+
+
+    def test_term_table_selection(self):
+        for i in range(12):
+            Sample.objects.create(project=self.proj, user=self.user, name='tagged %d' % i).set_tags(depth_cm=str(i))
+        term = Term.objects.get(slug='depth_cm')
+        response = self.client.get(reverse('lims:term_detail', kwargs={'pk': term.pk}))
+        url = [url.replace('&amp;', '&') for url in re.findall(r'data-url="([^"]+)"', response.content.decode('utf-8'))
+               if '/Sample/' in url][0]
+
+        # the selection only has the objects with a value for the term
+        response = self.client.post('/lims/sample/action/', self.selection_form(url))
+        response = self.client.get(response.url)
+        self.assertEqual(response.context['object_count'], 12)
+        self.assertNotContains(response, self.keep[0].slug)
+
+    def test_invalid_filter_selection(self):
+        selection = SelectionSet.objects.create(
+            user=self.user, model='Sample', data_widget='Sample', query_string='filter=t.depth_cm >'
+        )
+        url = '/lims/sample/action/publish?selection=%s' % selection.pk
+        response = self.client.get(url)
+        self.assertContains(response, 'The filter of this selection is not valid')
+
+        response = self.client.post(url)
+        self.assertContains(response, 'The filter of this selection is not valid')
+        self.assertFalse(Sample.objects.filter(status='published').exists())
+
+
+class BulkEditFormTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='editor', is_staff=True)
+        self.proj = Project.objects.create(name='Edit Project', slug='edit-project')
+        self.collected = datetime.datetime(2018, 6, 1, 12, 0, tzinfo=timezone.utc)
+        self.samples = []
+        for i in range(6):
+            sample = Sample.objects.create(project=self.proj, user=self.user, name='sample %d' % i,
+                                           collected=self.collected)
+            sample.set_tags(depth=str(i), lake='Bedford')
+            self.samples.append(sample)
+        self.client.force_login(self.user)
+
+    def url(self, samples):
+        return '/lims/sample/action/bulkedit?' + '&'.join('id__in=%s' % sample.pk for sample in samples)
+
+    def test_bulk_edit_queries(self):
+        # the number of queries doesn't depend on the number of samples
+        query_counts = []
+        for samples in (self.samples[:2], self.samples):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(self.url(samples))
+            self.assertContains(response, 'tag_form_field_depth')
+            query_counts.append(len(queries))
+        self.assertEqual(query_counts[0], query_counts[1])
+
+    def test_bulk_edit_diff(self):
+        samples = self.samples[:2]
+        data = {
+            'form-TOTAL_FORMS': '2',
+            'form-INITIAL_FORMS': '2',
+            'form-MIN_NUM_FORMS': '0',
+            'form-MAX_NUM_FORMS': '1000'
+        }
+        # forms are ordered by -modified
+        for i, sample in enumerate(sorted(samples, key=lambda s: s.modified, reverse=True)):
+            prefix = 'form-%d-' % i
+            data.update({
+                prefix + 'id': sample.pk,
+                prefix + 'project_meta_field': self.proj.pk,
+                prefix + 'collected': timezone.localtime(self.collected).strftime('%Y-%m-%d %H:%M:%S'),
+                'initial-' + prefix + 'collected': timezone.localtime(self.collected).strftime('%Y-%m-%d %H:%M:%S'),
+                prefix + 'name': sample.name,
+                prefix + 'description': '',
+                prefix + 'parent': '',
+                prefix + 'geometry': '',
+                prefix + 'tag_form_field_depth': '100' if sample == samples[0] else sample.get_tag('depth'),
+                prefix + 'tag_form_field_lake': 'Bedford'
+            })
+
+        unchanged_modified = Sample.objects.get(pk=samples[1].pk).modified
+        lake_modified = samples[0].tags.get(key__slug='lake').modified
+        response = self.client.post(self.url(samples), data)
+        self.assertEqual(response.status_code, 302)
+
+        self.assertEqual(samples[0].get_tag('depth'), '100')
+        self.assertEqual(samples[0].tags.get(key__slug='lake').modified, lake_modified)
+        self.assertEqual(Sample.objects.get(pk=samples[1].pk).modified, unchanged_modified)
+
+
+class LazyDetailTablesTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='detail_user', is_staff=True)
+        self.proj = Project.objects.create(name='Detail Project', slug='detail-project')
+        self.parent = Sample.objects.create(project=self.proj, user=self.user, name='parent', status='published')
+        self.child = Sample.objects.create(project=self.proj, user=self.user, name='child', status='published',
+                                           parent=self.parent)
+        other_proj = Project.objects.create(name='Other Project', slug='other-project')
+        self.other = Sample.objects.create(project=other_proj, user=self.user, name='other', status='published')
+        self.child.set_tags(depth_cm='4')
+        self.client.force_login(self.user)
+
+    def lazy_urls(self, response):
+        return [url.replace('&amp;', '&') for url in re.findall(r'data-url="([^"]+)"', response.content.decode('utf-8'))]
+
+    def test_detail_tables_are_lazy(self):
+        # no table queries are made to render the page
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('lims:project_detail', kwargs={'pk': self.proj.pk}))
+        self.assertNotContains(response, self.child.slug)
+        sample_url, attachment_url, term_url = self.lazy_urls(response)
+
+        response = self.client.get(sample_url)
+        self.assertContains(response, self.parent.slug)
+        self.assertContains(response, self.child.slug)
+        self.assertNotContains(response, self.other.slug)
+        # actions return to the detail page
+        self.assertContains(response, '?from=/lims/project/%s"' % self.proj.pk)
+
+        response = self.client.get(reverse('lims:sample_detail', kwargs={'pk': self.parent.pk}))
+        response = self.client.get([url for url in self.lazy_urls(response) if '/Sample/' in url][0])
+        self.assertContains(response, self.child.slug)
+        self.assertNotContains(response, 'dv-Sample-%s' % self.parent.pk)
+
+        # term pages list the objects with values for the term
+        term = Term.objects.get(slug='depth_cm')
+        response = self.client.get(reverse('lims:term_detail', kwargs={'pk': term.pk}))
+        urls = self.lazy_urls(response)
+        self.assertEqual(len(urls), 4)
+        # each table has its own name (the prefix of its query string and DOM ids)
+        self.assertIn('/SampleTag/data-view/SampleTag/', ' '.join(urls))
+        self.assertEqual(len(re.findall(r'dv-SampleTag-lazy', response.content.decode('utf-8'))), 1)
+        response = self.client.get([url for url in urls if '/SampleTag/' in url][0])
+        self.assertContains(response, 'SampleTag-viewlist-form')
+        response = self.client.get([url for url in urls if '/Sample/' in url][0])
+        self.assertContains(response, self.child.slug)
+        self.assertNotContains(response, 'dv-Sample-%s' % self.parent.pk)
+        self.assertContains(response, 'data-count="1"')
+
+        # unknown models are not found
+        response = self.client.get(sample_url.replace('/Sample/', '/NotAModel/'))
+        self.assertEqual(response.status_code, 404)
+
+
+class DataWidgetRowsTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='rows_user', is_staff=True)
+        self.proj = Project.objects.create(name='Rows Project', slug='rows-project')
+        self.samples = [
+            Sample.objects.create(project=self.proj, user=self.user, name='rows%s' % i, status='published')
+            for i in range(5)
+        ]
+        for i, sample in enumerate(self.samples[:4]):
+            sample.set_tags(depth_cm=str(i), lake='<Bedford>')
+        self.term = Term.objects.get(slug='depth_cm', taxonomy='Sample')
+
+    def test_rows(self):
+        term_field = TermField(self.term)
+        dw = SampleDataWidget(term_field, name='samples')
+        term_column = dw.fields.index(term_field)
+        queryset = Sample.objects.filter(pk__in=[s.pk for s in self.samples]).order_by('name')
+
+        with CaptureQueriesContext(connection) as queries:
+            rows = list(dw.rows(queryset))
+        self.assertEqual(len([q for q in queries if 'lims_sampletag' in q['sql']]), 1)
+
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(len(rows[0]), len(dw.fields))
+        self.assertEqual(rows[0][0].object, self.samples[0])
+        self.assertEqual(rows[0][1]['output'], 'rows0')
+        self.assertEqual(rows[2][term_column].value.value, '2')
+        self.assertEqual(rows[2][term_column].output, '2')
+        self.assertEqual(rows[4][term_column].output, '')
+        self.assertIn('href="%s"' % self.samples[0].get_absolute_url(), rows[0][0].output)
+
+        # the same cells are produced column-wise
+        column = list(term_field.get_values_iter(queryset))
+        self.assertEqual([cell.output for cell in column], [row[term_column].output for row in rows])
+
+        request = RequestFactory().get('/')
+        request.user = self.user
+        html = dw.bind(queryset, request).rows_html()
+        self.assertEqual(html.count('<tr '), 5)
+        self.assertIn('<td class="dv-samples-name">rows1</td>', html)
+        self.assertIn('name="object-%s-selected"' % self.samples[1].pk, html)
+
+        lake = Term.objects.get(slug='lake', taxonomy='Sample')
+        html = SampleDataWidget(TermField(lake), name='samples').bind(queryset, request).rows_html()
+        self.assertIn('&lt;Bedford&gt;', html)
+        self.assertNotIn('<Bedford>', html)
+
+
+    def test_compiled_specs(self):
+        # compiled once per class, and shared between instances
+        self.assertIs(SampleDataWidget(name='a').spec, SampleDataWidget(name='b').spec)
+        self.assertIs(compile_data_widget(SampleDataWidget), SampleDataWidget(name='a').spec)
+        with self.assertRaises(AttributeError):
+            SampleDataWidget(name='a').spec.fields = ()
+
+        extra_spec = SampleDataWidget(TermField(self.term), name='a', exclude=('name', )).spec
+        self.assertIsNone(extra_spec.get_field('name'))
+        self.assertIsNotNone(extra_spec.get_field('depth_cm'))
+        self.assertEqual(len(SampleDataWidget(name='a').fields), len(SampleDataWidget.fields) + 1)
+
+        request = RequestFactory().get('/')
+        request.user = self.user
+        queryset = Sample.objects.filter(pk__in=[s.pk for s in self.samples])
+        project_user_url = reverse('lims:project_user_detail', kwargs={'project_id': self.proj.pk, 'pk': self.user.pk})
+
+        bound = SampleDataWidget(name='samples').bind(queryset, request, project_id=self.proj.pk)
+        self.assertIsNone(bound.spec.get_field('project'))
+        self.assertEqual(bound.filter_fields, ['project_id'])
+        self.assertIn(project_user_url, bound.rows_html())
+
+        # binding within a project does not change the widget for other requests
+        bound = SampleDataWidget(name='samples').bind(queryset, request)
+        self.assertIsNotNone(bound.spec.get_field('project'))
+        self.assertEqual(bound.filter_fields, [])
+        self.assertNotIn(project_user_url, bound.rows_html())
+        self.assertIn(reverse('lims:user_detail', kwargs={'pk': self.user.pk}), bound.rows_html())
+
+
+class ConcurrentDataWidgetsTestCase(TransactionTestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='concurrent_user', is_staff=True)
+        self.proj = Project.objects.create(name='Concurrent Project', slug='concurrent-project')
+        self.sample = Sample.objects.create(project=self.proj, user=self.user, name='concurrent', status='published')
+        self.sample.set_tags(depth_cm='4')
+        self.client.force_login(self.user)
+
+    def test_evaluate_bound_widgets(self):
+        # the test database is private to this thread's connection
+        self.assertFalse(can_evaluate_concurrently())
+
+        request = RequestFactory().get('/')
+        request.user = self.user
+        bound_widgets = [
+            SampleDataWidget(name='samples').bind(Sample.objects.all(), request),
+            TermDataWidget(name='terms').bind(Term.objects.all(), request),
+            ProjectDataWidget(name='projects').bind(Project.objects.all(), request)
+        ]
+
+        threads = []
+        evaluate = BoundDataWidget.evaluate
+
+        def evaluate_in_thread(bound_widget):
+            threads.append(threading.get_ident())
+            return evaluate(bound_widget)
+
+        with mock.patch('lims.widgets.data_widget.can_evaluate_concurrently', return_value=True), \
+                mock.patch.object(BoundDataWidget, 'evaluate', evaluate_in_thread):
+            evaluate_bound_widgets(bound_widgets, max_workers=2)
+        self.assertEqual(len(threads), 3)
+        self.assertNotIn(threading.get_ident(), threads)
+
+        # all of the queries were made by the workers
+        with self.assertNumQueries(0):
+            html = [str(bound_widget) for bound_widget in bound_widgets]
+        self.assertIn(self.sample.slug, html[0])
+        self.assertIn('depth_cm', html[1])
+        self.assertIn(self.proj.slug, html[2])
+
+    def test_eager_detail_tables(self):
+        with mock.patch.object(ProjectDetailView, 'lazy_tables', False):
+            response = self.client.get(reverse('lims:project_detail', kwargs={'pk': self.proj.pk}))
+        self.assertContains(response, self.sample.slug)
+        self.assertContains(response, 'data-count="1"')
+
+
 class PermissionTestCase(TestCase):
 
     def setUp(self):
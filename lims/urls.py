@@ -26,6 +26,7 @@ urlpatterns = [
         name="sample_add_bulk"
     ),
     url(r'^project/(?P<project_id>[0-9]+)/sample/add/$', views.SampleAddView.as_view(), name="sample_add"),
+    url(r'^project/(?P<project_id>[0-9]+)/sample/import/$', views.SampleImportView.as_view(), name="sample_import"),
 
     # sample object views
     url(r'^sample/(?P<pk>[0-9]+)$', views.SampleDetailView.as_view(), name="sample_detail"),
@@ -43,6 +44,7 @@ urlpatterns = [
     url(r'^term/$', views.TermListView.as_view(), name="term_list"),
     url(r'^project/(?P<project_id>[0-9]+)/term/$', views.TermListView.as_view(), name="project_term_list"),
     url(r'^term/(?P<pk>[0-9]+)$', views.TermDetailView.as_view(), name="term_detail"),
+    url(r'^term/(?P<pk>[0-9]+)/stats/$', views.TermStatsView.as_view(), name="term_stats"),
 
     # attachment object views
     url(r'^attachment/$', views.AttachmentListView.as_view(), name='attachment_list'),
@@ -53,12 +55,41 @@ urlpatterns = [
     ),
     url(r'^attachment/(?P<pk>[0-9]+)$', views.AttachmentDetailView.as_view(), name="attachment_detail"),
     url(r'^attachment/(?P<pk>[0-9]+)/download/$', views.AttachmentDownloadView.as_view(), name="attachment_download"),
+    url(
+        r'^attachment/(?P<pk>[0-9]+)/thumbnail/$',
+        views.AttachmentThumbnailView.as_view(),
+        name="attachment_thumbnail"
+    ),
+
+    # chunked attachment upload views
+    url(
+        r'^project/(?P<project_id>[0-9]+)/attachment/upload/$',
+        views.AttachmentUploadInitView.as_view(),
+        name='attachment_upload_init'
+    ),
+    url(r'^attachment/upload/(?P<pk>[0-9]+)$', views.AttachmentUploadStatusView.as_view(), name='attachment_upload'),
+    url(
+        r'^attachment/upload/(?P<pk>[0-9]+)/chunk/(?P<index>[0-9]+)$',
+        views.AttachmentUploadChunkView.as_view(),
+        name='attachment_upload_chunk'
+    ),
+    url(
+        r'^attachment/upload/(?P<pk>[0-9]+)/finalize/$',
+        views.AttachmentUploadFinalizeView.as_view(),
+        name='attachment_upload_finalize'
+    ),
 
     # action views
     url(r'^(?P<model>[a-z]+)/(?P<pk>[0-9]+)/action/(?P<action>[a-z-]+)$', views.item_action_view, name='item_action'),
     url(r'^(?P<model>[a-z]+)/action/(?P<action>[a-z-]+)$', views.base_action_view, name='bulk_action'),
     url(r'^(?P<model>[a-z]+)/action/$', views.resolve_action_view, name='resolve_bulk_action'),
 
+    # job views
+    url(r'^job/$', views.JobListView.as_view(), name='job_list'),
+    url(r'^job/(?P<pk>[0-9]+)$', views.JobDetailView.as_view(), name='job_detail'),
+    url(r'^job/(?P<pk>[0-9]+)/status/$', views.JobStatusView.as_view(), name='job_status'),
+    url(r'^job/(?P<pk>[0-9]+)/result/$', views.JobResultDownloadView.as_view(), name='job_result'),
+
     # data views
     url(
         r'^(?P<model>[A-Za-z]+)/data-view/(?P<data_widget>[A-Za-z0-9_-]+)/' + \
@@ -70,4 +101,7 @@ urlpatterns = [
     # ajax views
     url(r'^(?P<model>[A-Za-z]+)/select2/$', views.LimsSelect2Ajax.as_view(), name='ajax_select2'),
 
+    # incremental exports
+    url(r'^(?P<model>[a-z]+)/delta/$', views.DeltaExportView.as_view(), name='delta_export'),
+
 ]
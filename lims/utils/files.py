@@ -0,0 +1,72 @@
+import hashlib
+
+
+class HashingReader:
+    """
+    A read-only file-like wrapper that hashes everything read through it. Wrapping
+    a stream with this and passing it to a storage backend computes the hash while the
+    data is written, without reading the data twice.
+    """
+
+    def __init__(self, stream, algorithm='sha256', max_size=None):
+        self.stream = stream
+        self.hash = hashlib.new(algorithm)
+        self.bytes_read = 0
+        self.max_size = max_size
+
+    def read(self, size=None):
+        data = self.stream.read(size) if size is not None and size >= 0 else self.stream.read()
+        self.bytes_read += len(data)
+        if self.max_size is not None and self.bytes_read > self.max_size:
+            raise ValueError('Stream is larger than %s bytes' % self.max_size)
+        self.hash.update(data)
+        return data
+
+    def hexdigest(self):
+        return self.hash.hexdigest()
+
+
+class ConcatenatedReader:
+    """
+    A read-only file-like object that reads a sequence of files one after
+    another, opening each one only when it is needed.
+    """
+
+    def __init__(self, files, mode='rb'):
+        self.files = iter(files)
+        self.mode = mode
+        self.current = None
+
+    def _next_file(self):
+        if self.current is not None:
+            self.current.close()
+        try:
+            self.current = next(self.files)
+            self.current.open(self.mode)
+            return True
+        except StopIteration:
+            self.current = None
+            return False
+
+    def read(self, size=None):
+        if self.current is None and not self._next_file():
+            return b''
+
+        parts = []
+        remaining = size if size is not None and size >= 0 else None
+        while self.current is not None:
+            data = self.current.read(remaining) if remaining is not None else self.current.read()
+            parts.append(data)
+            if remaining is not None:
+                remaining -= len(data)
+                if remaining <= 0:
+                    break
+            if remaining is None or not data:
+                self._next_file()
+
+        return b''.join(parts)
+
+    def close(self):
+        if self.current is not None:
+            self.current.close()
+            self.current = None
@@ -1,5 +1,6 @@
 
 import re
+import struct
 
 from django.core.exceptions import ValidationError
 
@@ -89,3 +90,175 @@ def wkt_bounds(value):
         "ymin": None,
         "ymax": None
     }
+
+
+class WKTError(ValueError):
+    pass
+
+
+_RE_WKT_TOKEN = re.compile(r'''
+    \s*(?:
+        (?P<word>[A-Za-z]+)|
+        (?P<number>[-+]?(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][-+]?[0-9]+)?)|
+        (?P<punct>[(),])
+    )
+''', re.VERBOSE)
+
+# GeoJSON type and the number of levels of parentheses around each coordinate
+WKT_TYPES = {
+    'POINT': ('Point', 1),
+    'LINESTRING': ('LineString', 1),
+    'POLYGON': ('Polygon', 2),
+    'MULTIPOINT': ('MultiPoint', 1),
+    'MULTILINESTRING': ('MultiLineString', 2),
+    'MULTIPOLYGON': ('MultiPolygon', 3)
+}
+
+
+class WKTReader:
+    """
+    Reads well-known text in a single pass: tokens are matched one at a time as the parser asks
+    for them, and coordinates are built as they are read
+    """
+
+    def __init__(self, value):
+        self.value = value
+        self.pos = 0
+        self.token = self.read_token()
+
+    def read_token(self):
+        self.value_pos = self.pos
+        if self.pos >= len(self.value) or not self.value[self.pos:].strip():
+            return None, None
+        match = _RE_WKT_TOKEN.match(self.value, self.pos)
+        if not match:
+            raise WKTError('Unexpected character at position %d' % (self.pos + 1))
+        self.pos = match.end()
+        return match.lastgroup, match.group(match.lastgroup)
+
+    def next(self, kind=None, value=None):
+        token = self.token
+        if (kind is not None and token[0] != kind) or (value is not None and token[1] != value):
+            expected = value if value is not None else 'a ' + kind
+            found = 'end of text' if token[0] is None else '"%s"' % token[1]
+            raise WKTError('Expected %s at position %d but found %s' % (expected, self.value_pos + 1, found))
+        self.token = self.read_token()
+        return token[1]
+
+    def read_geometry(self):
+        wkt_type = self.next('word').upper()
+        if wkt_type not in WKT_TYPES:
+            raise WKTError('Unsupported geometry type: "%s"' % wkt_type)
+        geometry_type, depth = WKT_TYPES[wkt_type]
+
+        if self.token[0] == 'word' and self.token[1].upper() == 'EMPTY':
+            self.next()
+            coordinates = None
+        else:
+            coordinates = self.read_list()
+            if geometry_type == 'MultiPoint' and _depth(coordinates) == 2:
+                # MULTIPOINT ((1 2), (3 4)) as well as MULTIPOINT (1 2, 3 4)
+                if any(len(point) != 1 for point in coordinates):
+                    raise WKTError('Each point of a MULTIPOINT must have one coordinate')
+                coordinates = [point[0] for point in coordinates]
+            _check_depth(coordinates, depth)
+            if geometry_type == 'Point':
+                if len(coordinates) != 1:
+                    raise WKTError('A POINT must have exactly one coordinate')
+                coordinates = coordinates[0]
+
+        if self.token[0] is not None:
+            raise WKTError('Unexpected "%s" at position %d' % (self.token[1], self.value_pos + 1))
+        return None if coordinates is None else {'type': geometry_type, 'coordinates': coordinates}
+
+    def read_list(self):
+        self.next('punct', '(')
+        items = [self.read_item()]
+        while self.token == ('punct', ','):
+            self.next()
+            items.append(self.read_item())
+        self.next('punct', ')')
+        return items
+
+    def read_item(self):
+        if self.token == ('punct', '('):
+            return self.read_list()
+        coordinate = []
+        while self.token[0] == 'number':
+            coordinate.append(float(self.next()))
+        if len(coordinate) not in (2, 3):
+            raise WKTError('Coordinates must have two or three values (position %d)' % (self.value_pos + 1))
+        return coordinate
+
+
+def _depth(items):
+    depth = 0
+    while isinstance(items, list) and items and isinstance(items[0], list):
+        depth += 1
+        items = items[0]
+    return depth
+
+
+def _check_depth(items, depth):
+    """Checks that each coordinate is nested in depth lists"""
+    if depth == 0:
+        if not items or isinstance(items[0], list):
+            raise WKTError('Unexpected nesting of coordinates')
+        return
+    for item in items:
+        if not isinstance(item, list) or not item or not isinstance(item[0], (list, float)):
+            raise WKTError('Unexpected nesting of coordinates')
+        _check_depth(item, depth - 1)
+
+
+def parse_wkt(value):
+    """
+    Parses well-known text into a GeoJSON geometry (a dict with 'type' and 'coordinates'), or None
+    if value is empty. Raises WKTError if value is not valid well-known text.
+    """
+    if not value or not value.strip():
+        return None
+    return WKTReader(value).read_geometry()
+
+
+_WKB_TYPES = {
+    'Point': 1, 'LineString': 2, 'Polygon': 3, 'MultiPoint': 4, 'MultiLineString': 5, 'MultiPolygon': 6
+}
+_WKB_MULTI_PARTS = {'MultiPoint': 'Point', 'MultiLineString': 'LineString', 'MultiPolygon': 'Polygon'}
+
+
+def _write_wkb(out, geometry_type, coordinates):
+    out += struct.pack('<BI', 1, _WKB_TYPES[geometry_type])
+    if geometry_type == 'Point':
+        out += struct.pack('<dd', coordinates[0], coordinates[1])
+    elif geometry_type == 'LineString':
+        out += struct.pack('<I', len(coordinates))
+        for x, y, *z in coordinates:
+            out += struct.pack('<dd', x, y)
+    elif geometry_type == 'Polygon':
+        out += struct.pack('<I', len(coordinates))
+        for ring in coordinates:
+            out += struct.pack('<I', len(ring))
+            for x, y, *z in ring:
+                out += struct.pack('<dd', x, y)
+    else:
+        out += struct.pack('<I', len(coordinates))
+        for part in coordinates:
+            _write_wkb(out, _WKB_MULTI_PARTS[geometry_type], part)
+
+
+def geometry_wkb(geometry):
+    """Encodes a GeoJSON geometry (see parse_wkt()) as (two-dimensional, little-endian) well-known binary"""
+    out = bytearray()
+    _write_wkb(out, geometry['type'], geometry['coordinates'])
+    return bytes(out)
+
+
+def geometry_bounds(geometry):
+    """(xmin, xmax, ymin, ymax) of a GeoJSON geometry"""
+    coordinates = [geometry['coordinates']]
+    for i in range(_depth(coordinates) - 1):
+        coordinates = [coordinate for part in coordinates for coordinate in part]
+    x_coords = [coordinate[0] for coordinate in coordinates]
+    y_coords = [coordinate[1] for coordinate in coordinates]
+    return min(x_coords), max(x_coords), min(y_coords), max(y_coords)
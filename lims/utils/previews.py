@@ -0,0 +1,137 @@
+import io
+import os
+import shutil
+import tempfile
+import mimetypes
+import subprocess
+
+from django.core.files.storage import default_storage
+
+from .files import HashingReader
+
+THUMBNAIL_SIZE = (256, 256)
+TEXT_PREVIEW_LINES = 10
+TEXT_PREVIEW_BYTES = 64 * 1024
+TEXT_MIME_TYPES = ('application/json', 'application/csv', 'application/xml')
+
+
+class PreviewError(Exception):
+    pass
+
+
+def preview_type(filename, mime_type=''):
+    """Decides which kind of preview can be generated for a file"""
+    if not mime_type:
+        mime_type = mimetypes.guess_type(filename)[0] or ''
+
+    if mime_type.startswith('image/'):
+        return 'image'
+    elif mime_type == 'application/pdf':
+        return 'pdf'
+    elif mime_type.startswith('text/') or mime_type in TEXT_MIME_TYPES:
+        return 'text'
+    elif os.path.splitext(filename)[1].lower() in ('.csv', '.tsv', '.txt'):
+        return 'text'
+    else:
+        return 'none'
+
+
+def file_hash(f, chunk_size=1024 * 1024):
+    reader = HashingReader(f)
+    while reader.read(chunk_size):
+        pass
+    return reader.hexdigest()
+
+
+def image_thumbnail(f, size=THUMBNAIL_SIZE):
+    try:
+        from PIL import Image
+    except ImportError:
+        raise PreviewError('Pillow is required to generate image thumbnails')
+
+    try:
+        img = Image.open(f)
+        # lets the JPEG decoder skip most of the full-size image
+        img.draft('RGB', size)
+        img.thumbnail(size)
+        if img.mode not in ('RGB', 'RGBA', 'L'):
+            img = img.convert('RGBA')
+
+        with io.BytesIO() as out:
+            img.save(out, format='png')
+            return out.getvalue()
+    except Exception as e:
+        # includes Pillow's DecompressionBombError, which is not an IOError
+        raise PreviewError('Could not read image: %s' % e)
+
+
+def pdf_thumbnail(f, size=THUMBNAIL_SIZE):
+    pdftoppm = shutil.which('pdftoppm')
+    if pdftoppm is None:
+        raise PreviewError('pdftoppm is required to generate PDF thumbnails')
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pdf_file = os.path.join(tmp_dir, 'file.pdf')
+        with open(pdf_file, 'wb') as out:
+            shutil.copyfileobj(f, out)
+
+        out_prefix = os.path.join(tmp_dir, 'thumbnail')
+        result = subprocess.run(
+            [pdftoppm, '-png', '-singlefile', '-f', '1', '-l', '1', '-scale-to', str(max(size)),
+             pdf_file, out_prefix],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE
+        )
+        if result.returncode != 0:
+            raise PreviewError('Could not render PDF: %s' % result.stderr.decode('utf-8', errors='replace'))
+
+        with open(out_prefix + '.png', 'rb') as png:
+            return png.read()
+
+
+def text_head(f, n_lines=TEXT_PREVIEW_LINES, max_bytes=TEXT_PREVIEW_BYTES):
+    text = f.read(max_bytes).decode('utf-8', errors='replace')
+    return '\n'.join(text.splitlines()[:n_lines])
+
+
+def generate_preview(name, mime_type='', calculated_hash='', storage=None):
+    """
+    Generates a preview for a file in storage. This only touches storage (never the database),
+    so that it can be run in a worker process. Returns a dict with the file hash, the preview type
+    ('image', 'text', or 'none'), the PNG thumbnail (or None), the text preview, and any error.
+    Raises PreviewError if the file cannot be read at all.
+    """
+    storage = default_storage if storage is None else storage
+
+    if not calculated_hash:
+        try:
+            with storage.open(name, 'rb') as f:
+                calculated_hash = file_hash(f)
+        except OSError as e:
+            raise PreviewError('Could not read file: %s' % e)
+
+    result = {
+        'file_hash': calculated_hash,
+        'preview_type': 'none',
+        'thumbnail': None,
+        'text': '',
+        'error': ''
+    }
+
+    kind = preview_type(name, mime_type)
+    try:
+        with storage.open(name, 'rb') as f:
+            if kind == 'image':
+                result['thumbnail'] = image_thumbnail(f)
+                result['preview_type'] = 'image'
+            elif kind == 'pdf':
+                result['thumbnail'] = pdf_thumbnail(f)
+                result['preview_type'] = 'image'
+            elif kind == 'text':
+                result['text'] = text_head(f)
+                result['preview_type'] = 'text'
+    except Exception as e:
+        # the preview is recorded with its error, so that the file isn't tried again
+        result['error'] = str(e) or type(e).__name__
+
+    return result
@@ -0,0 +1,154 @@
+import re
+from collections import OrderedDict
+
+from django.db.models import Q
+
+from .tag_values import TagFilterError, tag_exists, tag_value_condition
+
+_RE_TOKEN = re.compile(r'''
+    \s*(?:
+        (?P<paren>[()])|
+        (?P<op>>=|<=|!=|==|=|>|<)|
+        (?P<tag>t\.[A-Za-z0-9._-]+)|
+        (?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')|
+        (?P<word>[^\s()"'<>=!]+)
+    )
+''', re.VERBOSE)
+
+_RE_ESCAPE = re.compile(r'\\(.)')
+
+_TOKEN_NAMES = {
+    'paren': 'a parenthesis',
+    'op': 'an operator',
+    'tag': 'a term (t.<term>)',
+    'string': 'a value',
+    'word': 'a value'
+}
+
+_OPERATORS = {
+    '=': 'exact',
+    '==': 'exact',
+    '!=': 'exact',
+    '>': 'gt',
+    '>=': 'gte',
+    '<': 'lt',
+    '<=': 'lte'
+}
+
+
+def tokenize(expression):
+    tokens = []
+    pos = 0
+    expression = expression.rstrip()
+    while pos < len(expression):
+        match = _RE_TOKEN.match(expression, pos)
+        if not match or match.end() == pos:
+            raise TagFilterError('Unexpected character at position %d: "%s"' % (pos + 1, expression[pos:].strip()))
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'string':
+            value = _RE_ESCAPE.sub(r'\1', value[1:-1])
+        elif kind == 'word' and value.lower() in ('and', 'or', 'not'):
+            kind = value.lower()
+        tokens.append((kind, value))
+        pos = match.end()
+    return tokens
+
+
+class TagQueryParser:
+    """
+    Parses a tag filter expression such as t.depth_cm>10 and t.lake="Bedford", where
+    t.<term slug> refers to the value of an object's tag. Each comparison is compiled to a
+    correlated EXISTS subquery on the tag table (added as an annotation of the queryset), and the
+    comparisons are combined using and, or, not, and parentheses. A term on its own (e.g. t.lake)
+    matches objects with any value for that term. Quoted values compared using = or != are compared
+    as text, and other values are compared using the typed (numeric, date/time, or true/false)
+    tag value columns.
+    """
+
+    def __init__(self, queryset, expression):
+        self.queryset = queryset
+        self.expression = expression
+        self.tokens = tokenize(expression)
+        self.pos = 0
+        self.annotations = {}
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def next(self, *kinds):
+        kind, value = self.peek()
+        if kinds and kind not in kinds:
+            expected = ' or '.join(OrderedDict((_TOKEN_NAMES[k], None) for k in kinds))
+            if kind is None:
+                raise TagFilterError('Unexpected end of filter, expected %s' % expected)
+            raise TagFilterError('Unexpected "%s", expected %s' % (value, expected))
+        self.pos += 1
+        return kind, value
+
+    def parse(self):
+        if not self.tokens:
+            raise TagFilterError('Filter is empty')
+        q = self.parse_or()
+        if self.pos < len(self.tokens):
+            raise TagFilterError('Unexpected "%s"' % self.peek()[1])
+        return q
+
+    def parse_or(self):
+        q = self.parse_and()
+        while self.peek()[0] == 'or':
+            self.next()
+            q = q | self.parse_and()
+        return q
+
+    def parse_and(self):
+        q = self.parse_not()
+        while self.peek()[0] == 'and':
+            self.next()
+            q = q & self.parse_not()
+        return q
+
+    def parse_not(self):
+        if self.peek()[0] == 'not':
+            self.next()
+            return ~self.parse_not()
+        return self.parse_atom()
+
+    def parse_atom(self):
+        kind, value = self.next('paren', 'tag')
+        if kind == 'paren':
+            if value != '(':
+                raise TagFilterError('Unexpected ")"')
+            q = self.parse_or()
+            kind, value = self.next('paren')
+            if value != ')':
+                raise TagFilterError('Expected ")"')
+            return q
+
+        slug = value[2:]
+        if self.peek()[0] != 'op':
+            return self.exists(slug)
+
+        op = self.next('op')[1]
+        value_kind, value = self.next('string', 'word')
+        lookup = _OPERATORS[op]
+        if value_kind == 'string' and lookup == 'exact':
+            condition = Q(value=value)
+        else:
+            condition = Q(**tag_value_condition(value, lookup))
+
+        if op == '!=':
+            condition = ~condition
+        return self.exists(slug, condition)
+
+    def exists(self, slug, *conditions):
+        name = '_tag_query_%d' % (len(self.queryset.query.annotations) + len(self.annotations))
+        self.annotations[name] = tag_exists(self.queryset, slug, *conditions)
+        return Q(**{name: True})
+
+
+def tag_query_filter(queryset, expression):
+    """Filters queryset (whose model must have tags) using a tag filter expression"""
+    parser = TagQueryParser(queryset, expression)
+    q = parser.parse()
+    return queryset.annotate(**parser.annotations).filter(q)
@@ -0,0 +1,175 @@
+import re
+import datetime
+
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+TAG_VALUE_LOOKUPS = ('exact', 'gt', 'gte', 'lt', 'lte', 'range')
+
+_RE_TAG_FILTER_KEY = re.compile(r'^tag__(.+?)(?:__(%s))?$' % '|'.join(TAG_VALUE_LOOKUPS))
+
+
+class TagFilterError(Exception):
+    pass
+
+
+def numeric_value(value):
+    """Numbers (and true/false, as 1/0) are stored in Tag.numeric_value"""
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        value = str(value).lower()
+        if value == 'true':
+            return 1
+        elif value == 'false':
+            return 0
+        else:
+            return None
+
+
+def datetime_value(value):
+    """ISO 8601 dates and date/times are stored in Tag.datetime_value (in the current time zone if not specified)"""
+    if value is None:
+        return None
+
+    value = str(value).strip()
+    if not value:
+        return None
+    try:
+        parsed = parse_datetime(value)
+        if parsed is None:
+            parsed_date = parse_date(value)
+            if parsed_date is None:
+                return None
+            parsed = datetime.datetime.combine(parsed_date, datetime.time())
+    except ValueError:
+        # well formatted but not a valid date (e.g., 2019-02-30)
+        return None
+
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, timezone.get_current_timezone())
+    return parsed
+
+
+def boolean_value(value):
+    """true/false values are stored in Tag.boolean_value"""
+    if value is None:
+        return None
+    value = str(value).strip().lower()
+    if value == 'true':
+        return True
+    elif value == 'false':
+        return False
+    else:
+        return None
+
+
+def typed_values(value):
+    return {
+        'numeric_value': numeric_value(value),
+        'datetime_value': datetime_value(value),
+        'boolean_value': boolean_value(value)
+    }
+
+
+def parse_tag_filter_key(key):
+    """
+    Parses a tag filter query string key (tag__<term slug>__<lookup>), returning
+    (term slug, lookup) or None if key is not a tag filter
+    """
+    match = _RE_TAG_FILTER_KEY.match(key)
+    if not match:
+        return None
+    return match.group(1), match.group(2) or 'exact'
+
+
+def _typed_filter_value(value, lookup):
+    """Chooses the typed column to compare against based on the filter value"""
+    try:
+        return 'numeric_value', float(value)
+    except ValueError:
+        pass
+
+    parsed = datetime_value(value)
+    if parsed is not None:
+        return 'datetime_value', parsed
+
+    parsed = boolean_value(value)
+    if parsed is not None and lookup == 'exact':
+        return 'boolean_value', parsed
+
+    if lookup == 'exact':
+        return 'value', value
+
+    raise TagFilterError('Value "%s" cannot be compared using "%s"' % (value, lookup))
+
+
+def tag_value_condition(value, lookup='exact'):
+    """
+    Returns filter() keyword arguments for a tag model comparing the typed value column to value.
+    Numbers use numeric_value, ISO dates use datetime_value, and true/false use boolean_value, so
+    that the filter can use the (key, typed value) indexes.
+    """
+    if lookup not in TAG_VALUE_LOOKUPS:
+        raise TagFilterError('Lookup must be one of %s' % ', '.join(TAG_VALUE_LOOKUPS))
+
+    if lookup == 'range':
+        values = value if isinstance(value, (list, tuple)) else str(value).split(',')
+        if len(values) != 2:
+            raise TagFilterError('Range must have exactly two values')
+        (column, start), (end_column, end) = [_typed_filter_value(v.strip(), 'gte') for v in values]
+        if column != end_column:
+            raise TagFilterError('Range values must be of the same type')
+        return {column + '__range': (start, end)}
+
+    column, typed_value = _typed_filter_value(str(value).strip(), lookup)
+    return {'%s__%s' % (column, lookup): typed_value}
+
+
+def tag_exists(queryset, slug, *conditions, **condition):
+    """
+    A correlated EXISTS subquery selecting the tags of the objects in queryset with a key whose
+    slug is slug and that match conditions (Q objects) and condition
+    """
+    tag_model = queryset.model._meta.get_field('tags').related_model
+    term_model = tag_model._meta.get_field('key').related_model
+
+    # resolving the key ids here keeps the subquery on the tag table (and its indexes)
+    key_ids = list(term_model.objects.filter(slug=slug).values_list('pk', flat=True))
+    return term_exists(queryset, key_ids, *conditions, **condition)
+
+
+def term_exists(queryset, key_ids, *conditions, **condition):
+    """
+    A correlated EXISTS subquery selecting the tags of the objects in queryset with a key in key_ids
+    that match conditions (Q objects) and condition
+    """
+    tag_model = queryset.model._meta.get_field('tags').related_model
+    return Exists(
+        tag_model.objects.filter(*conditions, object_id=OuterRef('pk'), key_id__in=key_ids, **condition)
+    )
+
+
+def term_filter(queryset, key_ids):
+    """Filters queryset to objects with a tag whose key is in key_ids (without the duplicates of a join)"""
+    annotation_name = '_tag_filter_%d' % len(queryset.query.annotations)
+    return queryset.annotate(**{annotation_name: term_exists(queryset, key_ids)}).filter(**{annotation_name: True})
+
+
+def tag_value_filter(queryset, slug, lookup, value):
+    """Filters queryset to objects with a tag whose key is slug and whose value matches value using lookup"""
+    annotation_name = '_tag_filter_%d' % len(queryset.query.annotations)
+    return queryset.annotate(
+        **{annotation_name: tag_exists(queryset, slug, **tag_value_condition(value, lookup))}
+    ).filter(**{annotation_name: True})
+
+
+def has_tags(model):
+    try:
+        model._meta.get_field('tags')
+        return True
+    except Exception:
+        return False
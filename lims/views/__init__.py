@@ -6,6 +6,8 @@ from .list import *
 from .detail import *
 from .ajax import *
 from .data_view import *
+from .uploads import *
+from .jobs import *
 
 from django.views import generic
 
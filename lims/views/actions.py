@@ -1,27 +1,43 @@
 
+import io
+import os
 import re
 import csv
+import copy
+import tempfile
 
-from django.shortcuts import redirect
+from django.shortcuts import redirect, get_object_or_404
 from django.views import generic
 from django.urls import reverse_lazy
-from django.http import Http404, HttpResponse, QueryDict, HttpResponseBadRequest
+from django.http import Http404, HttpResponse, QueryDict, HttpResponseBadRequest, HttpRequest, \
+    StreamingHttpResponse, FileResponse
 from django.db import IntegrityError
 from django.utils.safestring import mark_safe
 from django.utils.html import format_html
-from django.utils import timezone
-import reversion
 
-from .. import models
+from .. import models, bulk
+from ..jobs import register_job, submit_job
+from ..export import SAMPLE_EXPORT_FIELDS, ExportError, export_header, iter_export_rows, export_npz, export_feather, \
+    export_xlsx, long_export_tag_terms, long_export_header, iter_long_export_rows, iter_geojson, export_geopackage
+from ..revisions import bulk_revision
+from ..utils.tag_values import TagFilterError
 from .accounts import LimsLoginMixin
+from .data_view import DataWidgetView
 from .edit import SampleBulkAddView, SampleForm
 from .forms import SampleSelect2Widget
 
 
-def find_action_view(model, action):
+def model_actions(model):
+    """The bulk actions for data widgets of model (a lowercase model name)"""
     if model == 'sample':
-        action_list = SAMPLE_ACTIONS
+        return SAMPLE_ACTIONS
     else:
+        return ()
+
+
+def find_action_view(model, action):
+    action_list = model_actions(model)
+    if not action_list:
         raise Http404('No such model')
 
     for action_item in action_list:
@@ -32,13 +48,28 @@ def find_action_view(model, action):
 
 
 def resolve_action_view(request, model):
+    # check login
+    if not request.user.pk:
+        return HttpResponseBadRequest('Permission denied')
+
     # resolve the action
     if 'action' not in request.POST:
         return HttpResponseBadRequest('No action provided')
     action = request.POST['action']
+    action_view = find_action_view(model, action)
 
-    # resolve the objects
-    new_querydict = extract_selected_ids(request.POST)
+    # store the selected objects on the server (there may be too many to fit in a URL)
+    selection = models.SelectionSet(user=request.user, model=action_view.model.__name__)
+    if request.POST.get('select_all', ''):
+        selection.data_widget = request.POST.get('selection_data_widget', '')
+        selection.query_string = request.POST.get('selection_query', '')
+        selection.save()
+    else:
+        selection.save()
+        selection.set_ids(extract_selected_ids(request.POST))
+
+    new_querydict = QueryDict(mutable=True)
+    new_querydict['selection'] = selection.pk
 
     # keep the return URL
     if 'from' in request.GET:
@@ -79,9 +110,25 @@ def extract_selected_ids(data):
     for key, value in data.items():
         if regex.match(key) and value:
             ids.append(int(regex.search(key).group(1)))
-    ids_query = QueryDict(mutable=True)
-    ids_query.setlist('id__in', ids)
-    return ids_query
+    return ids
+
+
+def selection_queryset(selection, request):
+    """
+    Evaluates a SelectionSet: its explicit items, or the objects that its data widget would list for
+    request.user (rebuilt from the data_view endpoint, so that restrictions like parent_id and term_id
+    are kept). Raises TagFilterError if the stored filter is not valid.
+    """
+    if not selection.is_filter():
+        return selection.item_queryset()
+
+    query_dict = QueryDict(mutable=True)
+    for key, values in QueryDict(selection.query_string).lists():
+        query_dict.setlist(selection.data_widget + '_' + key, values)
+    widget_request = copy.copy(request)
+    widget_request.GET = query_dict
+    bound_dw = DataWidgetView.static_bound_data_widget(widget_request, selection.model, selection.data_widget)
+    return bound_dw.filtered_queryset()
 
 
 class ActionListView(generic.ListView):
@@ -111,7 +158,31 @@ class ActionListView(generic.ListView):
         context['item_text'] = self.model.__name__.lower()
         return context
 
+    def get_selection(self):
+        selection_id = self.request.GET.get('selection', '')
+        if not selection_id:
+            return None
+        if not re.match(r'^[0-9]+$', selection_id):
+            raise Http404('Invalid selection')
+
+        selection = get_object_or_404(models.SelectionSet, pk=selection_id, user=self.request.user)
+        if selection.get_model() is not self.model:
+            raise Http404('Selection is not of the correct model')
+        return selection
+
     def get_queryset(self):
+        selection = self.get_selection()
+        if selection is not None:
+            try:
+                queryset = selection_queryset(selection, self.request).order_by('-modified')
+            except TagFilterError as e:
+                # show the error instead of the objects that the filter would have selected
+                self.add_error('The filter of this selection is not valid: %s' % e)
+                return self.model.objects.none()
+            if not queryset.exists():
+                raise Http404('Could not find any objects')
+            return queryset
+
         id_in = self.request.GET.getlist('id__in')
         queryset = self.model.objects.all().filter(id__in=id_in).order_by('-modified')
         if not queryset:
@@ -122,10 +193,31 @@ class ActionListView(generic.ListView):
 
 
 class BulkActionView(ActionListView):
+    # the job that runs large selections (see bulk_action_job())
+    job_name = 'bulk_action'
+    # selections larger than this are run by the job runner instead of in the request
+    job_threshold = 1000
+    # if set, jobs run do_action() on chunks of this size and report progress between them
+    job_chunk_size = None
+    # the confirmation page only lists this many of the selected objects
+    preview_limit = 100
+
+    def get_context_data(self, *args, **kwargs):
+        context = super().get_context_data(*args, **kwargs)
+        context['object_count'] = self.object_list.count()
+        context['preview_list'] = self.object_list[:self.preview_limit]
+        return context
 
     def post(self, request):
         try:
-            result = self.do_action(request, self.get_queryset())
+            queryset = self.get_queryset()
+            if self.errors:
+                self.object_list = queryset
+                return self.render_to_response(self.get_context_data())
+            if self.job_threshold is not None and queryset.count() > self.job_threshold:
+                return self.submit_job(request, queryset)
+
+            result = self.do_action(request, queryset)
             if self.errors:
                 return self.get(request)
             elif result is not None:
@@ -138,26 +230,88 @@ class BulkActionView(ActionListView):
     def do_action(self, request, queryset):
         raise NotImplementedError()
 
+    def get_job_params(self, request):
+        return {
+            'model': request.resolver_match.kwargs['model'],
+            'action': request.resolver_match.kwargs['action']
+        }
+
+    def submit_job(self, request, queryset):
+        params = self.get_job_params(request)
+
+        selection = self.get_selection()
+        if selection is not None:
+            # the objects are fixed when the job is submitted rather than when it is run
+            if selection.is_filter():
+                selection.freeze(queryset)
+            n_objects = selection.items.count()
+            params['selection'] = selection.pk
+        else:
+            params['ids'] = list(queryset.values_list('pk', flat=True))
+            n_objects = len(params['ids'])
+
+        job = submit_job(
+            self.job_name,
+            request.user,
+            description='%s %d %ss' % (self.action_name, n_objects, self.model.__name__.lower()),
+            **params
+        )
+        return redirect(job.get_absolute_url())
+
+
+@register_job
+def bulk_action_job(job, model, action, ids=None, selection=None):
+    """Runs BulkActionView.do_action() outside of a request on behalf of the user that submitted the job"""
+    request = HttpRequest()
+    request.method = 'POST'
+    request.user = job.user
+
+    view = find_action_view(model, action)()
+    view.setup(request)
+
+    if selection is not None:
+        queryset = models.SelectionSet.objects.get(pk=selection).item_queryset()
+    else:
+        queryset = view.model.objects.filter(id__in=ids)
+
+    if view.job_chunk_size:
+        # chunks are read by primary key as they are needed, so large selections are never in memory
+        n_objects = max(queryset.count(), 1)
+        n_done = 0
+        for pks in bulk.iter_pk_chunks(queryset, view.job_chunk_size):
+            view.do_action(request, view.model.objects.filter(pk__in=pks).order_by('-modified'))
+            n_done += len(pks)
+            job.set_progress(n_done / n_objects)
+            if view.errors:
+                break
+    else:
+        result = view.do_action(request, queryset.order_by('-modified'))
+        if result is not None:
+            job.save_response(result)
+
+    for message in view.messages:
+        job.add_message(message)
+    for error in view.errors:
+        job.add_error(error)
+
 
 class MultiDeleteView(BulkActionView):
     action_name = 'delete'
+    job_chunk_size = 500
 
     def do_action(self, request, queryset):
-        current_user = request.user
         deleted = 0
 
         try:
-            with reversion.create_revision():
-                for obj in queryset:
-                    if obj.user_can(current_user, 'edit'):
-                        obj.delete()
-                        deleted += 1
-                    else:
-                        raise models.ObjectPermissionError(obj)
-
-                # set meta information
-                reversion.set_user(self.request.user)
-                reversion.set_comment('deleted from MultiDeleteView')
+            with bulk_revision(user=self.request.user, comment='deleted from MultiDeleteView') as revision:
+                bulk.check_queryset_permission(queryset, request.user, 'edit')
+
+                # deleted objects and their tags are recorded so that they can be recovered
+                revision.add_deleted(queryset)
+                if getattr(self.model, 'tags', None) is not None:
+                    revision.add_deleted(self.model.tags.rel.related_model.objects.filter(object__in=queryset))
+
+                deleted = bulk.bulk_delete(queryset)
 
         except IntegrityError as e:
             if hasattr(e, 'protected_objects') and e.protected_objects:
@@ -180,80 +334,180 @@ class MultiDeleteView(BulkActionView):
 
 class SampleDeleteView(LimsLoginMixin, MultiDeleteView):
     model = models.Sample
-    success_url = reverse_lazy('lims:my_sample_list')
+    success_url = reverse_lazy('lims:sample_list')
 
 
 class SamplePrintBarcodeView(LimsLoginMixin, BulkActionView):
     model = models.Sample
     template_name = 'lims/action_views/sample_print_barcode.html'
     action_name = 'print barcodes'
+    job_threshold = None
 
     def do_action(self, request, queryset):
         self.add_error("Barcode printing isn't implemented yet...")
 
 
-def export_response(queryset, fields, terms):
+class _EchoWriter:
+    """A file-like object for csv.writer that returns lines instead of writing them"""
 
-    target_tz = timezone.get_default_timezone()
+    def write(self, value):
+        return value
 
-    def header_iter():
-        for field in fields:
-            yield field
-        for term in terms:
-            yield term.slug
 
-    def field_iter(instance):
-        for field in fields:
-            item = getattr(instance, field)
-            if hasattr(item, 'strftime'):
-                yield item.astimezone(target_tz).strftime('%Y-%m-%dT%H:%M%z')
-            else:
-                yield str(item)
-        for term in terms:
-            item = instance.get_tag(term)
-            if item is None:
-                yield 'NA'
-            else:
-                yield str(item)
+def export_response(queryset, fields, terms):
+    terms = list(terms)
+    writer = csv.writer(_EchoWriter())
 
-    response = HttpResponse(content_type='text/csv')
+    def lines():
+        yield writer.writerow(export_header(fields, terms))
+        for row in iter_export_rows(queryset, fields, terms):
+            yield writer.writerow(row)
+
+    response = StreamingHttpResponse(lines(), content_type='text/csv')
     response['Content-Disposition'] = 'attachment; filename = "LIMS_export.csv"'
-    writer = csv.writer(response)
-    writer.writerow(header_iter())
-    for obj in queryset:
-        writer.writerow(field_iter(obj))
     return response
 
 
 class SampleExportView(LimsLoginMixin, BulkActionView):
     model = models.Sample
     action_name = 'export'
+    # large exports are rendered by a pool of processes
+    job_name = 'export'
+
+    def get_job_params(self, request):
+        return {'model': self.model.__name__}
 
     def do_action(self, request, queryset):
         return export_response(
             queryset,
-            fields=['id', 'slug', 'user', 'name', 'description', 'collected'],
+            fields=SAMPLE_EXPORT_FIELDS,
             terms=self.model.get_all_terms(queryset)
         )
 
 
+class SampleXlsxExportView(LimsLoginMixin, BulkActionView):
+    model = models.Sample
+    action_name = 'export'
+
+    def do_action(self, request, queryset):
+        # the workbook is written to a temporary file that is deleted when the response is closed
+        out = tempfile.TemporaryFile()
+        try:
+            export_xlsx(queryset, out, fields=SAMPLE_EXPORT_FIELDS, terms=self.model.get_all_terms(queryset))
+        except ExportError as e:
+            out.close()
+            self.add_error(str(e))
+            return None
+
+        out.seek(0)
+        return FileResponse(
+            out,
+            as_attachment=True,
+            filename='LIMS_export.xlsx',
+            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        )
+
+
+class SampleGeoJSONExportView(LimsLoginMixin, BulkActionView):
+    """Exports the geometry of each sample as a GeoJSON feature (with the tags as properties)"""
+    model = models.Sample
+    action_name = 'export'
+
+    def do_action(self, request, queryset):
+        response = StreamingHttpResponse(
+            iter_geojson(queryset, fields=SAMPLE_EXPORT_FIELDS, terms=self.model.get_all_terms(queryset)),
+            content_type='application/geo+json'
+        )
+        response['Content-Disposition'] = 'attachment; filename = "LIMS_export.geojson"'
+        return response
+
+
+class SampleGeoPackageExportView(LimsLoginMixin, BulkActionView):
+    model = models.Sample
+    action_name = 'export'
+
+    def do_action(self, request, queryset):
+        # SQLite needs a path, which is removed once the response has opened the file (and set its length)
+        fd, path = tempfile.mkstemp(suffix='.gpkg')
+        os.close(fd)
+        os.remove(path)
+        try:
+            export_geopackage(queryset, path, fields=SAMPLE_EXPORT_FIELDS, terms=self.model.get_all_terms(queryset))
+            return FileResponse(
+                open(path, 'rb'),
+                as_attachment=True,
+                filename='LIMS_export.gpkg',
+                content_type='application/geopackage+sqlite3'
+            )
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class SampleLongExportView(LimsLoginMixin, BulkActionView):
+    """Exports one row per tag (with its sample, comment, user, dates, and the tags of the tag)"""
+    model = models.Sample
+    action_name = 'export tags of'
+
+    def do_action(self, request, queryset):
+        tag_terms = list(long_export_tag_terms(queryset))
+        writer = csv.writer(_EchoWriter())
+
+        def lines():
+            yield writer.writerow(long_export_header(queryset, tag_terms))
+            for row in iter_long_export_rows(queryset, tag_terms):
+                yield writer.writerow(row)
+
+        response = StreamingHttpResponse(lines(), content_type='text/csv')
+        response['Content-Disposition'] = 'attachment; filename = "LIMS_export_long.csv"'
+        return response
+
+
+class SampleMatrixExportView(LimsLoginMixin, BulkActionView):
+    """Exports the numeric tag values of samples as a samples x terms matrix for analysis"""
+    model = models.Sample
+    action_name = 'export numeric values'
+    matrix_format = 'npz'
+    sparse = False
+
+    def do_action(self, request, queryset):
+        out = io.BytesIO()
+        try:
+            if self.matrix_format == 'feather':
+                export_feather(queryset, out)
+            else:
+                export_npz(queryset, out, sparse=self.sparse)
+        except ExportError as e:
+            self.add_error(str(e))
+            return None
+
+        response = HttpResponse(out.getvalue(), content_type='application/octet-stream')
+        response['Content-Disposition'] = 'attachment; filename = "LIMS_export.%s"' % self.matrix_format
+        return response
+
+
+class SampleSparseMatrixExportView(SampleMatrixExportView):
+    sparse = True
+
+
+class SampleFeatherExportView(SampleMatrixExportView):
+    matrix_format = 'feather'
+
+
 class SamplePublishView(LimsLoginMixin, BulkActionView):
     model = models.Sample
     action_name = 'publish'
+    job_chunk_size = 500
 
     def new_status(self):
         return 'published'
 
     def do_action(self, request, queryset):
-        current_user = request.user
+        changed = 0
         try:
-            with reversion.create_revision():
-                for obj in queryset:
-                    if obj.user_can(current_user, 'edit'):
-                        obj.status = self.new_status()
-                        obj.save()
-                    else:
-                        raise models.ObjectPermissionError(obj)
+            with bulk_revision(user=request.user, comment='%s from SamplePublishView' % self.action_name) as revision:
+                bulk.check_queryset_permission(queryset, request.user, 'edit')
+                changed = bulk.bulk_set_status(queryset, self.new_status(), revision=revision)
 
         except models.ObjectPermissionError as e:
             self.add_error(
@@ -263,7 +517,7 @@ class SamplePublishView(LimsLoginMixin, BulkActionView):
                 )
             )
 
-        self.add_message('%s items were successfully %sed' % (queryset.count(), self.action_name))
+        self.add_message('%s items were successfully %sed' % (changed, self.action_name))
 
 
 class SampleUnPublishView(SamplePublishView):
@@ -296,6 +550,16 @@ class SampleBulkEditView(SampleBulkAddView, ActionListView):
     def get_extra_forms(self):
         return 0
 
+    def get_project(self):
+        if 'project_id' in self.kwargs:
+            return super().get_project()
+
+        # tag terms are resolved in the project context, so all the samples must share a project
+        project_ids = list(self.get_queryset().order_by().values_list('project_id', flat=True).distinct()[:2])
+        if len(project_ids) != 1:
+            raise Http404('Samples can only be edited together if they are from the same project')
+        return get_object_or_404(models.Project, pk=project_ids[0])
+
     def get_form_kwargs(self):
         kwargs = super().get_form_kwargs()
         kwargs["project"] = self.get_project()
@@ -306,6 +570,16 @@ SAMPLE_ACTIONS = [
     {'value': 'delete', 'label': 'Delete samples', 'view': SampleDeleteView},
     {'value': 'print', 'label': 'Print barcodes', 'view': SamplePrintBarcodeView},
     {'value': 'export', 'label': 'Export selected samples', 'view': SampleExportView},
+    {'value': 'export-xlsx', 'label': 'Export selected samples (Excel)', 'view': SampleXlsxExportView},
+    {'value': 'export-geojson', 'label': 'Export locations of selected samples (GeoJSON)',
+     'view': SampleGeoJSONExportView},
+    {'value': 'export-gpkg', 'label': 'Export locations of selected samples (GeoPackage)',
+     'view': SampleGeoPackageExportView},
+    {'value': 'export-long', 'label': 'Export tags of selected samples (long format)', 'view': SampleLongExportView},
+    {'value': 'export-npz', 'label': 'Export numeric values (NumPy)', 'view': SampleMatrixExportView},
+    {'value': 'export-npz-sparse', 'label': 'Export numeric values (sparse NumPy)',
+     'view': SampleSparseMatrixExportView},
+    {'value': 'export-feather', 'label': 'Export numeric values (Arrow)', 'view': SampleFeatherExportView},
     {'value': 'publish', 'label': 'Publish selected samples', 'view': SamplePublishView},
     {'value': 'unpublish', 'label': 'Unpublish selected samples', 'view': SampleUnPublishView},
     {'value': 'bulkedit', 'label': 'Bulk Edit selected samples', 'view': SampleBulkEditView}
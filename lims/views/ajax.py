@@ -3,8 +3,10 @@ import json
 
 from django.views import generic
 from django.http import HttpResponse, HttpResponseForbidden
+from django.core.serializers.json import DjangoJSONEncoder
 
 from .. import models
+from ..delta import DeltaError, delta_export, resolve_delta_model, DELTA_EXPORT_LIMIT, DELTA_EXPORT_MAX_LIMIT
 from ..widgets.data_widget import query_string_filter
 
 
@@ -14,7 +16,7 @@ class AjaxBaseView(generic.View):
         if not request.user.pk:
             return HttpResponseForbidden()
         return HttpResponse(
-            content=json.dumps(self.request_data(request, *args, **kwargs)),
+            content=json.dumps(self.request_data(request, *args, **kwargs), cls=DjangoJSONEncoder),
             content_type='application/json'
         )
 
@@ -118,3 +120,35 @@ class LimsSelect2Ajax(AjaxBaseView):
         return {
             'err': message
         }
+
+
+class DeltaExportView(AjaxBaseView):
+    """
+    The changes to objects (and their tags) since a cursor, for incremental copies: pass the
+    returned cursor to get the next changes, and repeat until complete is true
+    """
+
+    def request_data(self, request, *args, **kwargs):
+        try:
+            model = resolve_delta_model(kwargs['model'])
+            try:
+                project_id = int(request.GET.get('project') or 0)
+                limit = min(max(int(request.GET.get('limit', DELTA_EXPORT_LIMIT)), 1), DELTA_EXPORT_MAX_LIMIT)
+            except ValueError:
+                raise DeltaError('Project and limit must be numbers')
+
+            project = None
+            if project_id:
+                project = models.Project.objects.filter(pk=project_id).first()
+                if project is None:
+                    raise DeltaError('No such project: %s' % project_id)
+
+            return delta_export(
+                model,
+                cursor=request.GET.get('cursor', ''),
+                project=project,
+                user=request.user,
+                limit=limit
+            )
+        except DeltaError as e:
+            return self.error_data(str(e))
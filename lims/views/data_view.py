@@ -5,10 +5,14 @@ from django.shortcuts import get_object_or_404
 from django.views import generic
 from django.http import HttpResponse, HttpResponseForbidden, Http404
 from django.utils.functional import cached_property
+from django.urls import reverse
+from django.template.loader import get_template
 
 from .. import models
 from ..widgets.widgets import WidgetError
 from ..widgets import data_widget
+from ..widgets.data_widget import TermField
+from ..utils.tag_values import has_tags, term_filter
 
 _data_widgets = {}
 
@@ -42,6 +46,11 @@ def unregister_data_widget(data_widget_class):
 for item in ['AttachmentDataWidget', 'ProjectDataWidget', 'SampleDataWidget', 'TagDataWidget', 'TermDataWidget']:
     register_data_widget(getattr(data_widget, item), re.sub(r'DataWidget$', '', item))
 
+# the name of a data widget is also its query string prefix and DOM id, so the tags of each model have their
+# own name (several tag tables can be on one page)
+for item in ['ProjectTag', 'SampleTag', 'SampleTagTag', 'AttachmentTag', 'TermTag']:
+    register_data_widget(data_widget.TagDataWidget, item)
+
 
 class DataWidgetView(generic.View):
 
@@ -55,27 +64,39 @@ class DataWidgetView(generic.View):
             raise Http404("Cannot find scope '%s'" % scope)
 
     def bound_data_widget(self, *args, **kwargs):
-        return DataWidgetView.bound_data_widget(*args, view=self, **kwargs)
+        return DataWidgetView.static_bound_data_widget(*args, view=self, **kwargs)
 
     @staticmethod
     def get_queryset(model):
-        model_class = models.LimsModelField.get_model(model)
+        try:
+            model_class = models.LimsModelField.get_model(model)
+        except ValueError:
+            model_class = None
         if model_class is None:
             raise Http404("Cannot find model '%s'" % model)
         return model_class.objects.all()
 
     @staticmethod
-    def data_widget(data_widget, **kwargs):
+    def data_widget(data_widget, *fields, **kwargs):
         if data_widget is None or data_widget not in _data_widgets:
             raise Http404("Cannot find data widget '%s'" % data_widget)
         kwargs.update({'name': data_widget})
-        return _data_widgets[data_widget](**kwargs)
+        return _data_widgets[data_widget](*fields, **kwargs)
+
+    @staticmethod
+    def data_widget_actions(model):
+        # actions.py imports this module
+        from .actions import model_actions
+        return model_actions(str(model).lower())
 
     @staticmethod
     def static_bound_data_widget(request, model, data_widget, output_type='html', view=None, **kwargs):
-        dw = DataWidgetView.data_widget(data_widget)
+        # the data widget's name is the query string prefix
+        prefix = str(data_widget) + '_'
         project_id = kwargs.pop('project_id') if 'project_id' in kwargs else \
-            request.GET.get(dw.name + '_project_id', None)
+            request.GET.get(prefix + 'project_id', None)
+        term_id = kwargs.pop('term_id') if 'term_id' in kwargs else \
+            request.GET.get(prefix + 'term_id', None)
 
         context = kwargs.pop('context', {})
         if 'view' not in context and view is not None:
@@ -84,17 +105,70 @@ class DataWidgetView(generic.View):
         if project_id is not None and 'project' not in context:
             context['project'] = get_object_or_404(models.Project, pk=project_id)
 
-        return dw.bind(
-            DataWidgetView.get_queryset(model),
+        # the page that loaded this widget, so that actions return there
+        return_url = request.GET.get('from', '')
+        if return_url.startswith('/') and 'return_url' not in context:
+            context['return_url'] = return_url
+
+        queryset = DataWidgetView.get_queryset(model)
+
+        # objects tagged with a term, with a column for its values
+        extra_fields = []
+        if term_id:
+            if not has_tags(queryset.model):
+                raise Http404("Model '%s' does not have tags" % model)
+            term = get_object_or_404(models.Term, pk=term_id)
+            extra_fields.append(TermField(term))
+            queryset = term_filter(queryset, [term.pk])
+
+        dw = DataWidgetView.data_widget(data_widget, *extra_fields, actions=DataWidgetView.data_widget_actions(model))
+
+        bound_dw = dw.bind(
+            queryset,
             request,
             output_type,
             project_id=project_id,
             context=context,
+            selection_data_widget=data_widget,
             **kwargs
         )
+        # selections of all matching objects are rebuilt from the query string (see selection_queryset())
+        if term_id:
+            bound_dw.query_dict[prefix + 'term_id'] = term_id
+        return bound_dw
+
+
+class ConcurrentDataWidgetsMixin:
+    """
+    Evaluates the BoundDataWidgets in the context of a view (directly or as values of a dict) on a
+    thread pool before rendering, for views with several independent tables
+    """
+    concurrent_data_widgets = True
+    max_data_widget_workers = 4
+
+    def get_bound_data_widgets(self, context):
+        bound_widgets = []
+        for value in context.values():
+            values = value.values() if isinstance(value, dict) else (value, )
+            bound_widgets.extend(item for item in values if isinstance(item, data_widget.BoundDataWidget))
+        return bound_widgets
+
+    def render_to_response(self, context, **response_kwargs):
+        if self.concurrent_data_widgets:
+            data_widget.evaluate_bound_widgets(
+                self.get_bound_data_widgets(context),
+                max_workers=self.max_data_widget_workers
+            )
+        return super().render_to_response(context, **response_kwargs)
 
 
 class LazyDataWidget:
+    """
+    A data widget that is rendered as a placeholder and loaded from the data_view endpoint when
+    it scrolls into view (see data_view.js). Keyword arguments restrict the objects in the widget
+    (e.g., project_id, parent_id, or term_id) and must be in the data widget's filter_fields.
+    """
+    template = 'lims/data_view/lazy.html'
 
     def __init__(self, request, model, data_widget, output_type='html', **kwargs):
         self.request = request
@@ -113,5 +187,34 @@ class LazyDataWidget:
             **self.kwargs
         )
 
-    def __str__(self):
+    @property
+    def name(self):
+        return self.data_widget
+
+    def query_dict(self):
+        query_dict = self.request.GET.copy()
+        for key, value in self.kwargs.items():
+            if value is not None:
+                query_dict[self.name + '_' + key] = value
+        query_dict['from'] = self.request.get_full_path()
+        return query_dict
+
+    def url(self, scope='widget'):
+        return reverse(
+            'lims:data_view',
+            kwargs={
+                'model': self.model,
+                'data_widget': self.data_widget,
+                'output_type': self.output_type,
+                'scope': scope
+            }
+        ) + '?' + self.query_dict().urlencode()
+
+    def as_placeholder(self):
+        return get_template(self.template).render({'dv': self, 'url': self.url()})
+
+    def as_widget(self):
         return self.bound_widget.as_widget()
+
+    def __str__(self):
+        return self.as_placeholder()
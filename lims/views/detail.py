@@ -3,17 +3,23 @@ from collections import OrderedDict
 
 from django.views import generic
 from django.shortcuts import get_object_or_404
-from django.http import FileResponse
+from django.http import FileResponse, Http404
 from django.contrib.auth.models import User
 
 from .. import models
+from ..stats import term_stats
 from .accounts import LimsLoginMixin
+from .ajax import AjaxBaseView
+from .data_view import LazyDataWidget, ConcurrentDataWidgetsMixin
 from .actions import SAMPLE_ACTIONS
 from ..widgets.data_widget import SampleDataWidget, \
     TermDataWidget, AttachmentDataWidget, TagDataWidget, TermField, get_widget_class
 
 
-class DetailViewWithTablesBase(generic.DetailView):
+class DetailViewWithTablesBase(ConcurrentDataWidgetsMixin, generic.DetailView):
+    # render placeholders that load each table from the data_view endpoint when it scrolls into view
+    # (otherwise, the tables are evaluated concurrently before the page is rendered)
+    lazy_tables = True
 
     def get_project(self):
         if 'project_id' in self.kwargs:
@@ -33,6 +39,26 @@ class DetailViewWithTablesBase(generic.DetailView):
     def get_attachment_queryset(self):
         return self.object.attachments.all()
 
+    # the same tables as filter_fields of the data widgets, for lazy tables (None for no table)
+    def get_sample_filters(self):
+        return None
+
+    def get_term_filters(self):
+        return None
+
+    def get_tag_filters(self):
+        return {'object_id': self.object.pk, 'key__taxonomy': self.model.__name__}
+
+    def get_attachment_filters(self):
+        return None
+
+    def get_lazy_data_widget(self, model, data_widget, filters, view_project=None):
+        if filters is None:
+            return None
+        if view_project is not None:
+            filters = dict(filters, project_id=view_project.pk)
+        return LazyDataWidget(self.request, model, data_widget, **filters)
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
 
@@ -43,6 +69,19 @@ class DetailViewWithTablesBase(generic.DetailView):
         elif 'project' in context:
             view_project = context['project']
 
+        if self.lazy_tables:
+            tables = (
+                ('sample_dv', 'Sample', 'Sample', self.get_sample_filters()),
+                ('term_dv', 'Term', 'Term', self.get_term_filters()),
+                ('attachment_dv', 'Attachment', 'Attachment', self.get_attachment_filters()),
+                ('tags_dv', self.model.__name__ + 'Tag', self.model.__name__ + 'Tag', self.get_tag_filters())
+            )
+            for context_name, model, data_widget, filters in tables:
+                lazy_dv = self.get_lazy_data_widget(model, data_widget, filters, view_project)
+                if lazy_dv is not None:
+                    context[context_name] = lazy_dv
+            return context
+
         sample_queryset = self.get_sample_queryset()
         if sample_queryset is not None:
             context['sample_dv'] = SampleDataWidget(
@@ -66,17 +105,11 @@ class DetailViewWithTablesBase(generic.DetailView):
 
         tags_queryset = self.get_tag_queryset()
         if tags_queryset is not None:
-            tag_dv = TagDataWidget(
+            context['tags_dv'] = TagDataWidget(
                 name='tags',
-                actions=()  # no tag actions yet
-            )
-
-            # remove the 'object' field, because we're already on the detail page
-            for i, field in enumerate(list(tag_dv.fields)):
-                if field.slug == 'object':
-                    tag_dv.fields.pop(i)
-
-            context['tags_dv'] = tag_dv.bind(tags_queryset, self.request, project=view_project)
+                actions=(),  # no tag actions yet
+                exclude=('object', )  # we're already on the detail page
+            ).bind(tags_queryset, self.request, project=view_project)
 
         return context
 
@@ -91,6 +124,15 @@ class ProjectDetailView(LimsLoginMixin, DetailViewWithTablesBase):
     def get_term_queryset(self):
         return models.Term.objects.filter(project=self.object)
 
+    def get_sample_filters(self):
+        return {'project_id': self.object.pk}
+
+    def get_term_filters(self):
+        return {'project_id': self.object.pk}
+
+    def get_attachment_filters(self):
+        return {'project_id': self.object.pk}
+
 
 class SampleDetailView(LimsLoginMixin, DetailViewWithTablesBase):
     template_name = 'lims/detail/sample_detail.html'
@@ -102,6 +144,12 @@ class SampleDetailView(LimsLoginMixin, DetailViewWithTablesBase):
     def get_sample_queryset(self):
         return self.object.children.all()
 
+    def get_sample_filters(self):
+        return {'parent_id': self.object.pk}
+
+    def get_attachment_filters(self):
+        return {'samples': self.object.pk}
+
 
 class UserDetailView(LimsLoginMixin, DetailViewWithTablesBase):
     template_name = 'lims/detail/user_detail.html'
@@ -116,6 +164,15 @@ class UserDetailView(LimsLoginMixin, DetailViewWithTablesBase):
     def get_tag_queryset(self):
         return None
 
+    def get_sample_filters(self):
+        return {'user_id': self.object.pk}
+
+    def get_attachment_filters(self):
+        return {'user_id': self.object.pk}
+
+    def get_tag_filters(self):
+        return None
+
 
 class TermDetailView(LimsLoginMixin, DetailViewWithTablesBase):
     template_name = 'lims/detail/term_detail.html'
@@ -135,15 +192,33 @@ class TermDetailView(LimsLoginMixin, DetailViewWithTablesBase):
         for model in (models.Project, models.Sample, models.SampleTag, models.Attachment):
             widget_class = get_widget_class(model)
 
+            if self.lazy_tables:
+                # data widgets are registered by model name, so that the table of SampleTag values doesn't
+                # share its name (and query string prefix) with this term's own tags (TermTag)
+                value_data_views[model.__name__] = self.get_lazy_data_widget(
+                    model.__name__,
+                    model.__name__,
+                    {'term_id': self.object.pk},
+                    view_project
+                )
+                continue
+
             value_data_views[model.__name__] = widget_class(
                 TermField(self.object),
                 name='tags_' + model.__name__.lower()
             ).bind(model.objects.filter(tags__key=self.object).distinct(), self.request, project=view_project)
 
         context['value_dvs'] = value_data_views
+        context['term_stats'] = term_stats(self.object, self.request.user)
         return context
 
 
+class TermStatsView(AjaxBaseView):
+
+    def request_data(self, request, *args, **kwargs):
+        return term_stats(get_object_or_404(models.Term, pk=kwargs['pk']), request.user)
+
+
 class AttachmentDetailView(LimsLoginMixin, DetailViewWithTablesBase):
     template_name = 'lims/detail/attachment_detail.html'
     model = models.Attachment
@@ -157,9 +232,22 @@ class AttachmentDetailView(LimsLoginMixin, DetailViewWithTablesBase):
     def get_attachment_queryset(self):
         return None
 
+    def get_sample_filters(self):
+        return {'attachments': self.object.pk}
+
 
 class AttachmentDownloadView(LimsLoginMixin, generic.View):
 
     def dispatch(self, request, *args, **kwargs):
         obj = get_object_or_404(models.Attachment, pk=kwargs['pk'])
         return FileResponse(obj.file.open('rb'), filename=obj.file.name, as_attachment=True)
+
+
+class AttachmentThumbnailView(LimsLoginMixin, generic.View):
+
+    def dispatch(self, request, *args, **kwargs):
+        obj = get_object_or_404(models.Attachment, pk=kwargs['pk'])
+        preview = obj.get_preview()
+        if preview is None or not preview.thumbnail:
+            raise Http404('No thumbnail for this attachment')
+        return FileResponse(preview.thumbnail.open('rb'), content_type='image/png')
@@ -1,8 +1,13 @@
 
+import io
+
+from django.forms import Form, FileField, ChoiceField
 from django.views import generic
 from django.urls import reverse_lazy
+from django.shortcuts import redirect, get_object_or_404
 
 from .. import models
+from ..bulk import import_samples, SampleImporter, ImportValidationError
 from .accounts import LimsLoginMixin
 from .forms import BaseObjectModelForm, ObjectFormView, BulkEditViewBase,\
     SampleSelect2Widget, DateTimePicker, TermSelect2Widget
@@ -52,9 +57,9 @@ class SampleAddView(LimsLoginMixin, ObjectFormView, generic.CreateView):
     def get_success_url(self):
         project = self.get_project()
         if project:
-            return reverse_lazy('lims:project_my_sample_list', kwargs={"project_id": self.get_project().pk})
+            return reverse_lazy('lims:project_sample_list', kwargs={"project_id": self.get_project().pk})
         else:
-            return reverse_lazy('lims:my_sample_list')
+            return reverse_lazy('lims:sample_list')
 
 
 class SampleChangeView(LimsLoginMixin, ObjectFormView, generic.UpdateView):
@@ -85,6 +90,51 @@ class SampleBulkAddView(LimsLoginMixin, BulkEditViewBase):
     def get_success_url(self):
         project = self.get_project()
         if project:
-            return reverse_lazy('lims:project_my_sample_list', kwargs={"project_id": self.get_project().pk})
+            return reverse_lazy('lims:project_sample_list', kwargs={"project_id": self.get_project().pk})
         else:
-            return reverse_lazy('lims:my_sample_list')
+            return reverse_lazy('lims:sample_list')
+
+
+class SampleImportForm(Form):
+    file = FileField(
+        help_text='A CSV or TSV (.tsv or .txt) file with one sample per row. The columns name, description, '
+                  'collected, geometry and parent (the ID of an existing sample) set sample fields, '
+                  'all other columns are added as tags.'
+    )
+    status = ChoiceField(choices=(('draft', 'Draft'), ('published', 'Published')), initial='draft')
+
+
+class SampleImportView(LimsLoginMixin, generic.FormView):
+    template_name = 'lims/forms/sample_import.html'
+    form_class = SampleImportForm
+
+    def get_project(self):
+        return get_object_or_404(models.Project, pk=self.kwargs['project_id'])
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['project'] = self.get_project()
+        return context
+
+    def form_valid(self, form):
+        project = self.get_project()
+        if not models.Sample(project=project).user_can(self.request.user, 'edit'):
+            form.add_error(None, 'User is not allowed to add samples to this project')
+            return self.form_invalid(form)
+
+        uploaded_file = form.cleaned_data['file']
+        f = io.TextIOWrapper(uploaded_file.file, encoding='utf-8-sig', newline='')
+        try:
+            import_samples(
+                f, project, self.request.user,
+                status=form.cleaned_data['status'],
+                delimiter=SampleImporter.guess_delimiter(uploaded_file.name)
+            )
+        except ImportValidationError as e:
+            for message in e.messages:
+                form.add_error('file', message)
+            if e.new_terms:
+                form.add_error(None, 'Columns that would be added as new terms: %s' % ', '.join(e.new_terms))
+            return self.form_invalid(form)
+
+        return redirect(reverse_lazy('lims:project_sample_list', kwargs={'project_id': project.pk}))
@@ -1,5 +1,6 @@
 
 import re
+import copy
 
 from django.shortcuts import get_object_or_404
 from django.forms import modelformset_factory,\
@@ -9,6 +10,7 @@ import reversion
 from django_select2.forms import ModelSelect2Widget
 
 from .. import models
+from ..revisions import bulk_revision
 
 
 class ProjectModelSelect2Widget(ModelSelect2Widget):
@@ -101,34 +103,42 @@ class ObjectFormView(generic.FormView):
 class BaseObjectModelForm(ModelForm):
     project_meta_field = CharField(widget=HiddenInput(), required=True)
 
-    def __init__(self, *args, user=None, project=None, tag_field_names=(), **kwargs):
+    def __init__(self, *args, user=None, project=None, tag_field_names=(), term_cache=None, **kwargs):
         super().__init__(*args, **kwargs)
         self.user = user
         self.project = project
         self.fields['project_meta_field'].initial = project.pk
+        # terms resolved by name, which may be shared between the forms of a formset
+        self.term_cache = {} if term_cache is None else term_cache
+        taxonomy = self._meta.model.__name__
+
+        # tags are read from instance.tags.all() so that they can be prefetched by a formset
+        instance_tags = sorted(self.instance.tags.all(), key=lambda tag: tag.pk)
 
         # add additional tag names that may exist from the current instance
-        current_tag_keys = self.instance.get_tags().keys()
         tag_field_names = list(tag_field_names)
-        for key in current_tag_keys:
-            tag_field_names.append(key)
+        for tag in instance_tags:
+            if tag.key.taxonomy == taxonomy:
+                tag_field_names.append(tag.key.slug)
 
         # add additional terms that exist in the form data
         for key in self.data:
             if re.match('^tag_form_field_(.*)$', key):
                 tag_field_names.append(re.search('^tag_form_field_(.*)$', key).group(1))
 
-        # set the tag names from tag_field_names
+        # resolve all the terms that aren't already known at once
         # currently only the model taxonomy can be used
+        missing_names = [name for name in tag_field_names if name not in self.term_cache]
+        if missing_names:
+            self.term_cache.update(models.Term.get_terms(missing_names, self.project, taxonomy=taxonomy, create=True))
+
+        # the last value of each tag is used, as in get_tag()
+        tag_values = {tag.key_id: tag.value for tag in instance_tags}
+
+        # set the tag names from tag_field_names
         self.tag_field_names = {}
         for field_name in tag_field_names:
-            # try to resolve term
-            term = models.Term.get_term(
-                field_name,
-                create=True,
-                project=self.project,
-                taxonomy=self._meta.model.__name__
-            )
+            term = self.term_cache.get(field_name, None)
 
             # if term can't be resolved, don't add it to the form
             # (most likely reason is that field_name is '')
@@ -142,8 +152,9 @@ class BaseObjectModelForm(ModelForm):
             # add the field
             field_id = 'tag_form_field_' + term.slug
             self.tag_field_names[term] = field_id
-            self.fields[field_id] = term.field
-            initial_val = self.instance.get_tag(term)
+            # terms may be shared between forms, but fields can't be
+            self.fields[field_id] = copy.deepcopy(term.field)
+            initial_val = tag_values.get(term.pk, None)
             if initial_val:
                 self.initial[field_id] = initial_val
 
@@ -177,16 +188,24 @@ class BaseObjectModelForm(ModelForm):
             raise ValidationError('User is not allowed to edit this sample')
 
     def save(self, *args, **kwargs):
-        # save the instance
-        return_val = super().save(*args, **kwargs)
+        # save the instance only if it is new or one of its fields changed
+        instance_changed = not self.instance.pk or any(name in self.changed_data for name in self._meta.fields)
+        if instance_changed:
+            return_val = super().save(*args, **kwargs)
+        else:
+            return_val = self.instance
 
         # tags need the instance to exist in the DB before creating them...
-        tags_dict = {term: self.cleaned_data[field] for term, field in self.tag_field_names.items()}
+        # only tags that changed are written
+        tags_dict = {
+            term: self.cleaned_data[field] for term, field in self.tag_field_names.items()
+            if field in self.changed_data
+        }
 
-        # update the tag information
+        # update the tag information (saving the instance if it wasn't saved above)
         # TODO: this could result in a ValidationError() from the full_clean() of
         # tag objects
-        self.instance.update_tags(_values=tags_dict)
+        self.instance.update_tags(_values=tags_dict, save_object=not instance_changed)
 
         # return whatever the super() returned
         return return_val
@@ -199,10 +218,18 @@ class BulkAddFormset(BaseModelFormSet):
         self.user = user
         self.project = project
         self.tag_field_names = list(tag_field_names)
+        self.term_cache = {}
+
+        # tags and their terms are fetched for all the instances at once and shared with each form
+        self.queryset = self.queryset.prefetch_related('tags__key')
 
         # add additional terms that exist in the queryset
-        for term in self.model.get_all_terms(self.queryset):
-            self.tag_field_names.append(term.slug)
+        taxonomy = self.model.__name__
+        for instance in self.get_queryset():
+            for tag in instance.tags.all():
+                if tag.key.taxonomy == taxonomy and tag.key.slug not in self.tag_field_names:
+                    self.tag_field_names.append(tag.key.slug)
+                    self.term_cache[tag.key.slug] = tag.key
 
         # add additional terms that exist in the form data
         for key in self.data:
@@ -220,6 +247,7 @@ class BulkAddFormset(BaseModelFormSet):
         kwargs['user'] = self.user
         kwargs['project'] = self.project
         kwargs['tag_field_names'] = self.tag_field_names
+        kwargs['term_cache'] = self.term_cache
         return kwargs
 
 
@@ -284,12 +312,7 @@ class BulkEditViewBase(ObjectFormView):
         if self.request.POST.get('add-form-tag-column', None):
             return self.form_invalid(form)
 
-        with reversion.create_revision():
+        # only the rows that are saved are recorded, not everything they follow
+        with bulk_revision(user=self.request.user, comment='bulk object creation from SampleBulkAddView'):
             form.save()
-            return_value = super().form_valid(form)
-
-            # add information about from whence it came
-            reversion.set_user(self.request.user)
-            reversion.set_comment('bulk object creation from SampleBulkAddView')
-
-            return return_value
+            return super().form_valid(form)
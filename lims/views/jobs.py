@@ -0,0 +1,52 @@
+from django.views import generic
+from django.shortcuts import get_object_or_404
+from django.http import FileResponse, Http404
+
+from .. import models
+from .accounts import LimsLoginMixin
+from .ajax import AjaxBaseView
+
+
+def job_queryset_for_user(user):
+    if user.is_staff:
+        return models.Job.objects.all()
+    return models.Job.objects.filter(user=user)
+
+
+class JobListView(LimsLoginMixin, generic.ListView):
+    template_name = 'lims/jobs/job_list.html'
+    paginate_by = 50
+
+    def get_queryset(self):
+        return job_queryset_for_user(self.request.user).order_by('-created')
+
+
+class JobDetailView(LimsLoginMixin, generic.DetailView):
+    template_name = 'lims/jobs/job_detail.html'
+    context_object_name = 'job'
+
+    def get_queryset(self):
+        return job_queryset_for_user(self.request.user)
+
+
+class JobStatusView(AjaxBaseView):
+
+    def request_data(self, request, *args, **kwargs):
+        job = get_object_or_404(job_queryset_for_user(request.user), pk=kwargs['pk'])
+        return {
+            'id': job.pk,
+            'status': job.status,
+            'progress': job.progress,
+            'messages': job.messages.splitlines(),
+            'errors': job.errors.splitlines(),
+            'result': bool(job.result)
+        }
+
+
+class JobResultDownloadView(LimsLoginMixin, generic.View):
+
+    def dispatch(self, request, *args, **kwargs):
+        job = get_object_or_404(job_queryset_for_user(request.user), pk=kwargs['pk'])
+        if not job.result:
+            raise Http404('This job has no result')
+        return FileResponse(job.result.open('rb'), filename=job.result.name.split('/')[-1], as_attachment=True)
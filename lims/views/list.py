@@ -8,6 +8,8 @@ from ..widgets.data_widget import SampleDataWidget, ProjectDataWidget, Attachmen
 
 
 class LimsListView(generic.TemplateView):
+    # the registered data widget that can rebuild the list for "select all" (see selection_queryset())
+    selection_data_widget = ''
 
     def get_data_view(self):
         raise NotImplementedError()
@@ -25,7 +27,8 @@ class LimsListView(generic.TemplateView):
             context['dv'] = dv.bind(
                 self.get_queryset(),
                 self.request,
-                project_id=context['project'].pk if 'project' in context else None
+                project_id=context['project'].pk if 'project' in context else None,
+                selection_data_widget=self.selection_data_widget
             )
         return context
 
@@ -38,6 +41,7 @@ class LimsListView(generic.TemplateView):
 
 class ProjectListView(LimsLoginMixin, LimsListView):
     template_name = "lims/lists/project_list.html"
+    selection_data_widget = 'Project'
 
     def get_data_view(self):
         return ProjectDataWidget()
@@ -48,6 +52,7 @@ class ProjectListView(LimsLoginMixin, LimsListView):
 
 class SampleListView(LimsLoginMixin, LimsListView):
     template_name = 'lims/lists/sample_list.html'
+    selection_data_widget = 'Sample'
 
     def get_data_view(self):
         return SampleDataWidget(actions=SAMPLE_ACTIONS)
@@ -58,6 +63,7 @@ class SampleListView(LimsLoginMixin, LimsListView):
 
 class AttachmentListView(LimsLoginMixin, LimsListView):
     template_name = 'lims/lists/attachment_list.html'
+    selection_data_widget = 'Attachment'
 
     def get_data_view(self):
         return AttachmentDataWidget()
@@ -68,6 +74,7 @@ class AttachmentListView(LimsLoginMixin, LimsListView):
 
 class TermListView(LimsLoginMixin, LimsListView):
     template_name = 'lims/lists/term_list.html'
+    selection_data_widget = 'Term'
 
     def get_data_view(self):
         return TermDataWidget()
@@ -0,0 +1,109 @@
+from django.shortcuts import get_object_or_404
+from django.http import HttpResponseNotAllowed
+from django.core.exceptions import ValidationError
+import reversion
+
+from .. import models
+from .ajax import AjaxBaseView
+
+
+class AttachmentUploadBaseView(AjaxBaseView):
+    """
+    Base view for the chunked upload protocol: POST to the init view to start an upload,
+    PUT each chunk (the raw request body) to the chunk view, then POST to the finalize view
+    to create the Attachment. The status view lists the chunks that have been received
+    so that interrupted uploads can be resumed.
+    """
+    allowed_methods = ('post', )
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method.lower() not in self.allowed_methods:
+            return HttpResponseNotAllowed([method.upper() for method in self.allowed_methods])
+        return super().dispatch(request, *args, **kwargs)
+
+    def get_upload(self, request, pk):
+        return get_object_or_404(models.AttachmentUpload, pk=pk, user=request.user, status='in-progress')
+
+    def upload_data(self, upload):
+        return {
+            'upload_id': upload.pk,
+            'filename': upload.filename,
+            'size': upload.size,
+            'status': upload.status,
+            'received_chunks': upload.received_chunks(),
+            'received_size': upload.received_size()
+        }
+
+
+class AttachmentUploadInitView(AttachmentUploadBaseView):
+
+    def request_data(self, request, *args, **kwargs):
+        project = get_object_or_404(models.Project, pk=kwargs['project_id'])
+        if not models.Attachment(project=project).user_can(request.user, 'edit'):
+            return self.error_data('User is not allowed to add attachments to this project')
+
+        filename = request.POST.get('filename', '').strip()
+        if not filename:
+            return self.error_data('A filename is required')
+
+        size = request.POST.get('size', '')
+        try:
+            size = int(size) if size else None
+        except ValueError:
+            return self.error_data('Size must be an integer')
+
+        upload = models.AttachmentUpload.objects.create(
+            project=project,
+            user=request.user,
+            name=request.POST.get('name', ''),
+            filename=filename,
+            size=size
+        )
+        return self.upload_data(upload)
+
+
+class AttachmentUploadStatusView(AttachmentUploadBaseView):
+    allowed_methods = ('get', )
+
+    def request_data(self, request, *args, **kwargs):
+        return self.upload_data(self.get_upload(request, kwargs['pk']))
+
+
+class AttachmentUploadChunkView(AttachmentUploadBaseView):
+    allowed_methods = ('put', )
+    max_chunk_size = 64 * 1024 * 1024
+
+    def request_data(self, request, *args, **kwargs):
+        upload = self.get_upload(request, kwargs['pk'])
+        try:
+            chunk = upload.write_chunk(int(kwargs['index']), request, max_size=self.max_chunk_size)
+        except ValueError as e:
+            return self.error_data(str(e))
+
+        return {
+            'upload_id': upload.pk,
+            'index': chunk.index,
+            'size': chunk.size,
+            'chunk_hash': chunk.chunk_hash
+        }
+
+
+class AttachmentUploadFinalizeView(AttachmentUploadBaseView):
+
+    def request_data(self, request, *args, **kwargs):
+        upload = self.get_upload(request, kwargs['pk'])
+        try:
+            with reversion.create_revision():
+                attachment = upload.finalize(description=request.POST.get('description', ''))
+
+                reversion.set_user(request.user)
+                reversion.set_comment('attachment creation from AttachmentUploadFinalizeView')
+        except ValidationError as e:
+            return self.error_data('; '.join(e.messages))
+
+        return {
+            'upload_id': upload.pk,
+            'attachment_id': attachment.pk,
+            'file_hash': attachment.file_hash,
+            'url': str(attachment.get_absolute_url())
+        }
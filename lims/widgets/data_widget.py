@@ -1,15 +1,24 @@
 
 import re
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from types import MappingProxyType
 
-from django.core.exceptions import FieldError
 from django.http import QueryDict
 from django.core.paginator import Paginator
-from django.db.models import Q, F, Case, When, prefetch_related_objects, Func, Max, Min
+from django.apps import apps
+from django.db import connections
+from django.db.models import Q, F, Case, When, prefetch_related_objects, Func, Max, Min, OuterRef, Subquery
 from django.urls import reverse_lazy
-from django.utils.html import format_html
+from django.utils.functional import cached_property
+from django.utils.html import format_html, conditional_escape
+from django.utils.safestring import mark_safe
 from django.template.loader import get_template
 
 from . import widgets
+from ..utils.tag_values import parse_tag_filter_key, tag_value_filter, has_tags, TagFilterError
+from ..utils.tag_query import tag_query_filter
 
 _RE_TARGET = re.compile('^[A-Za-z0-9_-]*$')
 _RE_TARGET_FIRST = re.compile(r'^([A-Za-z0-9_-]+)__(.*)')
@@ -55,6 +64,36 @@ def _get_value(obj, target):
         return value
 
 
+class DataWidgetCell:
+    """One value of a data widget row (a field bound to an object)"""
+    __slots__ = ('field', 'object', 'value', 'output')
+
+    def __init__(self, field, obj, value, output):
+        self.field = field
+        self.object = obj
+        self.value = value
+        self.output = output
+
+    @property
+    def slug(self):
+        return self.field.slug
+
+    @property
+    def target(self):
+        return self.field.target
+
+    @property
+    def label(self):
+        return self.field.label
+
+    def __getitem__(self, key):
+        # cells used to be dicts
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+
 class DataWidgetField:
 
     def __init__(self, slug, target=None, label=None, sortable=False, queryable=(), output_widget=None):
@@ -73,6 +112,10 @@ class DataWidgetField:
     def prepare_queryset(self, queryset):
         return queryset
 
+    def prepare_objects(self, objects):
+        """Called with the list of objects on a page before get_value(), e.g., to prefetch related objects"""
+        pass
+
     def sort_by(self, queryset, ascending=True):
         if not self.sortable:
             return queryset
@@ -85,30 +128,29 @@ class DataWidgetField:
         else:
             return queryset.order_by(*previous_sort, '-' + str(self.target))
 
-    def get_values_iter(self, queryset, output_type=None):
-        target = self.target
+    def get_value(self, obj):
         try:
-            # TODO: this currently fails every time, because what's getting passed in is a page,
-            # not a queryset
-            value_qs = queryset.values_list(target, flat=True)
-            for obj, value in zip(queryset, value_qs):
-                yield self.bind(obj, value, output_type=output_type)
-        except (FieldError, AttributeError):
-            for obj in queryset:
-                try:
-                    yield self.bind(obj, _get_value(obj, target), output_type=output_type)
-                except Exception as e:
-                    yield self.bind(obj, None, output_type=output_type)
+            return _get_value(obj, self.target)
+        except Exception:
+            return None
+
+    def render_many(self, objects, values, output_type=None, context=None):
+        """
+        The outputs for values (of objects), rendered together. context contains information
+        about where the values are displayed (e.g., the project_id of the page).
+        """
+        return self.output_widget.render_many(values, output_type=output_type)
+
+    def get_values_iter(self, queryset, output_type=None, context=None):
+        objects = list(queryset)
+        self.prepare_objects(objects)
+        values = [self.get_value(obj) for obj in objects]
+        outputs = self.render_many(objects, values, output_type=output_type, context=context)
+        for obj, value, output in zip(objects, values, outputs):
+            yield DataWidgetCell(self, obj, value, output)
 
     def bind(self, obj, value, output_type=None):
-        return {
-            'object': obj,
-            'slug': self.slug,
-            'target': self.target,
-            'label': self.label,
-            'value': value,
-            'output': self.output_widget.render(value, output_type=output_type)
-        }
+        return DataWidgetCell(self, obj, value, self.render_many([obj], [value], output_type=output_type)[0])
 
 
 class ModelField(DataWidgetField):
@@ -127,14 +169,23 @@ class ModelLinkField(ModelField):
 
     def __init__(self, slug, **kwargs):
         self.link = kwargs.pop('link', slug + '__' + 'get_absolute_url')
+        # link(obj, project_id) used when the widget is displayed within a project
+        self.project_link = kwargs.pop('project_link', None)
         super().__init__(slug, **kwargs)
 
-    def bind(self, obj, value, output_type=None):
-        vals = super().bind(obj, value, output_type=None)
-        output = vals['output']
-        if output:
-            vals['output'] = format_html('<a href="{}">{}</a>', _get_value(obj, self.link), output)
-        return vals
+    def get_link(self, context=None):
+        project_id = context.get('project_id') if context else None
+        if project_id is not None and self.project_link is not None:
+            return lambda obj: self.project_link(obj, project_id)
+        return self.link
+
+    def render_many(self, objects, values, output_type=None, context=None):
+        outputs = super().render_many(objects, values, output_type=None, context=context)
+        link = self.get_link(context)
+        return [
+            format_html('<a href="{}">{}</a>', _get_value(obj, link), output) if output else output
+            for obj, output in zip(objects, outputs)
+        ]
 
 
 class TermField(DataWidgetField):
@@ -189,23 +240,118 @@ class TermField(DataWidgetField):
                 '-' + dummy_name
             )
 
-    def get_values_iter(self, queryset, output_type=None):
-        prefetch_related_objects(queryset, 'tags')
-        for obj in queryset:
-            tags = obj.tags.filter(key=self.term)
-            # TODO: support multiple tags
-            tag = tags[0] if tags else None
-            yield self.bind(obj, tag, output_type=output_type)
+    def prepare_objects(self, objects):
+        prefetch_related_objects(objects, 'tags')
 
-    def bind(self, obj, value, output_type=None):
-        return {
-            'object': obj,
-            'slug': self.slug,
-            'target': self.target,
-            'label': self.label,
-            'value': value,
-            'output': self.output_widget.render(value.value if value else None, output_type=output_type)
+    def get_value(self, obj):
+        # TODO: support multiple tags
+        for tag in obj.tags.all():
+            if tag.key_id == self.term.pk:
+                return tag
+        return None
+
+    def render_many(self, objects, values, output_type=None, context=None):
+        return self.output_widget.render_many(
+            [value.value if value else None for value in values],
+            output_type=output_type
+        )
+
+
+class AttachmentPreviewField(DataWidgetField):
+    """
+    Shows the thumbnail or text preview of an attachment. The preview information is annotated
+    onto the queryset so that rendering a page never opens the attachment files.
+    """
+
+    def __init__(self, slug='preview', **kwargs):
+        defaults = {
+            'label': 'Preview',
+            'sortable': False,
+            'queryable': ()
         }
+        defaults.update(**kwargs)
+        super().__init__(slug, **defaults)
+
+    def prepare_queryset(self, queryset):
+        previews = apps.get_model('lims', 'AttachmentPreview').objects.filter(file_hash=OuterRef('file_hash'))
+        return queryset.annotate(
+            preview_type=Subquery(previews.values('preview_type')[:1]),
+            preview_text=Subquery(previews.values('text')[:1])
+        )
+
+    def get_value(self, obj):
+        return getattr(obj, 'preview_type', None)
+
+    def render_many(self, objects, values, output_type=None, context=None):
+        outputs = []
+        for obj, value in zip(objects, values):
+            if value == 'image':
+                outputs.append(format_html(
+                    '<img class="attachment-thumbnail" src="{}" alt="{}"/>',
+                    reverse_lazy('lims:attachment_thumbnail', kwargs={'pk': obj.pk}),
+                    obj
+                ))
+            elif value == 'text':
+                outputs.append(format_html('<pre class="attachment-text-preview">{}</pre>', obj.preview_text))
+            else:
+                outputs.append('')
+        return outputs
+
+
+class DataWidgetSpec:
+    """
+    The compiled fields of a data widget: its columns, the targets used by the search box, the
+    query string filters it allows, and its sortable fields. Specs are shared by all requests (and
+    threads) in a process, so they are never modified after they are created.
+    """
+    __slots__ = ('declared_fields', 'context_fields', 'fields', 'filter_fields', 'search', 'use', 'sortable')
+
+    def __init__(self, declared_fields=(), context_fields=(), filter_fields=()):
+        fields = tuple(declared_fields) + tuple(context_fields)
+        sortable = OrderedDict()
+        for field in reversed(fields):
+            if field.sortable:
+                sortable[field.slug] = field
+
+        init = super().__setattr__
+        init('declared_fields', tuple(declared_fields))
+        init('context_fields', tuple(context_fields))
+        init('fields', fields)
+        init('filter_fields', tuple(filter_fields))
+        init('search', tuple(f.target for f in fields if f.queryable))
+        init('use', tuple('%s__%s' % (f.target, q) for f in fields for q in f.queryable) + tuple(filter_fields))
+        init('sortable', MappingProxyType(sortable))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('DataWidgetSpec objects cannot be modified')
+
+    def get_field(self, slug):
+        for field in self.fields:
+            if field.slug == slug:
+                return field
+        return None
+
+    def with_fields(self, extra_fields=(), exclude=()):
+        """A spec with extra_fields added after the declared fields, without the fields whose slug is in exclude"""
+        return DataWidgetSpec(
+            [f for f in self.declared_fields + tuple(extra_fields) if f.slug not in exclude],
+            [f for f in self.context_fields if f.slug not in exclude],
+            self.filter_fields
+        )
+
+
+def compile_data_widget(data_widget_class, in_project=False):
+    """The (validated) DataWidgetSpec for a data widget class, compiled once per process"""
+    return _compile_data_widget(data_widget_class, bool(in_project))
+
+
+@lru_cache(maxsize=None)
+def _compile_data_widget(data_widget_class, in_project):
+    declared_fields = tuple(data_widget_class.fields)
+    context_fields = tuple(data_widget_class.get_context_fields(in_project))
+    for field in declared_fields + context_fields:
+        field.validate()
+    return DataWidgetSpec(declared_fields, context_fields, data_widget_class.filter_fields)
 
 
 class DataWidget:
@@ -217,41 +363,46 @@ class DataWidget:
     paginator_template = 'lims/data_view/paginator.html'
     data_view_template = 'lims/data_view/data_view.html'
 
+    fields = ()
+    filter_fields = ()
+    # the query string filter that restricts objects to a project (if any)
+    project_filter = None
+
     def __init__(self, *extra_fields, name='default', actions=(), default_limit=10, max_limit=1000,
-                 default_order=('-modified', )):
+                 default_order=('-modified', ), exclude=()):
         self.name = str(name)
         self.actions = actions
         self.default_limit = default_limit
         self.default_order = default_order
         self.max_limit = max_limit
 
-        if hasattr(self, 'fields'):
-            fields = list(self.fields)
-        else:
-            fields = []
-
+        # the class fields are validated once, when the class is compiled
         for field in extra_fields:
-            fields.append(field)
-
-        for field in fields:
             field.validate()
+        self.extra_fields = tuple(extra_fields)
+        self.exclude = tuple(exclude)
 
-        if hasattr(self, 'filter_fields'):
-            filter_fields = list(self.filter_fields)
-        else:
-            filter_fields = []
+        self.spec = self.get_spec()
+        self.fields = self.spec.fields
+        self.filter_fields = self.spec.filter_fields
+
+    @classmethod
+    def get_context_fields(cls, in_project=False):
+        """Fields added after the declared and extra fields, depending on where the widget is displayed"""
+        return ()
 
-        self.fields = fields
-        self.filter_fields = filter_fields
+    def get_spec(self, in_project=False):
+        spec = compile_data_widget(type(self), in_project)
+        if self.extra_fields or self.exclude:
+            spec = spec.with_fields(self.extra_fields, exclude=self.exclude)
+        return spec
 
     def get_field(self, slug):
-        for field in self.fields:
-            if field.slug == slug:
-                return field
-        return None
+        return self.spec.get_field(slug)
 
-    def prepare_queryset(self, queryset, query_dict=None, user=None):
-        for field in self.fields:
+    def prepare_queryset(self, queryset, query_dict=None, user=None, spec=None, filter_fields=()):
+        spec = spec if spec is not None else self.spec
+        for field in spec.fields:
             queryset = field.prepare_queryset(queryset)
 
         return self._paginate(
@@ -259,26 +410,28 @@ class DataWidget:
                 self._filter(
                     queryset,
                     query_dict,
-                    user=user
+                    user=user,
+                    spec=spec,
+                    filter_fields=filter_fields
                 ),
                 query_dict,
-                user=user
+                user=user,
+                spec=spec
             ),
             query_dict,
             user=user
         )
 
-    def _filter(self, queryset, query_dict=None, user=None):
-        search = [f.target for f in self.fields if f.queryable]
-        use = ['%s__%s' % (f.target, q) for f in self.fields for q in f.queryable] + list(self.filter_fields)
+    def _filter(self, queryset, query_dict=None, user=None, spec=None, filter_fields=()):
+        spec = spec if spec is not None else self.spec
 
         return default_published_filter(
             filter_queryset_for_user(
                 query_string_filter(
                     queryset,
                     query_dict,
-                    search=search,
-                    use=use,
+                    search=spec.search,
+                    use=spec.use + tuple(filter_fields),
                     prefix=self.name + '_'
                 ),
                 user=user,
@@ -296,7 +449,8 @@ class DataWidget:
             max_limit=self.max_limit
         )
 
-    def _order(self, queryset, query_dict, user=None):
+    def _order(self, queryset, query_dict, user=None, spec=None):
+        spec = spec if spec is not None else self.spec
         if query_dict is None:
             return queryset.order_by(*self.default_order)
         else:
@@ -306,7 +460,7 @@ class DataWidget:
                 return queryset.order_by(*self.default_order)
 
             order_slugs = [re.sub('^-', '', o) for o in order_values]
-            order_fields = [self.get_field(slug) for slug in order_slugs]
+            order_fields = [spec.sortable.get(slug) for slug in order_slugs]
             for field, order_val in zip(order_fields, order_values):
                 if field:
                     ascending = re.match('^-', order_val) is None
@@ -314,37 +468,79 @@ class DataWidget:
 
         return queryset
 
-    def columns(self, queryset, output_type=None):
-        for field in self.fields:
-            yield field.get_values_iter(queryset, output_type=output_type)
-
-    def rows(self, queryset, output_type=None):
-        for row in zip(*self.columns(queryset, output_type=output_type)):
-            yield tuple(row)
+    def columns(self, queryset, output_type=None, spec=None, context=None):
+        spec = spec if spec is not None else self.spec
+        for field in spec.fields:
+            yield field.get_values_iter(queryset, output_type=output_type, context=context)
+
+    def rows(self, queryset, output_type=None, spec=None, context=None):
+        """
+        Rows of DataWidgetCells for the objects in queryset. The objects are iterated over once to
+        get the values of all fields, and then the outputs for each field are rendered together.
+        """
+        objects = list(queryset)
+        if not objects:
+            return
+        fields = (spec if spec is not None else self.spec).fields
+        for field in fields:
+            field.prepare_objects(objects)
+
+        values = [[field.get_value(obj) for field in fields] for obj in objects]
+        outputs = [
+            field.render_many(objects, column, output_type=output_type, context=context)
+            for field, column in zip(fields, zip(*values))
+        ]
+
+        for i, (obj, row_values) in enumerate(zip(objects, values)):
+            yield tuple(
+                DataWidgetCell(field, obj, value, field_outputs[i])
+                for field, value, field_outputs in zip(fields, row_values, outputs)
+            )
 
-    def bind(self, queryset, request, output_type=None, **kwargs):
-        return BoundDataWidget(self, queryset, request, output_type, **kwargs)
+    def bind(self, queryset, request, output_type=None, project_id=None, **kwargs):
+        return BoundDataWidget(
+            self, queryset, request, output_type,
+            spec=self.get_spec(in_project=project_id is not None),
+            project_id=project_id,
+            **kwargs
+        )
 
 
 class BoundDataWidget:
 
-    def __init__(self, dv, queryset, request, output_type=None, url='', context=None, **kwargs):
+    def __init__(self, dv, queryset, request, output_type=None, url='', context=None, spec=None, project_id=None,
+                 selection_data_widget='', **kwargs):
         self.dv = dv
+        self.spec = spec if spec is not None else dv.spec
         self.output_type = output_type
+        self.project_id = project_id
         self.query_dict = request.GET.copy()
+        # filters for this request (e.g., parent_id), which are allowed in addition to the spec's filter_fields
+        self.filter_fields = []
+        if project_id is not None and dv.project_filter:
+            kwargs[dv.project_filter] = project_id
         for key, value in kwargs.items():
             if value:
-                dv.filter_fields.append(key)
+                self.filter_fields.append(key)
                 self.query_dict[dv.name + '_' + key] = value
         self.model = queryset.model
         self.model_name = self.model.__name__
+        self.has_tags = has_tags(self.model)
         self.request = request
         self.url = url
         self.context = context if context is not None else {}
-        self.page = dv.prepare_queryset(queryset, self.query_dict, self.request.user)
+        # where actions return to (the page containing the widget, if it was loaded separately)
+        self.return_url = self.context.get('return_url') or request.get_full_path()
+        self.queryset = queryset
+        self._filter_error = ''
+        self._rows = None
 
         self.name = dv.name
-        self.fields = list(dv.fields)
+        self.data_widget_class = type(dv).__name__
+        # the registered data widget that lists the same objects as this one from filter_query_string()
+        # alone (i.e., queryset is all objects of the model), if "select all" is available
+        self.selection_data_widget = selection_data_widget
+        self.fields = self.spec.fields
         self.actions = list(dv.actions)
 
         # copy templates to bound view
@@ -352,10 +548,47 @@ class BoundDataWidget:
             if attr.endswith('_template'):
                 setattr(self, attr, getattr(dv, attr))
 
+    @cached_property
+    def page(self):
+        try:
+            return self.dv.prepare_queryset(
+                self.queryset, self.query_dict, self.request.user, spec=self.spec, filter_fields=self.filter_fields
+            )
+        except TagFilterError as e:
+            # show the error instead of the objects that the filter would have selected
+            self._filter_error = str(e)
+            query_dict = self.query_dict.copy()
+            query_dict.pop(self.dv.name + '_filter', None)
+            return self.dv.prepare_queryset(
+                self.queryset.none(), query_dict, self.request.user, spec=self.spec, filter_fields=self.filter_fields
+            )
+
+    def filtered_queryset(self):
+        """The objects that match the filters of this widget (on all pages), raises TagFilterError"""
+        return self.dv._filter(
+            self.queryset, self.query_dict, self.request.user, spec=self.spec, filter_fields=self.filter_fields
+        )
+
+    @property
+    def filter_error(self):
+        self.page
+        return self._filter_error
+
+    def evaluate(self):
+        """
+        Runs the queries for this widget (the count, the objects on the page, and any queries
+        needed by the fields) so that it can be rendered without touching the database
+        """
+        page = self.page
+        page.paginator.count
+        page.object_list = list(page.object_list)
+        self._rows = list(self.rows())
+        return self
+
     def header_links(self):
         sort_var = self.dv.name + '_order_variable'
         current_sort = self.query_dict.getlist(sort_var, [])
-        for field in self.dv.fields:
+        for field in self.fields:
             if field.sortable:
                 qd = self.query_dict.copy()
                 cls = ''
@@ -376,16 +609,53 @@ class BoundDataWidget:
             else:
                 yield field.label
 
+    def filter_query_string(self):
+        """The query string items for this widget, without the widget name prefix (used for selection sets)"""
+        prefix = self.dv.name + '_'
+        qd = QueryDict(mutable=True)
+        for key in self.query_dict:
+            if key.startswith(prefix):
+                qd.setlist(key[len(prefix):], self.query_dict.getlist(key))
+        return qd.urlencode()
+
+    def tag_filter(self):
+        return self.query_dict.get(self.dv.name + '_filter', '')
+
     def get_context(self):
         context = self.context.copy()
         context.update({'dv': self})
         return context
 
     def rows(self):
-        return self.dv.rows(self.page, output_type=self.output_type)
+        if self._rows is not None:
+            return iter(self._rows)
+        return self.dv.rows(self.page, output_type=self.output_type, spec=self.spec, context=self.render_context())
 
     def columns(self):
-        return self.dv.columns(self.page, output_type=self.output_type)
+        return self.dv.columns(self.page, output_type=self.output_type, spec=self.spec, context=self.render_context())
+
+    def render_context(self):
+        return {'project_id': self.project_id}
+
+    def rows_html(self):
+        """The <tr> elements for rows(), rendered without a template for each cell"""
+        name = conditional_escape(self.name)
+        cell_start = [
+            format_html('<td class="dv-{}-{}">', self.name, str(field.target)) for field in self.fields
+        ]
+        html = []
+        for row in self.rows():
+            if not row:
+                continue
+            obj = row[0].object
+            html.append(format_html(
+                '<tr id="dv-{0}-{1}" class="dv-{0}">\n<td>\n'
+                '<input title="Select {2}" type="checkbox" name="object-{1}-selected"/>\n</td>',
+                name, obj.pk, obj
+            ))
+            html.extend(start + conditional_escape(cell.output) + '</td>' for start, cell in zip(cell_start, row))
+            html.append('</tr>')
+        return mark_safe('\n'.join(html))
 
     def as_table(self):
         return get_template(self.dv.table_template).render(self.get_context())
@@ -406,34 +676,31 @@ class BoundDataWidget:
         return self.as_widget()
 
 
-class BaseObjectDataWidget(DataWidget):
-    filter_fields = ['project_id']
+def user_link(obj):
+    return reverse_lazy('lims:user_detail', kwargs={'pk': obj.user_id})
 
-    def bind(self, queryset, request, output_type=None, project_id=None, **kwargs):
 
-        # need to assign project context to link fields
-        if project_id is not None:
-            for field in self.fields:
-                if field.target == 'user':
-                    field.link = lambda obj: reverse_lazy(
-                        'lims:project_user_detail',
-                        kwargs={'project_id': project_id, 'pk': obj.user.pk}
-                    )
-        else:
-            # add a project field
-            self.fields = self.fields + [ModelLinkField(slug='project', label='Project'), ]
+def project_user_link(obj, project_id):
+    return reverse_lazy('lims:project_user_detail', kwargs={'project_id': project_id, 'pk': obj.user_id})
 
-        return super().bind(queryset, request, output_type, project_id=project_id, **kwargs)
+
+class BaseObjectDataWidget(DataWidget):
+    filter_fields = ['project_id']
+    project_filter = 'project_id'
+    project_field = ModelLinkField(slug='project', label='Project')
+
+    @classmethod
+    def get_context_fields(cls, in_project=False):
+        # objects from more than one project need a project column
+        return () if in_project else (cls.project_field, )
 
 
 class SampleDataWidget(BaseObjectDataWidget):
+    filter_fields = ['project_id', 'user_id', 'parent_id', 'attachments']
     fields = [
         ModelLinkField(slug='slug', label='ID', link='get_absolute_url'),
         ModelField(slug='name', label='Name'),
-        ModelLinkField(
-            slug='user', label='User',
-            link=lambda obj: reverse_lazy('lims:user_detail', kwargs={'pk': obj.user.pk})
-        ),
+        ModelLinkField(slug='user', label='User', link=user_link, project_link=project_user_link),
         ModelField(slug='collected', label='Collected'),
         ModelField(slug='status', label='Status'),
         ModelField(slug='modified', label='Modified')
@@ -445,27 +712,23 @@ class TermDataWidget(BaseObjectDataWidget):
         ModelLinkField(slug='slug', label='ID', link='get_absolute_url'),
         ModelField(slug='name', label='Name'),
         ModelField(slug='taxonomy', label='Taxonomy'),
-        ModelLinkField(
-            slug='user', label='User',
-            link=lambda obj: reverse_lazy('lims:user_detail', kwargs={'pk': obj.user.pk})
-        ),
+        ModelLinkField(slug='user', label='User', link=user_link, project_link=project_user_link),
         ModelField(slug='status', label='Status'),
         ModelField(slug='modified', label='Modified')
     ]
 
 
 class AttachmentDataWidget(BaseObjectDataWidget):
+    filter_fields = ['project_id', 'user_id', 'samples']
     fields = [
         ModelLinkField(slug='slug', label='ID', link='get_absolute_url'),
         ModelField(slug='name', label='Name'),
-        ModelLinkField(
-            slug='user', label='User',
-            link=lambda obj: reverse_lazy('lims:user_detail', kwargs={'pk': obj.user.pk})
-        ),
+        ModelLinkField(slug='user', label='User', link=user_link, project_link=project_user_link),
         ModelLinkField(
             slug='file__name', label='File Name', sortable=False, queryable=[],
             link=lambda obj: reverse_lazy('lims:attachment_download', kwargs={'pk': obj.pk})
         ),
+        AttachmentPreviewField(),
         ModelField(slug='modified', label='Modified'),
     ]
 
@@ -474,41 +737,22 @@ class ProjectDataWidget(DataWidget):
     fields = [
         ModelLinkField(slug='slug', label='ID', link='get_absolute_url'),
         ModelField(slug='name', label='Name'),
-        ModelLinkField(
-            slug='user', label='User',
-            link=lambda obj: reverse_lazy('lims:user_detail', kwargs={'pk': obj.user.pk})
-        ),
+        ModelLinkField(slug='user', label='User', link=user_link, project_link=project_user_link),
         ModelField(slug='modified', label='Modified'),
     ]
 
 
 class TagDataWidget(DataWidget):
+    filter_fields = ['object_id', 'key__taxonomy']
     fields = [
         ModelLinkField(slug='object', label='Object', link='object__get_absolute_url'),
         ModelLinkField(slug='key', label='Term', link='key__get_absolute_url'),
         ModelField(slug='value', label='Value'),
         ModelField(slug='numeric_value', label='Numeric Value'),
-        ModelLinkField(
-            slug='user', label='User',
-            link=lambda obj: reverse_lazy('lims:user_detail', kwargs={'pk': obj.user.pk})
-        ),
+        ModelLinkField(slug='user', label='User', link=user_link, project_link=project_user_link),
         ModelField(slug='modified', label='Modified')
     ]
 
-    def bind(self, queryset, request, output_type=None, project_id=None, **kwargs):
-
-        # need to assign project context
-        if project_id is not None:
-            for field in self.fields:
-                if field.target == 'user':
-                    field.link = lambda obj: reverse_lazy(
-                        'lims:project_user_detail',
-                        kwargs={'project_id': project_id, 'pk': obj.user.pk}
-                    )
-
-        # not passing along project information to the super
-        return super().bind(queryset, request, output_type, **kwargs)
-
 
 def get_widget_class(model):
     if isinstance(model, type):
@@ -629,10 +873,11 @@ def query_string_filter(queryset, query_dict, use=(), search=(), search_func="ic
             if prefix_re.match(key):
                 # make sure key is actually queryable
                 field_key = prefix_re.sub('', key)
-                try:
-                    queryset.model._meta.get_field(field_key)
-                except Exception:
-                    continue
+                if field_key != 'filter' and parse_tag_filter_key(field_key) is None:
+                    try:
+                        queryset.model._meta.get_field(field_key.split('__')[0])
+                    except Exception:
+                        continue
 
                 q.setlist(field_key, query_dict.getlist(key))
     else:
@@ -650,8 +895,26 @@ def query_string_filter(queryset, query_dict, use=(), search=(), search_func="ic
                 final_q = Q(**search_query) | final_q
         queryset = queryset.filter(final_q)
 
+    # tag filter expression (e.g., t.depth_cm>10 and t.lake="Bedford"), raises TagFilterError
+    tag_filters = has_tags(queryset.model)
+    tag_query = q.get('filter', '').strip()
+    if tag_query and tag_filters:
+        queryset = tag_query_filter(queryset, tag_query)
+
     for key in q:
-        if key in use:
+        tag_filter = parse_tag_filter_key(key) if tag_filters else None
+        if tag_filter is not None:
+            # tag__<term slug>__<lookup>=value filters on the typed tag value columns
+            slug, lookup = tag_filter
+            for value in q.getlist(key):
+                if not value:
+                    continue
+                try:
+                    queryset = tag_value_filter(queryset, slug, lookup, value)
+                except TagFilterError:
+                    # ignore values that can't be compared using lookup
+                    pass
+        elif key in use:
             # make sure to ignore empty items! they cause errors
             value = q.getlist(key)
             if len(value) == 1:
@@ -690,3 +953,41 @@ def default_published_filter(queryset, user):
         return queryset.filter(Q(object__status='published') | (Q(object__user=user) & Q(object__status='draft')))
     else:
         return queryset.filter(Q(status='published') | (Q(user=user) & Q(status='draft')))
+
+
+def can_evaluate_concurrently():
+    """
+    Queries can only be run on separate connections if they can see the same data: not from within
+    a transaction (whose uncommitted changes are only visible on its own connection) and not
+    using an in-memory SQLite database (which is private to a connection)
+    """
+    for connection in connections.all():
+        if connection.in_atomic_block:
+            return False
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            return False
+    return True
+
+
+def _evaluate_in_thread(bound_widget):
+    try:
+        return bound_widget.evaluate()
+    finally:
+        # connections are per-thread, so close the ones this worker opened
+        connections.close_all()
+
+
+def evaluate_bound_widgets(bound_widgets, max_workers=4):
+    """
+    Evaluates independent BoundDataWidgets on a bounded thread pool (each worker using its own
+    database connection) so that the round trips for a page with several tables overlap. Falls back
+    to evaluating them one after another when this isn't safe or wouldn't help.
+    """
+    bound_widgets = list(bound_widgets)
+    if max_workers > 1 and len(bound_widgets) > 1 and can_evaluate_concurrently():
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(bound_widgets))) as executor:
+            list(executor.map(_evaluate_in_thread, bound_widgets))
+    else:
+        for bound_widget in bound_widgets:
+            bound_widget.evaluate()
+    return bound_widgets
@@ -120,14 +120,23 @@ class OutputWidget(metaclass=django_forms.MediaDefiningClass):
     def render(self, instance, output_type=None):
         raise NotImplementedError()
 
+    def render_many(self, instances, output_type=None):
+        return [self.render(instance, output_type=output_type) for instance in instances]
+
 
 @register_output_widget
 class EmptyOutput(OutputWidget):
     def render(self, instance, output_type=None):
         return ''
 
+    def render_many(self, instances, output_type=None):
+        return [''] * len(instances)
+
 
 @register_output_widget
 class IdentityOutput(OutputWidget):
     def render(self, instance, output_type=None):
         return instance if instance else ''
+
+    def render_many(self, instances, output_type=None):
+        return [instance if instance else '' for instance in instances]
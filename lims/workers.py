@@ -0,0 +1,21 @@
+# this module is imported by spawned worker processes before Django is set up, so it must not
+# import anything that requires the app registry (e.g., models)
+
+_in_worker = False
+
+
+def setup_worker():
+    """Initializes a (spawned) worker process so that it can run jobs"""
+    global _in_worker
+    _in_worker = True
+
+    import django
+    django.setup()
+
+    # job functions are registered when the views are imported
+    from . import views  # noqa: F401
+
+
+def in_worker():
+    """True in a worker process started with setup_worker(), which shouldn't start a process pool of its own"""
+    return _in_worker